@@ -31,7 +31,10 @@ except Exception as e:
 # --- Import Django Models (After django.setup()) ---
 try:
     from sensor_api.models import SensorData
-    from django.db.models import Avg, Max, Min
+    from sensor_api.rollups import aggregate_range, find_extreme_reading
+    from sensor_api.serializers import serialize_rows
+    from sensor_api.conditional import read_validator
+    from sensor_api.snapshot import current_sensor_state
     # Import User and IssueReport models
     from django.contrib.auth.models import User
     from accounts.models import IssueReport, UserProfile
@@ -53,38 +56,43 @@ print("MCP Server for Sensor Data configured for SSE...")
 # Define sync functions to be wrapped by sync_to_async for clarity
 @sync_to_async
 def _get_latest_sensor_data_sync():
-    return SensorData.objects.order_by('-timestamp').first()
+    # Kept in memory; each call only checks for rows stored since the previous one
+    return current_sensor_state().latest
+
+@sync_to_async
+def _get_etag_sync(key, window=None):
+    # Two index lookups; lets the summary tools skip aggregation when nothing changed
+    return read_validator(key, window=window).etag
+
+def _not_modified(etag):
+    return {"not_modified": True, "etag": etag, "message": "No change since the previous call with this etag."}
 
 @sync_to_async
 def _get_sensor_data_summary_sync(start_time, end_time):
-    query = SensorData.objects.filter(timestamp__gte=start_time, timestamp__lte=end_time)
-    summary = query.aggregate(
-        avg_temp=Avg('temperature'), min_temp=Min('temperature'), max_temp=Max('temperature'),
-        avg_humidity=Avg('humidity'), min_humidity=Min('humidity'), max_humidity=Max('humidity'),
-        avg_co2=Avg('co2'), min_co2=Min('co2'), max_co2=Max('co2'),
-        avg_pm25=Avg('pm2_5'), min_pm25=Min('pm2_5'), max_pm25=Max('pm2_5')
-    )
-    count = query.count()
-    return summary, count
+    # Read whole buckets from the rollup tables and only the partial edges from raw rows
+    stats = aggregate_range(start_time, end_time, metrics=['temperature', 'humidity', 'co2', 'pm2_5'])
+    summary = {}
+    for metric, name in (('temperature', 'temp'), ('humidity', 'humidity'), ('co2', 'co2'), ('pm2_5', 'pm25')):
+        for stat in ('avg', 'min', 'max'):
+            summary[f'{stat}_{name}'] = stats[f'{stat}_{metric}']
+    return summary, stats['count']
+
+# Field order of the data points returned by the range tools
+RANGE_FIELDS = ('timestamp', 'temperature', 'humidity', 'co2', 'pm1_0', 'pm2_5', 'pm10_0')
 
 @sync_to_async
 def _get_sensor_data_in_range_sync(start_time, end_time):
     query = SensorData.objects.filter(timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-    return list(query.values(
-        'timestamp', 'temperature', 'humidity', 'co2', 'pm1_0', 'pm2_5', 'pm10_0'
-    ))
+    # Plain dicts with ISO 8601 timestamps, built from values_list in one pass
+    return serialize_rows(query, RANGE_FIELDS, local_time=False)
 
 @sync_to_async
 def _get_extreme_sensor_value_sync(sensor_type, start_time, end_time):
-    query = SensorData.objects.filter(
-        timestamp__gte=start_time, 
-        timestamp__lte=end_time,
-        **{f'{sensor_type}__isnull': False}
-    )
-    min_record = query.order_by(sensor_type).first()
-    max_record = query.order_by(f'-{sensor_type}').first()
-    count = query.count()
-    return min_record, max_record, count
+    # Extremes and count come from the rollups; the matching rows are located bucket by bucket
+    stats = aggregate_range(start_time, end_time, metrics=[sensor_type])
+    min_record = find_extreme_reading(sensor_type, start_time, end_time, 'min', stats[f'min_{sensor_type}'])
+    max_record = find_extreme_reading(sensor_type, start_time, end_time, 'max', stats[f'max_{sensor_type}'])
+    return min_record, max_record, stats['count']
 
 @sync_to_async
 def _count_sensor_data_points_sync(start_time, end_time):
@@ -95,9 +103,7 @@ def _get_recent_sensor_data_sync(period_hours):
     end_time = django_timezone.now()
     start_time = end_time - timedelta(hours=period_hours)
     query = SensorData.objects.filter(timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-    return list(query.values(
-        'timestamp', 'temperature', 'humidity', 'co2', 'pm1_0', 'pm2_5', 'pm10_0'
-    )), start_time, end_time
+    return serialize_rows(query, RANGE_FIELDS, local_time=False), start_time, end_time
 
 @sync_to_async
 def _read_system_info_sync():
@@ -257,12 +263,13 @@ async def get_latest_sensor_data() -> dict[str, Any]:
         return {"error": str(e)}
 
 @mcp.tool()
-async def get_sensor_data_summary(start_time_iso: str, end_time_iso: str) -> dict[str, Any]:
+async def get_sensor_data_summary(start_time_iso: str, end_time_iso: str, etag: Optional[str] = None) -> dict[str, Any]:
     """Calculates summary statistics (avg, min, max) for sensor data within a specified time range.
 
     Args:
         start_time_iso: The start timestamp in ISO 8601 format with timezone (e.g., '2023-10-27T10:00:00Z' or '2023-10-27T18:00:00+08:00'). REQUIRED with timezone info.
         end_time_iso: The end timestamp in ISO 8601 format with timezone (e.g., '2023-10-27T12:00:00Z' or '2023-10-27T20:00:00+08:00'). REQUIRED with timezone info.
+        etag: Optional. The etag returned by a previous call with the same arguments; if the result would be unchanged, only {"not_modified": true, "etag": ...} is returned.
     
     Note: Timestamps without timezone info will be rejected. All returned timestamps include timezone info."""
     try:
@@ -286,6 +293,10 @@ async def get_sensor_data_summary(start_time_iso: str, end_time_iso: str) -> dic
         
         print(f"Executing get_sensor_data_summary from {start_time.isoformat()} to {end_time.isoformat()}...")
 
+        current_etag = await _get_etag_sync(('summary', start_time.isoformat(), end_time.isoformat()))
+        if etag == current_etag:
+            return _not_modified(current_etag)
+
         summary, count = await _get_sensor_data_summary_sync(start_time, end_time)
         
         serializable_summary = {k: v if v is not None else None for k, v in summary.items()}
@@ -299,10 +310,11 @@ async def get_sensor_data_summary(start_time_iso: str, end_time_iso: str) -> dic
                 "end_time": end_time.isoformat(),
                 "period_hours": round(period_hours, 2),
                 "data_points": count,
-                "summary": serializable_summary
+                "summary": serializable_summary,
+                "etag": current_etag
             }
         else:
-            return {"message": f"No sensor data found between {start_time.isoformat()} and {end_time.isoformat()}."}
+            return {"message": f"No sensor data found between {start_time.isoformat()} and {end_time.isoformat()}.", "etag": current_etag}
     except Exception as e:
         print(f"Error in get_sensor_data_summary: {e}")
         return {"error": str(e)}
@@ -333,10 +345,6 @@ async def get_sensor_data_in_range(start_time_iso: str, end_time_iso: str) -> di
         data_points = await _get_sensor_data_in_range_sync(start_time, end_time)
         count = len(data_points)
 
-        # Convert datetime objects to ISO strings for JSON serialization
-        for point in data_points:
-            point['timestamp'] = point['timestamp'].isoformat()
-            
         return {
             "start_time": start_time_iso,
             "end_time": end_time_iso,
@@ -348,12 +356,13 @@ async def get_sensor_data_in_range(start_time_iso: str, end_time_iso: str) -> di
         return {"error": str(e)}
 
 @mcp.tool()
-async def get_extreme_sensor_value(sensor_type: str, period_hours: int = 24) -> dict[str, Any]:
+async def get_extreme_sensor_value(sensor_type: str, period_hours: int = 24, etag: Optional[str] = None) -> dict[str, Any]:
     """Finds the minimum and maximum value for a specific sensor type within a given period.
 
     Args:
         sensor_type: The sensor field name (e.g., 'temperature', 'humidity', 'co2', 'pm2_5').
         period_hours: The duration in hours to look back from current server time (default: 24).
+        etag: Optional. The etag returned by a previous call with the same arguments; if the result would be unchanged, only {"not_modified": true, "etag": ...} is returned.
     
     Note: The period is calculated from server's current time. All returned timestamps include timezone information."""
     print(f"Executing get_extreme_sensor_value for '{sensor_type}' in the last {period_hours} hours...")
@@ -367,6 +376,10 @@ async def get_extreme_sensor_value(sensor_type: str, period_hours: int = 24) ->
         end_time = django_timezone.now()
         start_time = end_time - timedelta(hours=period_hours)
 
+        current_etag = await _get_etag_sync(('extreme', sensor_type, period_hours), timedelta(hours=period_hours))
+        if etag == current_etag:
+            return _not_modified(current_etag)
+
         min_record, max_record, count = await _get_extreme_sensor_value_sync(sensor_type, start_time, end_time)
 
         result = {
@@ -374,7 +387,8 @@ async def get_extreme_sensor_value(sensor_type: str, period_hours: int = 24) ->
             "period_hours": period_hours,
             "data_points_considered": count,
             "minimum": None,
-            "maximum": None
+            "maximum": None,
+            "etag": current_etag
         }
 
         if min_record:
@@ -413,10 +427,6 @@ async def get_recent_sensor_data(period_hours: int = 1) -> dict[str, Any]:
         data_points, start_time, end_time = await _get_recent_sensor_data_sync(period_hours)
         count = len(data_points)
 
-        # Convert datetime objects to ISO strings for JSON serialization
-        for point in data_points:
-            point['timestamp'] = point['timestamp'].isoformat()
-            
         return {
             "period_hours": period_hours,
             "calculated_start_time": start_time.isoformat(),
@@ -429,11 +439,12 @@ async def get_recent_sensor_data(period_hours: int = 1) -> dict[str, Any]:
         return {"error": str(e)}
 
 @mcp.tool()
-async def count_sensor_data_points(period_hours: int = 24) -> dict[str, Any]:
+async def count_sensor_data_points(period_hours: int = 24, etag: Optional[str] = None) -> dict[str, Any]:
     """Counts the number of sensor data points recorded within a specified period.
     
     Args:
         period_hours: The duration in hours to look back from current server time (default: 24).
+        etag: Optional. The etag returned by a previous call with the same arguments; if the result would be unchanged, only {"not_modified": true, "etag": ...} is returned.
     
     Note: The period is calculated from server's current time. All returned timestamps include timezone information."""
     print(f"Executing count_sensor_data_points for the last {period_hours} hours...")
@@ -441,13 +452,18 @@ async def count_sensor_data_points(period_hours: int = 24) -> dict[str, Any]:
         end_time = django_timezone.now()
         start_time = end_time - timedelta(hours=period_hours)
         
+        current_etag = await _get_etag_sync(('count', period_hours), timedelta(hours=period_hours))
+        if etag == current_etag:
+            return _not_modified(current_etag)
+        
         count = await _count_sensor_data_points_sync(start_time, end_time)
         
         return {
             "period_hours": period_hours,
             "data_points_count": count,
             "start_time": start_time.isoformat(),
-            "end_time": end_time.isoformat()
+            "end_time": end_time.isoformat(),
+            "etag": current_etag
         }
     except Exception as e:
         print(f"Error in count_sensor_data_points: {e}")
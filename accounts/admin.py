@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, IssueReport
+from .models import UserProfile, IssueReport, AlertEmail, AlertState
 
 # Define an inline admin descriptor for UserProfile model
 # which acts a bit like a singleton
@@ -51,3 +51,18 @@ class IssueReportAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(AlertEmail)
+class AlertEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipient', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'metric', 'created_at')
+    search_fields = ('recipient', 'subject', 'user__username')
+    readonly_fields = ('user', 'created_at', 'sent_at', 'claimed_by', 'claimed_at', 'last_error')
+
+
+@admin.register(AlertState)
+class AlertStateAdmin(admin.ModelAdmin):
+    list_display = ('user', 'metric', 'status', 'value', 'threshold', 'started_at', 'notified_at', 'suppressed')
+    list_filter = ('status', 'metric')
+    search_fields = ('user__username',)
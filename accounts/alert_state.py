@@ -0,0 +1,310 @@
+"""
+Alert state per user and metric: debouncing, hysteresis, cooldown and digests
+
+Raw threshold violations from the AlertEngine are not notified one by one.
+Every (user, metric) pair moves through clear -> pending -> open -> clear:
+
+- pending: the first violating reading starts an episode. It only opens once
+  the metric has stayed beyond the threshold for MIN_DURATION_S (reading time).
+- open: the alert is notified once.
+- Either ends when the value is back inside the threshold by the metric's
+  HYSTERESIS band (e.g. CO2 at or below co2_max - 50 ppm), so a value hovering
+  around the threshold neither restarts the minimum duration nor flaps.
+- cooldown: an alert that opens again within COOLDOWN_S of its last
+  notification is counted but not notified again.
+- digest: a user gets at most one email per DIGEST_S. The first alert goes
+  out immediately; alerts opening during the window are queued and sent
+  together as one digest when it ends.
+
+The state is kept in memory, so a reading costs a dict lookup per violation
+plus a check of the pairs that are currently pending or open. Changes are
+written to AlertState at most every PERSIST_INTERVAL_S and loaded back on
+first use after a restart. A write that fails is retried with the next one.
+Queued digests are released by the first evaluation after their window ends.
+
+The tracker is per process and assumes a single one evaluates alerts. With
+several workers (gunicorn, uvicorn --workers) each loads AlertState on its own,
+tracks only the readings it ingested and overwrites the rows of the others, so
+alerts are notified more than once and episodes, cooldowns and digests are lost.
+Run one worker, or evaluate alerts in a single dedicated process.
+"""
+import atexit
+import logging
+import threading
+import time
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .alerts import Alert, get_alert_settings
+from .models import AlertState
+
+logger = logging.getLogger(__name__)
+
+CLEAR = 'clear'
+PENDING = 'pending'
+OPEN = 'open'
+
+# Fields of AlertState mirrored by TrackedAlert
+STATE_FIELDS = ('status', 'direction', 'threshold', 'value', 'peak', 'readings', 'started_at',
+                'opened_at', 'queued', 'notified_at', 'suppressed')
+
+
+class TrackedAlert:
+    """In-memory alert state of one (user, metric) pair"""
+
+    def __init__(self, user_id, metric, username='', email='', **fields):
+        self.user_id = user_id
+        self.metric = metric
+        self.username = username
+        self.email = email
+        self.status = CLEAR
+        self.direction = ''
+        self.threshold = None
+        self.value = None
+        self.peak = None
+        self.readings = 0
+        self.started_at = None
+        self.opened_at = None
+        self.queued = False
+        self.notified_at = None
+        self.suppressed = 0
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @property
+    def key(self):
+        return self.user_id, self.metric
+
+    def start(self, alert, timestamp):
+        """Begin a new episode with a violating reading"""
+        self.status = PENDING
+        self.direction = alert.direction
+        self.threshold = alert.threshold
+        self.value = self.peak = alert.value
+        self.readings = 1
+        self.started_at = timestamp
+        self.opened_at = None
+        self.username, self.email = alert.username, alert.email
+
+    def update(self, alert):
+        """Another violating reading in the current episode"""
+        self.readings += 1
+        self.value = alert.value
+        self.threshold = alert.threshold
+        worse = max if self.direction == 'above' else min
+        self.peak = worse(self.peak, alert.value)
+        self.username, self.email = alert.username, alert.email
+
+    def recovered(self, value, band):
+        """Whether `value` is back inside the threshold by at least `band`"""
+        if self.direction == 'above':
+            return value <= self.threshold - band
+        return value >= self.threshold + band
+
+    def to_alert(self):
+        alert = Alert(self.user_id, self.username, self.email, self.metric, self.value, self.threshold,
+                      self.direction, self.opened_at, None)
+        alert.peak = self.peak
+        alert.since = self.started_at
+        alert.readings = self.readings
+        alert.suppressed = self.suppressed
+        return alert
+
+    def to_record(self):
+        return AlertState(user_id=self.user_id, metric=self.metric,
+                          **{name: getattr(self, name) for name in STATE_FIELDS})
+
+
+class AlertTracker:
+    """Turns the raw violations of each reading into the alerts to notify"""
+
+    def __init__(self, config=None, clock=timezone.now):
+        config = config or get_alert_settings()
+        self.min_duration = config['MIN_DURATION_S']
+        self.hysteresis = config['HYSTERESIS']
+        self.cooldown = config['COOLDOWN_S']
+        self.digest = config['DIGEST_S']
+        self.persist_interval = config['PERSIST_INTERVAL_S']
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Held from taking changes until they are written, so writes land in the order taken
+        self._write_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._states = {}
+        self._active = set()      # Keys of pending/open pairs
+        self._waiting = {}        # user_id -> keys queued for the user's next email
+        self._last_email = {}     # user_id -> when the user was last notified
+        self._dirty = set()
+        self._deleted = set()
+        self._loaded = False
+        self._last_persist = None
+
+    def clear(self):
+        """Forget the in-memory state; it is loaded again from the database on next use"""
+        with self._lock:
+            self._reset()
+
+    def process(self, observed):
+        """
+        observed: (reading, values, violations) for each reading, as returned by
+        AlertEngine.observe. Returns the alerts to notify now; several alerts
+        for the same user are meant to be sent as one digest.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            for reading, values, violations in observed:
+                self._observe(reading.timestamp, values, violations)
+            released = self._release_due()
+        self._persist()
+        return released
+
+    def flush(self):
+        """Write all pending changes to the database now"""
+        self._persist(force=True)
+
+    def _persist(self, force=False):
+        # A due write while another is in progress is left to the next evaluation
+        if not self._write_lock.acquire(blocking=force):
+            return
+        try:
+            with self._lock:
+                changes = self._take_changes(force=force)
+            if changes:
+                self._write(*changes)
+        finally:
+            self._write_lock.release()
+
+    def _load(self):
+        for record in AlertState.objects.select_related('user'):
+            state = TrackedAlert(record.user_id, record.metric, record.user.username, record.user.email,
+                                 **{name: getattr(record, name) for name in STATE_FIELDS})
+            self._states[state.key] = state
+            if state.status != CLEAR:
+                self._active.add(state.key)
+            if state.queued:
+                self._waiting.setdefault(state.user_id, set()).add(state.key)
+            if state.notified_at is not None:
+                last = self._last_email.get(state.user_id)
+                self._last_email[state.user_id] = state.notified_at if last is None else max(last, state.notified_at)
+        self._loaded = True
+
+    def _observe(self, timestamp, values, violations):
+        violated = set()
+        for alert in violations:
+            key = (alert.user_id, alert.metric)
+            violated.add(key)
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = TrackedAlert(alert.user_id, alert.metric)
+                self._deleted.discard(key)
+            if state.status == CLEAR or state.direction != alert.direction:
+                state.start(alert, timestamp)
+                self._active.add(key)
+            else:
+                state.update(alert)
+            if state.status == PENDING and (timestamp - state.started_at).total_seconds() >= self.min_duration:
+                self._open(state, timestamp)
+            self._dirty.add(key)
+
+        # Pairs in an episode that this reading did not violate end once the value
+        # is back past the hysteresis band
+        for key in [key for key in self._active if key not in violated]:
+            state = self._states[key]
+            value = values.get(state.metric)
+            if value is None:
+                continue
+            if state.recovered(value, self.hysteresis.get(state.metric, 0)):
+                state.status = CLEAR
+                self._active.discard(key)
+                self._dirty.add(key)
+
+    def _open(self, state, timestamp):
+        state.status = OPEN
+        state.opened_at = timestamp
+        if state.notified_at is not None and (self.clock() - state.notified_at).total_seconds() < self.cooldown:
+            state.suppressed += 1
+            return
+        state.queued = True
+        self._waiting.setdefault(state.user_id, set()).add(state.key)
+
+    def _release_due(self):
+        """Alerts of every user whose digest window has ended"""
+        now = self.clock()
+        released = []
+        for user_id in list(self._waiting):
+            last = self._last_email.get(user_id)
+            if last is not None and (now - last).total_seconds() < self.digest:
+                continue
+            for key in sorted(self._waiting.pop(user_id)):
+                state = self._states[key]
+                released.append(state.to_alert())
+                state.queued = False
+                state.notified_at = now
+                state.suppressed = 0
+                self._dirty.add(key)
+            self._last_email[user_id] = now
+        return released
+
+    def _take_changes(self, force=False):
+        """(records to upsert, keys to delete) when a write is due, else None"""
+        now = time.monotonic()
+        if not force and self._last_persist is not None and now - self._last_persist < self.persist_interval:
+            return None
+        self._last_persist = now
+        # Clear pairs outside their cooldown carry no information any more
+        wall = self.clock()
+        for key, state in list(self._states.items()):
+            if (state.status == CLEAR and not state.queued
+                    and (state.notified_at is None or (wall - state.notified_at).total_seconds() >= self.cooldown)):
+                del self._states[key]
+                self._dirty.discard(key)
+                self._deleted.add(key)
+        for user_id, last in list(self._last_email.items()):
+            if (wall - last).total_seconds() >= self.digest and user_id not in self._waiting:
+                del self._last_email[user_id]
+        records = [self._states[key].to_record() for key in self._dirty]
+        deleted = list(self._deleted)
+        self._dirty.clear()
+        self._deleted.clear()
+        if not records and not deleted:
+            return None
+        return records, deleted
+
+    def _write(self, records, deleted):
+        try:
+            if records:
+                AlertState.objects.bulk_create(records, update_conflicts=True, unique_fields=['user', 'metric'],
+                                               update_fields=list(STATE_FIELDS))
+            if deleted:
+                AlertState.objects.filter(reduce(or_, (Q(user_id=user_id, metric=metric)
+                                                       for user_id, metric in deleted))).delete()
+        except Exception:
+            logger.exception('Persisting alert state failed')
+            # Queue the changes again for the next write, unless newer ones superseded them
+            with self._lock:
+                for record in records:
+                    key = record.user_id, record.metric
+                    if key in self._states and key not in self._deleted:
+                        self._dirty.add(key)
+                self._deleted.update(key for key in deleted if key not in self._states)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_alert_tracker():
+    """Return the process-wide AlertTracker"""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = AlertTracker()
+                atexit.register(_tracker.flush)
+    return _tracker
@@ -0,0 +1,252 @@
+"""
+Threshold alerts evaluated on ingest
+
+Every committed batch of readings is checked against the thresholds of the
+users who enabled email notifications. Instead of loading every profile for
+every reading, the AlertEngine keeps an in-memory ThresholdIndex: per
+threshold rule (metric and direction) the users' boundaries sorted in one
+array, so the users a value violates are found with one bisect. They are a
+prefix of an 'above' rule's array and a suffix of a 'below' rule's.
+
+The index is rebuilt lazily after a profile or user is saved or deleted in
+this process, and at the latest INDEX_TTL_S after it was built, which covers
+changes made by other processes (e.g. the MCP server's update_user_profile).
+
+Raw matches go through the AlertTracker (accounts/alert_state.py), which
+debounces them per user and metric. What it releases is sent with the
+alerts_triggered signal; the delivery stage subscribes to it
+(queue_alert_emails below writes them to the email outbox).
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from sensor_api.aqi import calculate_aqi_from_pm
+from sensor_api.models import METRICS
+from sensor_api.signals import sensor_data_ingested
+
+from .models import UserProfile
+from .outbox import enqueue_alert_emails
+
+# Sent with `alerts`, a list of Alert, for every batch of readings that violated a threshold
+alerts_triggered = Signal()
+
+# (metric, UserProfile field, direction), as in utils.check_threshold_exceeded.
+# pm1_0 has no threshold setting, so it never matches.
+THRESHOLD_RULES = (
+    ('temperature', 'temp_min', 'below'),
+    ('temperature', 'temp_max', 'above'),
+    ('humidity', 'humidity_min', 'below'),
+    ('humidity', 'humidity_max', 'above'),
+    ('co2', 'co2_max', 'above'),
+    ('pm2_5', 'pm25_max', 'above'),
+    ('pm10_0', 'pm10_max', 'above'),
+    ('aqi', 'aqi_max', 'above'),
+)
+
+# The six sensor metrics plus the AQI derived from PM2.5/PM10
+ALERT_METRICS = METRICS + ('aqi',)
+
+DEFAULT_ALERT_SETTINGS = {
+    'ENABLED': True,
+    'INDEX_TTL_S': 60,
+    'MIN_DURATION_S': 60,
+    'HYSTERESIS': {'temperature': 0.5, 'humidity': 2.0, 'co2': 50.0, 'pm2_5': 2.0, 'pm10_0': 5.0, 'aqi': 5.0},
+    'COOLDOWN_S': 30 * 60,
+    'DIGEST_S': 10 * 60,
+    'PERSIST_INTERVAL_S': 30,
+}
+
+
+def get_alert_settings():
+    return {**DEFAULT_ALERT_SETTINGS, **getattr(settings, 'SENSOR_ALERTS', {})}
+
+
+class Alert:
+    """
+    One reading violating one user's threshold. Alerts released by the
+    AlertTracker also carry the episode: since, peak, readings and suppressed.
+    """
+    since = None
+    peak = None
+    readings = 1
+    suppressed = 0
+
+    def __init__(self, user_id, username, email, metric, value, threshold, direction, timestamp, reading_id):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.metric = metric
+        self.value = value
+        self.threshold = threshold
+        self.direction = direction
+        self.timestamp = timestamp
+        self.reading_id = reading_id
+
+    def __repr__(self):
+        return f'<Alert {self.username}: {self.metric}={self.value} {self.direction} {self.threshold}>'
+
+
+def reading_values(reading):
+    """Values of ALERT_METRICS for one reading"""
+    values = {metric: getattr(reading, metric) for metric in METRICS}
+    values['aqi'] = calculate_aqi_from_pm(reading.pm2_5, reading.pm10_0)
+    return values
+
+
+class ThresholdRule:
+    """The boundaries of one (metric, direction) rule for every subscribed user, sorted"""
+
+    def __init__(self, direction, entries):
+        self.direction = direction
+        entries = sorted(entries)
+        self.bounds = [threshold for threshold, _ in entries]
+        self.user_ids = [user_id for _, user_id in entries]
+
+    def violations(self, value):
+        """(threshold, user_id) pairs whose threshold `value` is strictly beyond"""
+        if self.direction == 'above':
+            end = bisect.bisect_left(self.bounds, value)
+            return zip(self.bounds[:end], self.user_ids[:end])
+        start = bisect.bisect_right(self.bounds, value)
+        return zip(self.bounds[start:], self.user_ids[start:])
+
+
+class ThresholdIndex:
+    """Sorted threshold boundaries of all users with email notifications enabled"""
+
+    def __init__(self, profiles):
+        """profiles: (user_id, username, email, {UserProfile field: threshold}) tuples"""
+        self.contacts = {}
+        entries = {(metric, field): [] for metric, field, _ in THRESHOLD_RULES}
+        for user_id, username, email, thresholds in profiles:
+            self.contacts[user_id] = (username, email)
+            for metric, field, _ in THRESHOLD_RULES:
+                if thresholds.get(field) is not None:
+                    entries[metric, field].append((thresholds[field], user_id))
+        self.rules = {metric: [] for metric in ALERT_METRICS}
+        for metric, field, direction in THRESHOLD_RULES:
+            if entries[metric, field]:
+                self.rules[metric].append(ThresholdRule(direction, entries[metric, field]))
+
+    @classmethod
+    def from_database(cls):
+        fields = [field for _, field, _ in THRESHOLD_RULES]
+        rows = UserProfile.objects.filter(
+            email_notifications=True,
+            user__email__isnull=False,
+            user__email__gt='',  # Ensure email is not empty
+        ).values_list('user_id', 'user__username', 'user__email', *fields)
+        return cls((row[0], row[1], row[2], dict(zip(fields, row[3:]))) for row in rows)
+
+    def match(self, reading, values=None):
+        """Alerts for every threshold one SensorData reading violates"""
+        values = values or reading_values(reading)
+        alerts = []
+        for metric in ALERT_METRICS:
+            value = values[metric]
+            if value is None:
+                continue
+            for rule in self.rules[metric]:
+                for threshold, user_id in rule.violations(value):
+                    username, email = self.contacts[user_id]
+                    alerts.append(Alert(user_id, username, email, metric, value, threshold, rule.direction,
+                                        reading.timestamp, reading.pk))
+        return alerts
+
+
+class AlertEngine:
+    """Matches readings against a cached ThresholdIndex"""
+
+    def __init__(self, ttl=DEFAULT_ALERT_SETTINGS['INDEX_TTL_S'], loader=ThresholdIndex.from_database):
+        self.ttl = ttl
+        self.loader = loader
+        self._index = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Rebuild the index before the next evaluation"""
+        with self._lock:
+            self._generation += 1
+            self._index = None
+
+    def get_index(self):
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._built_at < self.ttl:
+                return self._index
+            generation = self._generation
+        index = self.loader()
+        with self._lock:
+            # Not kept if a profile changed while it was being loaded
+            if generation == self._generation:
+                self._index = index
+                self._built_at = time.monotonic()
+        return index
+
+    def observe(self, readings):
+        """(reading, values, violations) for each reading of a batch"""
+        index = self.get_index()
+        observed = []
+        for reading in readings:
+            values = reading_values(reading)
+            observed.append((reading, values, index.match(reading, values) if index.contacts else []))
+        return observed
+
+    def evaluate(self, readings):
+        """Raw violations for a batch of stored readings, in reading order"""
+        return [alert for _, _, violations in self.observe(readings) for alert in violations]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_alert_engine():
+    """Return the process-wide AlertEngine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AlertEngine(ttl=get_alert_settings()['INDEX_TTL_S'])
+    return _engine
+
+
+def dispatch_alerts(readings):
+    """Evaluate committed readings and hand the alerts due now to the delivery stage"""
+    from .alert_state import get_alert_tracker
+    alerts = get_alert_tracker().process(get_alert_engine().observe(readings))
+    if alerts:
+        alerts_triggered.send(sender=AlertEngine, alerts=alerts)
+    return alerts
+
+
+@receiver(sensor_data_ingested)
+def evaluate_alerts_on_ingest(sender, readings, **kwargs):
+    """Check new readings against the users' thresholds once they are committed"""
+    if get_alert_settings()['ENABLED']:
+        # robust: a failing alert stage is logged and must not fail the ingest request
+        transaction.on_commit(lambda: dispatch_alerts(readings), robust=True)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_threshold_index(sender, **kwargs):
+    """Thresholds, notification preference, username or email may have changed"""
+    if _engine is not None:
+        _engine.invalidate()
+
+
+@receiver(alerts_triggered)
+def queue_alert_emails(sender, alerts, **kwargs):
+    """Delivery stage: one outbox email per user (a digest for several alerts), sent in the background"""
+    enqueue_alert_emails(alerts)
@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from accounts.alerts import Alert
+from accounts.models import AlertEmail
+from accounts.outbox import deliver_due_alert_emails, enqueue_alert_emails, get_delivery_settings
+from accounts.utils import send_threshold_alert_email
+from sensor_api.management.commands._bench import benchmark_database
+
+
+class SimulatedSMTPBackend(LocmemEmailBackend):
+    """
+    locmem backend with SMTP-like costs: CONNECT_S per opened connection and
+    SEND_S per message. Like the SMTP backend, send_messages() opens and closes
+    a connection itself unless one is already open.
+    """
+    CONNECT_S = 0.0
+    SEND_S = 0.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection = None
+
+    def open(self):
+        if self.connection is not None:
+            return False
+        time.sleep(self.CONNECT_S)
+        self.connection = True
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, messages):
+        created = self.open()
+        try:
+            time.sleep(self.SEND_S * len(messages))
+            return super().send_messages(messages)
+        finally:
+            if created:
+                self.close()
+
+
+BACKENDS = {
+    'locmem': 'accounts.management.commands.benchmark_alert_delivery.SimulatedSMTPBackend',
+    'file': 'django.core.mail.backends.filebased.EmailBackend',
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare alert email throughput of one send_mail() per alert against the batched outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alerts', type=int, default=500, help='Alert emails per path')
+        parser.add_argument('--backend', choices=sorted(BACKENDS), default='locmem',
+                            help='locmem with simulated SMTP latency, or the file backend')
+        parser.add_argument('--connect-ms', type=float, default=50.0,
+                            help='Simulated cost of opening a connection (locmem only)')
+        parser.add_argument('--send-ms', type=float, default=2.0,
+                            help='Simulated cost of sending one message (locmem only)')
+        parser.add_argument('--batch-size', type=int, default=get_delivery_settings()['BATCH_SIZE'],
+                            help='Messages per outbox batch')
+
+    def handle(self, *args, **options):
+        SimulatedSMTPBackend.CONNECT_S = options['connect_ms'] / 1000
+        SimulatedSMTPBackend.SEND_S = options['send_ms'] / 1000
+        count = options['alerts']
+        mail_dir = tempfile.mkdtemp(prefix='alert_mail_')
+        config = {**get_delivery_settings(), 'WORKER': False, 'BATCH_SIZE': options['batch_size']}
+        overrides = override_settings(EMAIL_BACKEND=BACKENDS[options['backend']], EMAIL_FILE_PATH=mail_dir,
+                                      SENSOR_ALERT_DELIVERY=config)
+        try:
+            with benchmark_database(), overrides:
+                mail.outbox = []
+                # One user per alert: alerts of the same user are combined into one digest email
+                users = User.objects.bulk_create([User(username=f'bench{i}', email=f'bench{i}@example.com')
+                                                  for i in range(count)])
+                now = timezone.now()
+                alerts = [Alert(user.pk, user.username, user.email, 'co2', 1000.0 + i, 1000.0, 'above', now, None)
+                          for i, user in enumerate(users)]
+
+                started = time.perf_counter()
+                for alert in alerts:
+                    send_threshold_alert_email(alert.username, alert.email, alert.metric, alert.value,
+                                               alert.threshold, alert.direction, alert.timestamp)
+                direct = time.perf_counter() - started
+
+                started = time.perf_counter()
+                enqueue_alert_emails(alerts)
+                enqueue = time.perf_counter() - started
+                started = time.perf_counter()
+                sent, failed = deliver_due_alert_emails(config)
+                deliver = time.perf_counter() - started
+                delivered = AlertEmail.objects.filter(status='sent').count()
+        finally:
+            shutil.rmtree(mail_dir, ignore_errors=True)
+
+        self.stdout.write(f"Alert emails per path: {count}, backend {options['backend']}"
+                          + (f" ({options['connect_ms']} ms connect, {options['send_ms']} ms per message)"
+                             if options['backend'] == 'locmem' else ''))
+        self.stdout.write(f"{'send_mail per alert':>22}: {direct:8.3f}s  {count / direct:10.1f} msgs/sec "
+                          f"(time the ingest request would block)")
+        self.stdout.write(f"{'outbox enqueue':>22}: {enqueue:8.3f}s  {count / enqueue:10.1f} msgs/sec "
+                          f"(time the ingest request blocks now)")
+        self.stdout.write(f"{'outbox delivery':>22}: {deliver:8.3f}s  {count / deliver:10.1f} msgs/sec "
+                          f"(batches of {options['batch_size']}, background)")
+        if sent != count or delivered != count or failed:
+            self.stdout.write(self.style.ERROR(f'Only {delivered} of {count} outbox emails were delivered'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Outbox delivery speed-up: {direct / deliver:.1f}x'))
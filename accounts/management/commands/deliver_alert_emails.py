@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.outbox import deliver_due_alert_emails, get_delivery_settings
+
+
+class Command(BaseCommand):
+    help = 'Send the alert emails that are due in the outbox (for deployments without the delivery worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and send due emails every POLL_INTERVAL_S seconds')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.deliver()
+            return
+        poll_interval = get_delivery_settings()['POLL_INTERVAL_S']
+        try:
+            while True:
+                self.deliver()
+                close_old_connections()
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+    def deliver(self):
+        sent, failed = deliver_due_alert_emails()
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Sent {sent} alert emails, {failed} failed and will be retried'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Sent {sent} alert emails'))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 21:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_alert_email_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('clear', 'Clear'), ('pending', 'Pending'), ('open', 'Open')], default='clear', max_length=10)),
+                ('direction', models.CharField(blank=True, max_length=5)),
+                ('threshold', models.FloatField(blank=True, null=True)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('peak', models.FloatField(blank=True, null=True)),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('opened_at', models.DateTimeField(blank=True, null=True)),
+                ('queued', models.BooleanField(default=False)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('suppressed', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'metric'), name='unique_alert_state_per_user_metric')],
+            },
+        ),
+    ]
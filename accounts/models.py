@@ -2,6 +2,13 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.core.cache import cache
+from django.utils import timezone
+from sensor_api.signals import sensor_data_ingested
+
+# Bumped on every ingest so cached analysis statistics are never served stale; edits and
+# deletes bump the sensor data generation (sensor_api.conditional), also part of the key
+ANALYSIS_CACHE_GENERATION_KEY = 'analysis:generation'
 
 # Create your models here.
 
@@ -35,6 +42,14 @@ def save_user_profile(sender, instance, **kwargs):
     """Signal to save a user profile when the user is saved"""
     instance.profile.save()
 
+@receiver(sensor_data_ingested)
+def invalidate_analysis_cache(sender, readings, **kwargs):
+    """Signal to move the analysis page cache to a new generation when readings are stored"""
+    try:
+        cache.incr(ANALYSIS_CACHE_GENERATION_KEY)
+    except ValueError:
+        cache.set(ANALYSIS_CACHE_GENERATION_KEY, 1, None)
+
 class IssueReport(models.Model):
     """User reported issue model"""
     ISSUE_TYPES = [
@@ -67,3 +82,76 @@ class IssueReport(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+
+
+class AlertEmail(models.Model):
+    """
+    Outbox entry for one threshold alert email
+
+    Rows are written when alerts are triggered on ingest and sent by the
+    delivery worker (accounts/outbox.py), so ingestion never waits on SMTP.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='alert_emails')
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    metric = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"Alert email to {self.recipient}: {self.subject} ({self.status})"
+
+
+class AlertState(models.Model):
+    """
+    Persisted alert state of one user and metric
+
+    The live state is kept in memory by the AlertTracker (accounts/alert_state.py)
+    and written here periodically, so episodes, cooldowns and queued digest
+    entries survive a restart.
+    """
+    STATUS_CHOICES = [
+        ('clear', 'Clear'),
+        ('pending', 'Pending'),
+        ('open', 'Open'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='alert_states')
+    metric = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='clear')
+    direction = models.CharField(max_length=5, blank=True)
+    threshold = models.FloatField(null=True, blank=True)
+    value = models.FloatField(null=True, blank=True)
+    peak = models.FloatField(null=True, blank=True)
+    readings = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    queued = models.BooleanField(default=False)
+    notified_at = models.DateTimeField(null=True, blank=True)
+    suppressed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'metric'], name='unique_alert_state_per_user_metric'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.metric}: {self.status}"
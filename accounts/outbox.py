@@ -0,0 +1,216 @@
+"""
+Alert email outbox and delivery worker
+
+Alerts triggered on ingest are only written to the AlertEmail table; the
+ingest request never talks to SMTP. A background worker thread (or the
+deliver_alert_emails command) claims due rows in batches and sends each batch
+over a single mail connection. A failed message is retried with exponential
+backoff until MAX_ATTEMPTS, then marked failed. Rows are claimed with a token,
+so several processes can drain the same outbox; a row left 'sending' by a
+process that died is picked up again after STALE_SECONDS.
+"""
+import atexit
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AlertEmail
+from .utils import build_alert_digest_email, build_threshold_alert_email
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELIVERY_SETTINGS = {
+    'WORKER': True,
+    'BATCH_SIZE': 100,
+    'POLL_INTERVAL_S': 5.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE_S': 30,
+    'BACKOFF_MAX_S': 3600,
+    'STALE_SECONDS': 300,
+    'RETENTION_SECONDS': 7 * 24 * 60 * 60,
+}
+
+
+def get_delivery_settings():
+    return {**DEFAULT_DELIVERY_SETTINGS, **getattr(settings, 'SENSOR_ALERT_DELIVERY', {})}
+
+
+def enqueue_alert_emails(alerts):
+    """
+    Write one outbox row per user (a digest when the user has several alerts)
+    and wake the delivery worker once they are committed
+    """
+    by_user = {}
+    for alert in alerts:
+        by_user.setdefault(alert.user_id, []).append(alert)
+    rows = []
+    for user_id, user_alerts in by_user.items():
+        alert = user_alerts[0]
+        if len(user_alerts) == 1:
+            subject, body = build_threshold_alert_email(alert.username, alert.metric, alert.value,
+                                                        alert.threshold, alert.direction, alert.timestamp)
+            metric = alert.metric
+        else:
+            subject, body = build_alert_digest_email(alert.username, user_alerts)
+            metric = 'digest'
+        rows.append(AlertEmail(user_id=user_id, recipient=alert.email, subject=subject, body=body, metric=metric))
+    AlertEmail.objects.bulk_create(rows)
+    worker = get_alert_delivery_worker()
+    if worker is not None:
+        transaction.on_commit(worker.wake)
+    return rows
+
+
+def backoff_seconds(attempts, config=None):
+    """Delay before retry number `attempts`: BACKOFF_BASE_S doubling up to BACKOFF_MAX_S"""
+    config = config or get_delivery_settings()
+    return min(config['BACKOFF_BASE_S'] * 2 ** (attempts - 1), config['BACKOFF_MAX_S'])
+
+
+def claim_batch(limit, config=None):
+    """Mark up to `limit` due rows as being sent by this caller and return them"""
+    config = config or get_delivery_settings()
+    now = timezone.now()
+    due = (Q(status='pending', next_attempt_at__lte=now)
+           | Q(status='sending', claimed_at__lt=now - timedelta(seconds=config['STALE_SECONDS'])))
+    ids = list(AlertEmail.objects.filter(due).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Only rows still due are taken, so a concurrent claimer gets each row at most once
+    AlertEmail.objects.filter(due, id__in=ids).update(status='sending', claimed_by=token, claimed_at=now)
+    return list(AlertEmail.objects.filter(claimed_by=token, status='sending').order_by('id'))
+
+
+def send_batch(batch, connection=None):
+    """
+    Send claimed rows over one connection. Returns (sent ids, {id: error}).
+    Messages are sent one by one on the open connection so a rejected
+    recipient only fails its own row.
+    """
+    connection = connection or get_connection(fail_silently=False)
+    sent, errors = [], {}
+    try:
+        connection.open()
+    except Exception as e:
+        return [], {row.pk: e for row in batch}
+    try:
+        for row in batch:
+            message = EmailMessage(row.subject, row.body, settings.DEFAULT_FROM_EMAIL, [row.recipient],
+                                   connection=connection)
+            try:
+                if connection.send_messages([message]):
+                    sent.append(row.pk)
+                else:
+                    errors[row.pk] = 'Not accepted by the mail backend'
+            except Exception as e:
+                errors[row.pk] = e
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            logger.warning('Closing the mail connection failed', exc_info=True)
+    return sent, errors
+
+
+def record_results(batch, sent, errors, config=None):
+    config = config or get_delivery_settings()
+    now = timezone.now()
+    if sent:
+        AlertEmail.objects.filter(pk__in=sent).update(
+            status='sent', sent_at=now, attempts=F('attempts') + 1, last_error='', claimed_by='')
+    for row in batch:
+        if row.pk not in errors:
+            continue
+        attempts = row.attempts + 1
+        update = {'attempts': attempts, 'last_error': str(errors[row.pk]), 'claimed_by': ''}
+        if attempts >= config['MAX_ATTEMPTS']:
+            update['status'] = 'failed'
+        else:
+            update['status'] = 'pending'
+            update['next_attempt_at'] = now + timedelta(seconds=backoff_seconds(attempts, config))
+        AlertEmail.objects.filter(pk=row.pk).update(**update)
+
+
+def deliver_due_alert_emails(config=None, connection=None):
+    """Send every due outbox row, batch by batch. Returns (sent, failed) counts."""
+    config = config or get_delivery_settings()
+    total_sent = total_failed = 0
+    while True:
+        batch = claim_batch(config['BATCH_SIZE'], config)
+        if not batch:
+            break
+        sent, errors = send_batch(batch, connection)
+        record_results(batch, sent, errors, config)
+        total_sent += len(sent)
+        total_failed += len(errors)
+        if errors and not sent:
+            # Probably the mail server; leave the rest for the next round
+            break
+    if total_sent:
+        purge_sent_alert_emails(config)
+    return total_sent, total_failed
+
+
+def purge_sent_alert_emails(config=None):
+    """Delete rows sent more than RETENTION_SECONDS ago"""
+    config = config or get_delivery_settings()
+    cutoff = timezone.now() - timedelta(seconds=config['RETENTION_SECONDS'])
+    AlertEmail.objects.filter(status='sent', sent_at__lt=cutoff).delete()
+
+
+class AlertDeliveryWorker:
+    """Daemon thread draining the outbox when woken, and every POLL_INTERVAL_S for retries"""
+
+    def __init__(self, poll_interval=DEFAULT_DELIVERY_SETTINGS['POLL_INTERVAL_S']):
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='alert-email-delivery', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                deliver_due_alert_emails()
+            except Exception:
+                logger.exception('Alert email delivery failed')
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_alert_delivery_worker():
+    """Return the process-wide AlertDeliveryWorker, or None when the worker is disabled"""
+    global _worker
+    config = get_delivery_settings()
+    if not config['WORKER']:
+        return None
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = AlertDeliveryWorker(poll_interval=config['POLL_INTERVAL_S'])
+                atexit.register(_worker.stop, timeout=5)
+    return _worker
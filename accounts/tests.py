@@ -1,10 +1,35 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+import datetime
+import random
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from sensor_api.aqi import calculate_aqi_from_pm
+from sensor_api.ingest import save_readings
+from sensor_api.models import SensorData
+from sensor_api.snapshot import current_sensor_state
+
+from .alert_state import AlertTracker
+from .alerts import (ALERT_METRICS, DEFAULT_ALERT_SETTINGS, Alert, AlertEngine, ThresholdIndex, get_alert_engine,
+                     reading_values)
+from .forms import IssueReportForm, UserProfileForm
+from .models import AlertEmail, AlertState, IssueReport, UserProfile
+from .outbox import AlertDeliveryWorker, deliver_due_alert_emails, enqueue_alert_emails
+from .utils import check_threshold_exceeded
 
-from .models import UserProfile, IssueReport
-from .forms import UserProfileForm, IssueReportForm
 
 class UserProfileModelTests(TestCase):
     """Test the functionality of the UserProfile model"""
@@ -275,3 +300,519 @@ class PageSecurityTests(TestCase):
         response = self.client.get(reverse('profile')) # page attempting to be accessed
         self.assertEqual(response.status_code, 302) # redirect occured
         self.assertTrue(response.url.startswith('/accounts/login/')) # redirect to login page
+
+
+class AnalyzeViewQueryTests(TestCase):
+    """The analysis page runs a fixed number of grouped queries however much data there is"""
+
+    # A Wednesday afternoon in the project's local timezone (America/Chicago)
+    NOW = timezone.make_aware(datetime.datetime(2025, 6, 18, 14, 37, 12, 500000))
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password123')
+        self.client.login(username='testuser', password='password123')
+        patcher = mock.patch('django.utils.timezone.now', return_value=self.NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_readings(self, days, per_day_hours=(1, 5, 9, 13)):
+        readings = []
+        for day in range(days):
+            for hour in per_day_hours:
+                local = timezone.localtime(self.NOW).replace(hour=hour, minute=0, second=0, microsecond=0)
+                readings.append({
+                    'timestamp': local - datetime.timedelta(days=day),
+                    'co2': 400 + day * 10 + hour,
+                    'humidity': 50.0,
+                    'temperature': 22.0,
+                    'pm1_0': 1.0,
+                    'pm2_5': 5.0 + hour,
+                    'pm10_0': 10.0,
+                })
+        save_readings(readings)
+
+    def count_queries(self):
+        # The sensor snapshot is seeded once per process, not per request
+        current_sensor_state()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('analyze'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_grow_with_data(self):
+        self.add_readings(days=1)
+        small, _ = self.count_queries()
+        SensorData.objects.all().delete()
+        self.add_readings(days=35, per_day_hours=range(24))
+        large, _ = self.count_queries()
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 20)
+
+    def test_breakdowns_group_by_local_time(self):
+        self.add_readings(days=30)
+        _, response = self.count_queries()
+
+        slots = response.context['time_slots']
+        self.assertEqual([slots[i]['count'] for i in range(6)], [1, 1, 1, 1, 0, 0])
+        self.assertAlmostEqual(slots[2]['avg_co2'], 409)
+        self.assertEqual(response.context['worst_slot'], 3)
+
+        daily = response.context['daily_stats']
+        self.assertEqual(daily[0]['date'], datetime.date(2025, 6, 18))
+        self.assertEqual(daily[0]['name'], 'Wednesday')
+        self.assertEqual(daily[6]['count'], 4)
+        self.assertAlmostEqual(daily[6]['avg_co2'], 400 + 60 + 7)
+
+        weeks = response.context['weekly_breakdown']
+        self.assertEqual(weeks[0]['start_date'], datetime.date(2025, 6, 16))
+        self.assertEqual(weeks[0]['count'], 12)  # Monday to Wednesday
+        self.assertEqual(weeks[1]['count'], 28)
+        self.assertEqual(weeks[3]['start_date'], datetime.date(2025, 5, 26))
+
+
+class AnalyzeViewCacheTests(TestCase):
+    """Analysis statistics are cached until new readings arrive"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password123')
+        self.client.login(username='testuser', password='password123')
+
+    def add_reading(self, co2=800, **kwargs):
+        reading = {'co2': co2, 'humidity': 50.0, 'temperature': 22.0, 'pm1_0': 1.0, 'pm2_5': 5.0, 'pm10_0': 10.0}
+        reading.update(kwargs)
+        return save_readings([reading])[0]
+
+    def test_second_load_is_a_hit(self):
+        self.add_reading()
+        first = self.client.get(reverse('analyze'))
+        self.assertEqual(first['X-Analysis-Cache'], 'miss')
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(reverse('analyze'))
+        self.assertEqual(second['X-Analysis-Cache'], 'hit')
+        self.assertEqual(second.context['today_stats'], first.context['today_stats'])
+        # Session, user, the latest reading and the data generation only
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+
+    def test_new_reading_invalidates(self):
+        self.add_reading(co2=800)
+        self.client.get(reverse('analyze'))
+        self.add_reading(co2=1200)
+        response = self.client.get(reverse('analyze'))
+        self.assertEqual(response['X-Analysis-Cache'], 'miss')
+        self.assertEqual(response.context['today_stats']['max_co2'], 1200)
+        self.assertIn("CO₂ concentration is too high, recommend ventilation or opening windows.",
+                      response.context['recommendations'])
+
+    def test_backfilled_reading_invalidates(self):
+        self.add_reading()
+        self.client.get(reverse('analyze'))
+        self.add_reading(co2=2000, timestamp=timezone.now() - datetime.timedelta(hours=1))
+        response = self.client.get(reverse('analyze'))
+        self.assertEqual(response['X-Analysis-Cache'], 'miss')
+        self.assertEqual(response.context['weekly_stats']['max_co2'], 2000)
+
+    def test_edited_or_deleted_reading_invalidates(self):
+        self.add_reading(co2=800)
+        reading = self.add_reading(co2=1200)
+        self.client.get(reverse('analyze'))
+        reading.co2 = 1500
+        reading.save()
+        response = self.client.get(reverse('analyze'))
+        self.assertEqual(response['X-Analysis-Cache'], 'miss')
+        self.assertEqual(response.context['today_stats']['max_co2'], 1500)
+        SensorData.objects.filter(co2=800).delete()
+        response = self.client.get(reverse('analyze'))
+        self.assertEqual(response['X-Analysis-Cache'], 'miss')
+        self.assertEqual(response.context['today_stats']['min_co2'], 1500)
+
+    def test_unchanged_page_is_not_modified(self):
+        self.add_reading()
+        self.client.get(reverse('analyze'))  # Sets the CSRF cookie the page depends on
+        first = self.client.get(reverse('analyze'))
+        self.assertIn('ETag', first)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('analyze'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # Session, user, the latest reading and the data generation only
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+        self.add_reading(co2=1200)
+        response = self.client.get(reverse('analyze'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['today_stats']['max_co2'], 1200)
+
+    def test_etag_depends_on_the_user(self):
+        self.add_reading()
+        self.client.get(reverse('analyze'))
+        etag = self.client.get(reverse('analyze'))['ETag']
+        User.objects.create_user(username='other', password='password123')
+        self.client.login(username='other', password='password123')
+        response = self.client.get(reverse('analyze'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(SENSOR_ALERT_DELIVERY={'WORKER': False},
+                   SENSOR_ALERTS={'MIN_DURATION_S': 0, 'COOLDOWN_S': 0, 'DIGEST_S': 0})
+class AlertEngineTests(TestCase):
+    """Threshold alerts are evaluated on ingest from the indexed thresholds"""
+
+    READING = {'co2': 800.0, 'humidity': 50.0, 'temperature': 22.0, 'pm1_0': 1.0, 'pm2_5': 5.0, 'pm10_0': 10.0}
+
+    def setUp(self):
+        get_alert_engine().invalidate()
+        patcher = mock.patch('accounts.alert_state._tracker', AlertTracker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = self.subscribe('alice', co2_max=1000.0, temp_max=25.0)
+        self.bob = self.subscribe('bob', co2_max=1500.0, temp_min=20.0)
+
+    def subscribe(self, username, **thresholds):
+        user = User.objects.create_user(username=username, password='password123', email=f'{username}@example.com')
+        UserProfile.objects.filter(user=user).update(email_notifications=True, **thresholds)
+        return user
+
+    def ingest(self, **values):
+        with self.captureOnCommitCallbacks(execute=True):
+            reading = save_readings([{**self.READING, **values}])[0]
+        deliver_due_alert_emails()
+        return reading
+
+    def test_index_matches_a_full_scan(self):
+        rng = random.Random(7)
+        profiles = []
+        for user_id in range(200):
+            profiles.append(UserProfile(
+                temp_min=rng.uniform(10, 20), temp_max=rng.uniform(22, 30),
+                humidity_min=rng.uniform(20, 40), humidity_max=rng.uniform(60, 80),
+                co2_max=rng.choice([800.0, 1000.0, 1200.0]), pm25_max=rng.uniform(10, 40),
+                pm10_max=rng.uniform(50, 150), aqi_max=rng.uniform(50, 100)))
+        fields = ['temp_min', 'temp_max', 'humidity_min', 'humidity_max', 'co2_max', 'pm25_max', 'pm10_max', 'aqi_max']
+        index = ThresholdIndex((user_id, f'user{user_id}', 'x@example.com',
+                                {field: getattr(profile, field) for field in fields})
+                               for user_id, profile in enumerate(profiles))
+        for _ in range(50):
+            reading = SensorData(co2=rng.uniform(400, 1500), humidity=rng.uniform(10, 90),
+                                 temperature=rng.uniform(5, 35), pm1_0=rng.uniform(0, 50),
+                                 pm2_5=rng.uniform(0, 80), pm10_0=rng.uniform(0, 200))
+            found = {(alert.user_id, alert.metric, alert.direction) for alert in index.match(reading)}
+            expected = set()
+            values = {metric: getattr(reading, metric) for metric in ALERT_METRICS if metric != 'aqi'}
+            values['aqi'] = calculate_aqi_from_pm(reading.pm2_5, reading.pm10_0)
+            for user_id, profile in enumerate(profiles):
+                for metric, value in values.items():
+                    exceeded, _, direction = check_threshold_exceeded(metric, value, profile)
+                    if exceeded:
+                        expected.add((user_id, metric, direction))
+            self.assertEqual(found, expected)
+
+    def test_ingest_sends_alerts(self):
+        self.ingest(co2=1200.0)
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+        self.assertIn('CO2', mail.outbox[0].subject)
+        self.assertIn('above 1000.0', mail.outbox[0].body)
+        mail.outbox = []
+        self.ingest(temperature=18.0)
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com']])
+        self.assertIn('below 20.0', mail.outbox[0].body)
+
+    def test_single_save_and_normal_reading(self):
+        self.ingest()
+        self.assertEqual(mail.outbox, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            SensorData.objects.create(**{**self.READING, 'co2': 2000.0})
+        deliver_due_alert_emails()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_profile_save_refreshes_the_index(self):
+        self.ingest(co2=1200.0)
+        self.assertEqual(len(mail.outbox), 1)
+        profile = UserProfile.objects.get(user=self.bob)
+        profile.co2_max = 1100.0
+        profile.save()
+        profile = UserProfile.objects.get(user=self.alice)
+        profile.email_notifications = False
+        profile.save()
+        mail.outbox = []
+        self.ingest(co2=1200.0)
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com']])
+
+    def test_index_is_built_once(self):
+        engine = AlertEngine(ttl=60)
+        with CaptureQueriesContext(connection) as ctx:
+            for co2 in (900.0, 1100.0, 1600.0):
+                engine.evaluate([SensorData(**{**self.READING, 'co2': co2})])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(len(engine.evaluate([SensorData(**{**self.READING, 'co2': 1600.0})])), 2)
+
+    @override_settings(SENSOR_ALERTS={'ENABLED': False})
+    def test_disabled(self):
+        self.ingest(co2=2000.0)
+        self.assertEqual(mail.outbox, [])
+
+
+class AlertIngestFailureTests(TransactionTestCase):
+    """A failing alert stage does not fail the ingest that triggered it"""
+
+    def test_post_succeeds_when_dispatch_fails(self):
+        with mock.patch('accounts.alerts.dispatch_alerts', side_effect=RuntimeError('tracker broken')) as dispatch, \
+                self.assertLogs('django.db.backends', 'ERROR'):
+            response = self.client.post(reverse('sensor-create'), AlertEngineTests.READING, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(dispatch.call_count, 1)
+        self.assertEqual(SensorData.objects.count(), 1)
+
+
+class AlertTrackerTests(TestCase):
+    """Violations are debounced per user and metric before anyone is notified"""
+
+    CONFIG = {**DEFAULT_ALERT_SETTINGS, 'MIN_DURATION_S': 60, 'COOLDOWN_S': 1800, 'DIGEST_S': 600}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        self.index = ThresholdIndex([(self.user.pk, 'alice', 'alice@example.com',
+                                      {'co2_max': 1000.0, 'temp_max': 25.0, 'pm25_max': 20.0})])
+        self.now = timezone.now()
+        self.tracker = self.make_tracker()
+
+    def make_tracker(self):
+        return AlertTracker(self.CONFIG, clock=lambda: self.now)
+
+    def feed(self, seconds=1, **values):
+        """One reading per second for `seconds`; returns the alerts released meanwhile"""
+        released = []
+        for _ in range(seconds):
+            self.now += datetime.timedelta(seconds=1)
+            reading = SensorData(timestamp=self.now, **{**AlertEngineTests.READING, **values})
+            reading_values_ = reading_values(reading)
+            released += self.tracker.process([(reading, reading_values_, self.index.match(reading, reading_values_))])
+        return released
+
+    def test_flapping_value_is_notified_once(self):
+        released = []
+        for _ in range(1800):
+            released += self.feed(co2=1200.0)
+            released += self.feed(co2=990.0)  # Inside the threshold, but not by the hysteresis band
+        self.assertEqual([(alert.metric, alert.direction) for alert in released], [('co2', 'above')])
+        self.assertEqual(released[0].peak, 1200.0)
+        self.assertEqual(released[0].readings, 31)
+
+    def test_minimum_duration(self):
+        self.assertEqual(self.feed(30, co2=1200.0), [])
+        self.assertEqual(self.feed(co2=800.0), [])
+        self.assertEqual(self.feed(59, co2=1200.0), [])
+        released = self.feed(2, co2=1200.0)
+        self.assertEqual(len(released), 1)
+        self.assertEqual(released[0].since, self.now - datetime.timedelta(seconds=60))
+
+    def test_cooldown_suppresses_reopened_alert(self):
+        self.assertEqual(len(self.feed(61, co2=1200.0)), 1)
+        self.feed(co2=900.0)  # Closes
+        self.assertEqual(self.feed(61, co2=1200.0), [])
+        self.assertEqual(self.tracker._states[self.user.pk, 'co2'].suppressed, 1)
+        self.feed(co2=900.0)
+        self.now += datetime.timedelta(seconds=1800)
+        released = self.feed(61, co2=1200.0)
+        self.assertEqual(len(released), 1)
+        self.assertEqual(released[0].suppressed, 1)
+
+    def test_digest_groups_alerts(self):
+        self.assertEqual(len(self.feed(61, co2=1200.0)), 1)
+        # Alerts opening within DIGEST_S of the last email wait for the window to end
+        self.assertEqual(self.feed(61, temperature=30.0, pm2_5=50.0), [])
+        self.now += datetime.timedelta(seconds=600)
+        released = self.feed(temperature=30.0, pm2_5=50.0)
+        self.assertEqual(sorted(alert.metric for alert in released), ['pm2_5', 'temperature'])
+        with override_settings(SENSOR_ALERT_DELIVERY={'WORKER': False}):
+            rows = enqueue_alert_emails(released)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].metric, 'digest')
+        self.assertIn('Temperature', rows[0].body)
+        self.assertIn('PM2.5', rows[0].body)
+
+    def test_state_survives_restart(self):
+        self.assertEqual(len(self.feed(61, co2=1200.0)), 1)
+        self.tracker.flush()
+        record = AlertState.objects.get(user=self.user, metric='co2')
+        self.assertEqual((record.status, record.queued), ('open', False))
+        self.tracker = self.make_tracker()
+        self.feed(co2=900.0)
+        # Still within the cooldown of the email sent before the restart
+        self.assertEqual(self.feed(61, co2=1200.0), [])
+        self.tracker.flush()
+        self.assertEqual(AlertState.objects.get(user=self.user, metric='co2').suppressed, 1)
+
+    def test_clear_states_are_dropped(self):
+        self.feed(30, co2=1200.0)
+        self.feed(co2=800.0)
+        self.tracker.flush()
+        self.assertFalse(AlertState.objects.exists())
+
+    def test_writes_land_in_the_order_taken(self):
+        self.feed(61, co2=1200.0)
+        self.tracker.flush()
+        writes = []
+        first_started, release = threading.Event(), threading.Event()
+
+        def write(records, deleted):
+            writes.append(('start', [record.status for record in records], deleted))
+            if len(writes) == 1:
+                first_started.set()
+                release.wait(5)
+            writes.append(('end',))
+
+        with mock.patch.object(self.tracker, '_write', side_effect=write):
+            self.feed(co2=1300.0)
+            first = threading.Thread(target=self.tracker.flush)
+            first.start()
+            self.assertTrue(first_started.wait(5))
+            self.now += datetime.timedelta(seconds=1800)
+            self.feed(co2=800.0)  # Clears and, outside the cooldown, drops the state
+            second = threading.Thread(target=self.tracker.flush)
+            second.start()
+            second.join(0.2)
+            self.assertEqual(len(writes), 1)  # Waits for the first write
+            release.set()
+            first.join(5)
+            second.join(5)
+        self.assertEqual(writes, [('start', ['open'], []), ('end',), ('start', [], [(self.user.pk, 'co2')]), ('end',)])
+
+    def test_failed_write_is_retried(self):
+        self.feed(61, co2=1200.0)
+        with mock.patch.object(AlertState.objects, 'bulk_create', side_effect=DatabaseError('locked')):
+            self.tracker.flush()
+        # Only the pending state written by the first evaluation is stored
+        self.assertEqual(AlertState.objects.get(user=self.user, metric='co2').status, 'pending')
+        self.tracker.flush()
+        self.assertEqual(AlertState.objects.get(user=self.user, metric='co2').status, 'open')
+
+        self.feed(co2=800.0)
+        self.now += datetime.timedelta(seconds=1800)
+        with mock.patch('django.db.models.query.QuerySet.delete', side_effect=DatabaseError('locked')):
+            self.tracker.flush()
+        self.assertTrue(AlertState.objects.exists())
+        self.tracker.flush()
+        self.assertFalse(AlertState.objects.exists())
+
+
+class CountingBackend(LocmemEmailBackend):
+    """locmem backend that counts opened connections and can reject recipients"""
+    opened = 0
+    reject = set()
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.reject:
+                raise OSError('550 Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='accounts.tests.CountingBackend',
+                   SENSOR_ALERT_DELIVERY={'WORKER': False, 'BATCH_SIZE': 10, 'MAX_ATTEMPTS': 3,
+                                          'BACKOFF_BASE_S': 30, 'BACKOFF_MAX_S': 60})
+class AlertOutboxTests(TestCase):
+    """Alert emails are queued in the outbox and sent in batches with retries"""
+
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.reject = set()
+        self.user = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+
+    def enqueue(self, count, email='alice@example.com'):
+        """One alert email each for `count` users"""
+        now = timezone.now()
+        users = [User.objects.create(username=f'user{User.objects.count()}') for _ in range(count)]
+        return enqueue_alert_emails([Alert(user.pk, user.username, email, 'co2', 1100.0 + i, 1000.0, 'above', now, None)
+                                     for i, user in enumerate(users)])
+
+    def test_alerts_of_a_user_are_one_email(self):
+        now = timezone.now()
+        rows = enqueue_alert_emails([Alert(self.user.pk, 'alice', 'alice@example.com', metric, 1100.0, 1000.0,
+                                           'above', now, None) for metric in ('co2', 'pm2_5')])
+        self.assertEqual([(row.metric, row.recipient) for row in rows], [('digest', 'alice@example.com')])
+
+    def test_enqueue_does_not_send(self):
+        self.enqueue(3)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(AlertEmail.objects.filter(status='pending').count(), 3)
+        self.assertIn('CO2', AlertEmail.objects.first().subject)
+
+    def test_one_connection_per_batch(self):
+        self.enqueue(25)
+        self.assertEqual(deliver_due_alert_emails(), (25, 0))
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(CountingBackend.opened, 3)
+        self.assertEqual(AlertEmail.objects.filter(status='sent').count(), 25)
+        self.assertEqual(deliver_due_alert_emails(), (0, 0))
+
+    def test_failed_message_is_retried_with_backoff(self):
+        self.enqueue(1)
+        self.enqueue(1, email='bounce@example.com')
+        CountingBackend.reject = {'bounce@example.com'}
+        self.assertEqual(deliver_due_alert_emails(), (1, 1))
+        failed = AlertEmail.objects.get(recipient='bounce@example.com')
+        self.assertEqual((failed.status, failed.attempts), ('pending', 1))
+        self.assertIn('550', failed.last_error)
+        self.assertAlmostEqual((failed.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5)
+        # Not due yet
+        self.assertEqual(deliver_due_alert_emails(), (0, 0))
+        for attempts, delay in ((2, 60), (3, None)):
+            AlertEmail.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+            deliver_due_alert_emails()
+            failed.refresh_from_db()
+            self.assertEqual(failed.attempts, attempts)
+            if delay:
+                self.assertAlmostEqual((failed.next_attempt_at - timezone.now()).total_seconds(), delay, delta=5)
+        self.assertEqual(failed.status, 'failed')
+
+    def test_connection_failure_keeps_the_batch(self):
+        self.enqueue(2)
+        with mock.patch.object(CountingBackend, 'open', side_effect=OSError('Connection refused')):
+            self.assertEqual(deliver_due_alert_emails(), (0, 2))
+        self.assertEqual(set(AlertEmail.objects.values_list('status', 'attempts')), {('pending', 1)})
+
+    def test_stale_claim_is_picked_up_again(self):
+        row = self.enqueue(1)[0]
+        AlertEmail.objects.filter(pk=row.pk).update(
+            status='sending', claimed_by='dead', claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(deliver_due_alert_emails(), (1, 0))
+
+    def test_command(self):
+        self.enqueue(2)
+        out = StringIO()
+        call_command('deliver_alert_emails', stdout=out)
+        self.assertIn('Sent 2 alert emails', out.getvalue())
+
+    def test_command_loop(self):
+        self.enqueue(2)
+        out = StringIO()
+        with mock.patch('accounts.management.commands.deliver_alert_emails.time.sleep',
+                        side_effect=[None, KeyboardInterrupt]) as sleep:
+            call_command('deliver_alert_emails', '--loop', stdout=out)
+        self.assertEqual(out.getvalue().count('Sent'), 2)
+        self.assertIn('Sent 2 alert emails', out.getvalue())
+        sleep.assert_called_with(5.0)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class AlertDeliveryWorkerTests(TransactionTestCase):
+    """The delivery worker sends queued emails on its own thread"""
+
+    def test_worker_sends_when_woken(self):
+        user = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        enqueue_alert_emails([Alert(user.pk, 'alice', 'alice@example.com', 'co2', 1100.0, 1000.0, 'above',
+                                    timezone.now(), None)])
+        worker = AlertDeliveryWorker(poll_interval=60)
+        self.addCleanup(worker.stop, timeout=5)
+        worker.wake()
+        deadline = time.monotonic() + 10
+        while not AlertEmail.objects.filter(status='sent').exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(mail.outbox), 1)
+
@@ -41,10 +41,129 @@ def check_threshold_exceeded(sensor_type, value, user_profile):
     
     return False, None, None
 
+SENSOR_NAMES = {
+    'temperature': 'Temperature',
+    'humidity': 'Humidity',
+    'co2': 'CO2',
+    'pm1_0': 'PM1.0',
+    'pm2_5': 'PM2.5',
+    'pm10_0': 'PM10.0',
+    'aqi': 'AQI (Air Quality Index)'
+}
+
+SENSOR_UNITS = {
+    'temperature': '°C',
+    'humidity': '%',
+    'co2': 'ppm',
+    'pm1_0': 'μg/m³',
+    'pm2_5': 'μg/m³',
+    'pm10_0': 'μg/m³',
+    'aqi': ''
+}
+
+def build_threshold_alert_email(username, sensor_type, value, threshold, direction, timestamp):
+    """
+    Subject and body of the alert email for one exceeded threshold
+    
+    Parameters:
+    - username: Recipient's username
+    - sensor_type: Sensor type (like 'temperature', 'humidity', 'co2', etc.)
+    - value: Sensor reading
+    - threshold, direction: The user's threshold and 'above' or 'below'
+    - timestamp: Timestamp
+    
+    Returns:
+    - (subject, message)
+    """
+    sensor_name = SENSOR_NAMES.get(sensor_type, sensor_type)
+    unit = SENSOR_UNITS.get(sensor_type, '')
+    
+    subject = f'Sensor Alert: {sensor_name} Abnormal'
+    
+    message = f"""
+Dear {username},
+
+The sensor monitoring system has detected abnormal data:
+
+Sensor type: {sensor_name}
+Current value: {value} {unit}
+Threshold setting: {direction} {threshold} {unit}
+Time: {timestamp}
+
+We recommend checking the sensor monitoring dashboard for more details.
+
+---
+This email was sent automatically by the system. Please do not reply.
+To modify threshold settings or disable email notifications, please visit the "Threshold Settings" page in your profile.
+            """
+    return subject, message
+
+def build_alert_digest_email(username, alerts):
+    """
+    Subject and body of one email summarizing several alerts of a user
+    
+    Parameters:
+    - username: Recipient's username
+    - alerts: Alerts released together by the AlertTracker (accounts/alert_state.py)
+    
+    Returns:
+    - (subject, message)
+    """
+    subject = f'Sensor Alert: {len(alerts)} thresholds exceeded'
+    
+    lines = []
+    for alert in alerts:
+        sensor_name = SENSOR_NAMES.get(alert.metric, alert.metric)
+        unit = SENSOR_UNITS.get(alert.metric, '')
+        line = (f"- {sensor_name}: {alert.value} {unit} (threshold: {alert.direction} {alert.threshold} {unit}, "
+                f"worst: {alert.peak if alert.peak is not None else alert.value} {unit}, since {alert.since or alert.timestamp})")
+        if alert.suppressed:
+            line += f", {alert.suppressed} repeated alerts suppressed"
+        lines.append(line)
+    details = "\n".join(lines)
+    
+    message = f"""
+Dear {username},
+
+The sensor monitoring system has detected abnormal data:
+
+{details}
+
+We recommend checking the sensor monitoring dashboard for more details.
+
+---
+This email was sent automatically by the system. Please do not reply.
+To modify threshold settings or disable email notifications, please visit the "Threshold Settings" page in your profile.
+            """
+    return subject, message
+
+def send_threshold_alert_email(username, email, sensor_type, value, threshold, direction, timestamp):
+    """
+    Send one user the alert email for one exceeded threshold, synchronously
+    
+    Alerts triggered on ingest go through the outbox (accounts/outbox.py) instead.
+    
+    Returns:
+    - Number of emails sent (0 or 1)
+    """
+    subject, message = build_threshold_alert_email(username, sensor_type, value, threshold, direction, timestamp)
+    
+    # Send email
+    return send_mail(
+        subject=subject,
+        message=message,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[email],
+        fail_silently=True,  # Don't raise exceptions on failure
+    )
+
 def send_sensor_alert_email(sensor_type, value, timestamp):
     """
     Send sensor data alert email based on each user's threshold settings
     
+    Checks every user with notifications enabled; the ingest path uses the
+    indexed AlertEngine (accounts/alerts.py) instead.
+    
     Parameters:
     - sensor_type: Sensor type (like 'temperature', 'humidity', 'co2', etc.)
     - value: Sensor reading
@@ -61,29 +180,6 @@ def send_sensor_alert_email(sensor_type, value, timestamp):
     if not users_with_notification.exists():
         return
     
-    sensor_name_map = {
-        'temperature': 'Temperature',
-        'humidity': 'Humidity',
-        'co2': 'CO2',
-        'pm1_0': 'PM1.0',
-        'pm2_5': 'PM2.5',
-        'pm10_0': 'PM10.0',
-        'aqi': 'AQI (Air Quality Index)'
-    }
-    
-    sensor_unit_map = {
-        'temperature': '°C',
-        'humidity': '%',
-        'co2': 'ppm',
-        'pm1_0': 'μg/m³',
-        'pm2_5': 'μg/m³',
-        'pm10_0': 'μg/m³',
-        'aqi': ''
-    }
-    
-    sensor_name = sensor_name_map.get(sensor_type, sensor_type)
-    unit = sensor_unit_map.get(sensor_type, '')
-    
     notification_sent = 0
     
     # Check threshold and send personalized notifications for each user
@@ -92,34 +188,7 @@ def send_sensor_alert_email(sensor_type, value, timestamp):
         exceeded, threshold, direction = check_threshold_exceeded(sensor_type, value, user.profile)
         
         if exceeded:
-            subject = f'Sensor Alert: {sensor_name} Abnormal'
-            
-            message = f"""
-Dear {user.username},
-
-The sensor monitoring system has detected abnormal data:
-
-Sensor type: {sensor_name}
-Current value: {value} {unit}
-Threshold setting: {direction} {threshold} {unit}
-Time: {timestamp}
-
-We recommend checking the sensor monitoring dashboard for more details.
-
----
-This email was sent automatically by the system. Please do not reply.
-To modify threshold settings or disable email notifications, please visit the "Threshold Settings" page in your profile.
-            """
-            
-            # Send email
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True,  # Don't raise exceptions on failure
-            )
-            
+            send_threshold_alert_email(user.username, user.email, sensor_type, value, threshold, direction, timestamp)
             notification_sent += 1
     
     return notification_sent  # Return number of notifications sent 
\ No newline at end of file
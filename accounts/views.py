@@ -8,15 +8,21 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
-from django.db.models import Avg, Max, Min, Count
+from django.utils.translation import get_language
+from django.core.cache import cache
+from django.db.models import Avg, Count, Sum
+from django.db.models.functions import ExtractHour, TruncDate, TruncWeek
 import datetime  # import the entire datetime module
 from accounts.forms import (
     UserProfileForm, CustomPasswordChangeForm, UsernameChangeForm, 
     IssueReportForm, CustomUserCreationForm, NotificationSettingsForm,
     ThresholdSettingsForm, ApiKeyForm
 )
-from .models import IssueReport, UserProfile
+from .models import ANALYSIS_CACHE_GENERATION_KEY, IssueReport, UserProfile
 from sensor_api.models import SensorData
+from sensor_api.rollups import aggregate_range
+from sensor_api.snapshot import current_sensor_state
+from sensor_api.conditional import data_generation, make_etag, not_modified_response, set_validator_headers
 from django.views.decorators.http import require_POST # Import require_POST
 import requests # Import requests library
 import json # Import json library
@@ -222,46 +228,43 @@ AMI Sensor Monitoring System
         'message': 'Invalid request method'
     }, status=400)
 
-@login_required
-def analyze_view(request):
-    """Display analysis of current and historical sensor data with recommendations"""
-    
-    # Get the latest sensor data
-    latest_data = SensorData.objects.order_by('-timestamp').first()
-    
-    # Get today's data - use the current timezone's date
-    today = timezone.localtime(timezone.now()).date()
-    print(f"Using today's date in local timezone: {today}")
+def local_day_start(day):
+    """
+    Aware datetime for midnight of `day` in the current timezone.
+    Filtering on timestamp ranges (instead of timestamp__date) lets the database
+    use the timestamp index rather than evaluating a date cast on every row.
+    """
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+# Metrics broken down by time slot, day and week on the analysis page
+ANALYZED_METRICS = ('co2', 'pm2_5', 'temperature', 'humidity')
+
+def grouped_stats(queryset, bucket):
+    """
+    Reading count, sums and averages per value of the `bucket` expression,
+    computed with a single GROUP BY query. Returns {bucket value: stats}.
+    """
+    aggregates = {'count': Count('id')}
+    for metric in ANALYZED_METRICS:
+        aggregates[f'sum_{metric}'] = Sum(metric)
+        aggregates[f'avg_{metric}'] = Avg(metric)
+    rows = queryset.annotate(bucket=bucket).values('bucket').annotate(**aggregates).order_by('bucket')
+    return {row.pop('bucket'): row for row in rows}
+
+def compute_analysis_stats(today):
+    """
+    Window statistics and time slot/day/week breakdowns for the analysis page.
+    Only depends on `today` and the stored readings, so the result can be cached
+    until new data arrives (see get_analysis_stats).
+    """
+    local_tz = timezone.get_current_timezone()
     
     # Using __date filtering might use UTC, so we explicitly specify the date range for the current timezone
     today_start = timezone.make_aware(datetime.datetime.combine(today, datetime.time.min))
     today_end = timezone.make_aware(datetime.datetime.combine(today, datetime.time.max))
-    print(f"Today date range: {today_start} to {today_end}")
     
-    today_data = SensorData.objects.filter(
-        timestamp__gte=today_start,
-        timestamp__lte=today_end
-    )
-    today_stats = today_data.aggregate(
-        avg_co2=Avg('co2'),
-        avg_humidity=Avg('humidity'),
-        avg_temperature=Avg('temperature'),
-        avg_pm1_0=Avg('pm1_0'),
-        avg_pm2_5=Avg('pm2_5'),
-        avg_pm10_0=Avg('pm10_0'),
-        max_co2=Max('co2'),
-        max_humidity=Max('humidity'),
-        max_temperature=Max('temperature'),
-        max_pm1_0=Max('pm1_0'),
-        max_pm2_5=Max('pm2_5'),
-        max_pm10_0=Max('pm10_0'),
-        min_co2=Min('co2'),
-        min_humidity=Min('humidity'),
-        min_temperature=Min('temperature'),
-        min_pm1_0=Min('pm1_0'),
-        min_pm2_5=Min('pm2_5'),
-        min_pm10_0=Min('pm10_0'),
-    )
+    # Window statistics come from the rollup tables plus raw edges
+    today_stats = aggregate_range(today_start, today_end)
     
     # Daily hourly analysis (4 hours per slot)
     time_slots = {}
@@ -277,47 +280,34 @@ def analyze_view(request):
     # Initialize data containers for each time slot
     for slot in range(6):
         time_slots[slot] = {
-            'data': [],
             'name': time_slot_names[slot],
+            'count': 0,
             'avg_co2': 0,
             'avg_pm2_5': 0,
             'avg_temperature': 0,
             'avg_humidity': 0
         }
     
-    # Categorize today's data by time slot
-    for entry in today_data:
-        # Ensure using local timezone's time
-        local_timestamp = timezone.localtime(entry.timestamp)
-        hour = local_timestamp.hour
-        print(f"Entry: {entry.id}, UTC timestamp: {entry.timestamp}, Local hour: {hour}")
-        
-        slot = hour // 4  # One session every 4 hours
-        time_slots[slot]['data'].append(entry)
+    # Group today's data by local hour in the database, then fold hours into 4-hour slots
+    today_data = SensorData.objects.filter(timestamp__gte=today_start, timestamp__lte=today_end)
+    hourly = grouped_stats(today_data, ExtractHour('timestamp', tzinfo=local_tz))
+    for hour, stats in hourly.items():
+        slot = time_slots[hour // 4]  # One session every 4 hours
+        for metric in ANALYZED_METRICS:
+            slot[f'avg_{metric}'] += stats[f'sum_{metric}']
+        slot['count'] += stats['count']
     
     # Calculate the average value for each time slot
     worst_slot = None
     worst_slot_score = 0
     
     for slot, data in time_slots.items():
-        if data['data']:
-            co2_values = [entry.co2 for entry in data['data']]
-            pm25_values = [entry.pm2_5 for entry in data['data']]
-            temp_values = [entry.temperature for entry in data['data']]
-            humidity_values = [entry.humidity for entry in data['data']]
-            
-            avg_co2 = sum(co2_values) / len(co2_values)
-            avg_pm25 = sum(pm25_values) / len(pm25_values)
-            avg_temp = sum(temp_values) / len(temp_values)
-            avg_humidity = sum(humidity_values) / len(humidity_values)
-            
-            time_slots[slot]['avg_co2'] = avg_co2
-            time_slots[slot]['avg_pm2_5'] = avg_pm25
-            time_slots[slot]['avg_temperature'] = avg_temp
-            time_slots[slot]['avg_humidity'] = avg_humidity
+        if data['count']:
+            for metric in ANALYZED_METRICS:
+                data[f'avg_{metric}'] /= data['count']
             
             # Calculate the air quality score (simply weighted CO2 and PM2.5)
-            slot_score = (avg_co2 / 500) + (avg_pm25 / 10)  # Normalize
+            slot_score = (data['avg_co2'] / 500) + (data['avg_pm2_5'] / 10)  # Normalize
             
             if slot_score > worst_slot_score:
                 worst_slot_score = slot_score
@@ -325,27 +315,8 @@ def analyze_view(request):
     
     # Get data from the past 7 days
     week_ago = today - datetime.timedelta(days=7)
-    weekly_data = SensorData.objects.filter(timestamp__date__gte=week_ago)
-    weekly_stats = weekly_data.aggregate(
-        avg_co2=Avg('co2'),
-        avg_humidity=Avg('humidity'),
-        avg_temperature=Avg('temperature'),
-        avg_pm1_0=Avg('pm1_0'),
-        avg_pm2_5=Avg('pm2_5'),
-        avg_pm10_0=Avg('pm10_0'),
-        max_co2=Max('co2'),
-        max_humidity=Max('humidity'),
-        max_temperature=Max('temperature'),
-        max_pm1_0=Max('pm1_0'),
-        max_pm2_5=Max('pm2_5'),
-        max_pm10_0=Max('pm10_0'),
-        min_co2=Min('co2'),
-        min_humidity=Min('humidity'),
-        min_temperature=Min('temperature'),
-        min_pm1_0=Min('pm1_0'),
-        min_pm2_5=Min('pm2_5'),
-        min_pm10_0=Min('pm10_0'),
-    )
+    now = timezone.now()
+    weekly_stats = aggregate_range(local_day_start(week_ago), now)
     
     # Analyze data from the past 7 days by day
     daily_stats = {}
@@ -359,23 +330,22 @@ def analyze_view(request):
         6: "Sunday"
     }
     
-    # Calculate the average value for each day in the past 7 days
+    # Calculate the average value for each day in the past 7 days with one grouped query
+    tomorrow_start = local_day_start(today + datetime.timedelta(days=1))
+    per_day = grouped_stats(
+        SensorData.objects.filter(
+            timestamp__gte=local_day_start(today - datetime.timedelta(days=6)),
+            timestamp__lt=tomorrow_start
+        ),
+        TruncDate('timestamp', tzinfo=local_tz)
+    )
     for i in range(7):
         day_date = today - datetime.timedelta(days=i)
-        day_name = days_of_week[day_date.weekday()]
-        
-        day_data = SensorData.objects.filter(timestamp__date=day_date)
-        if day_data.exists():
-            day_stats = day_data.aggregate(
-                avg_co2=Avg('co2'),
-                avg_pm2_5=Avg('pm2_5'),
-                avg_temperature=Avg('temperature'),
-                avg_humidity=Avg('humidity'),
-                count=Count('id')
-            )
+        day_stats = per_day.get(day_date)
+        if day_stats:
             daily_stats[i] = {
                 'date': day_date,
-                'name': day_name,
+                'name': days_of_week[day_date.weekday()],
                 'avg_co2': day_stats['avg_co2'],
                 'avg_pm2_5': day_stats['avg_pm2_5'],
                 'avg_temperature': day_stats['avg_temperature'],
@@ -396,37 +366,26 @@ def analyze_view(request):
     
     # Get data from the past 30 days
     month_ago = today - datetime.timedelta(days=30)
-    monthly_data = SensorData.objects.filter(timestamp__date__gte=month_ago)
-    monthly_stats = monthly_data.aggregate(
-        avg_co2=Avg('co2'),
-        avg_humidity=Avg('humidity'),
-        avg_temperature=Avg('temperature'),
-        avg_pm1_0=Avg('pm1_0'),
-        avg_pm2_5=Avg('pm2_5'),
-        avg_pm10_0=Avg('pm10_0'),
-    )
+    monthly_stats = aggregate_range(local_day_start(month_ago), now)
     
-    # Analyze data from the past 30 days by week
+    # Analyze data from the past 30 days by week (weeks start on Monday, local time)
     weekly_breakdown = {}
+    this_week_start = today - datetime.timedelta(days=today.weekday())
+    per_week = grouped_stats(
+        SensorData.objects.filter(
+            timestamp__gte=local_day_start(this_week_start - datetime.timedelta(weeks=3)),
+            timestamp__lt=local_day_start(this_week_start + datetime.timedelta(weeks=1))
+        ),
+        TruncWeek('timestamp', tzinfo=local_tz)
+    )
+    per_week = {timezone.localtime(week, local_tz).date(): stats for week, stats in per_week.items()}
     
     for i in range(4):  # Past 4 weeks
-        week_start = today - datetime.timedelta(days=today.weekday() + 7*i)
+        week_start = this_week_start - datetime.timedelta(weeks=i)
         week_end = week_start + datetime.timedelta(days=6)
+        week_stats = per_week.get(week_start)
         
-        week_data = SensorData.objects.filter(
-            timestamp__date__gte=week_start,
-            timestamp__date__lte=week_end
-        )
-        
-        if week_data.exists():
-            week_stats = week_data.aggregate(
-                avg_co2=Avg('co2'),
-                avg_pm2_5=Avg('pm2_5'),
-                avg_temperature=Avg('temperature'),
-                avg_humidity=Avg('humidity'),
-                count=Count('id')
-            )
-            
+        if week_stats:
             weekly_breakdown[i] = {
                 'start_date': week_start,
                 'end_date': week_end,
@@ -460,6 +419,77 @@ def analyze_view(request):
     if worst_day is not None and worst_day in daily_stats:
         daily_stats['worst_day'] = daily_stats[worst_day]
     
+    return {
+        'today_stats': today_stats,
+        'weekly_stats': weekly_stats,
+        'monthly_stats': monthly_stats,
+        'time_slots': time_slots,
+        'worst_slot': worst_slot,
+        'daily_stats': daily_stats,
+        'worst_day': worst_day,
+        'weekly_breakdown': weekly_breakdown,
+        'worst_week': worst_week,
+    }
+
+def analysis_cache_key(today, latest_data, data_generation):
+    """
+    Cache key for the analysis statistics: the local date plus the newest reading,
+    an ingest generation so readings stored with older timestamps also miss, and
+    the sensor data generation so edited or deleted readings miss too.
+    """
+    generation = f'{cache.get(ANALYSIS_CACHE_GENERATION_KEY, 0)}.{data_generation}'
+    if latest_data is None:
+        return f'analysis:{today.isoformat()}:empty:{generation}'
+    return f'analysis:{today.isoformat()}:{latest_data.id}:{latest_data.timestamp.timestamp()}:{generation}'
+
+def get_analysis_stats(today, key):
+    """Return (stats, hit), computing and caching the statistics under `key` on a miss"""
+    stats = cache.get(key)
+    if stats is not None:
+        return stats, True
+    stats = compute_analysis_stats(today)
+    cache.set(key, stats, getattr(settings, 'ANALYSIS_CACHE_TIMEOUT', 60 * 60 * 24))
+    return stats, False
+
+def analysis_validator(request, key, today, latest_data, changed_at):
+    """
+    (etag, last_modified) of the analysis page: the statistics cache key plus
+    what else the rendered page depends on (user, CSRF token, language).
+    The page also changes at local midnight and when readings were edited or
+    deleted (changed_at).
+    """
+    etag = make_etag(key, request.user.pk, request.META.get('CSRF_COOKIE'), get_language())
+    last_modified = timezone.make_aware(datetime.datetime.combine(today, datetime.time.min))
+    if latest_data is not None:
+        last_modified = max(last_modified, latest_data.timestamp)
+    if changed_at is not None:
+        last_modified = max(last_modified, changed_at)
+    return etag, last_modified
+
+@login_required
+def analyze_view(request):
+    """Display analysis of current and historical sensor data with recommendations"""
+    
+    # Get the latest sensor data from the in-memory snapshot
+    latest_data = current_sensor_state().latest
+    today = timezone.localtime(timezone.now()).date()
+    
+    # The page only changes with the data, the date and the user's session, so a
+    # browser revalidating its copy gets a 304 without any statistics being read
+    generation, changed_at = data_generation()
+    key = analysis_cache_key(today, latest_data, generation)
+    etag, last_modified = analysis_validator(request, key, today, latest_data, changed_at)
+    response = not_modified_response(request, etag, last_modified)
+    if response is not None:
+        return response
+    
+    # Statistics only change when new readings arrive, so they are cached per
+    # local date and latest reading; differences and recommendations are cheap
+    # and derived from the (possibly cached) statistics below
+    stats, cache_hit = get_analysis_stats(today, key)
+    today_stats = stats['today_stats']
+    weekly_stats = stats['weekly_stats']
+    
     # Pre-calculate differences to avoid arithmetic operations in the template
     differences = {}
     
@@ -538,21 +568,15 @@ def analyze_view(request):
             recommendations.append("PM10 concentration is slightly high, recommend maintaining indoor ventilation or using an air purifier.")
     
     context = {
+        **stats,  # Window statistics and time slot/day/week breakdowns
         'latest_data': latest_data,
-        'today_stats': today_stats,
-        'weekly_stats': weekly_stats,
-        'monthly_stats': monthly_stats,
         'recommendations': recommendations,
         'differences': differences,  # Add the difference dictionary to the context
-        'time_slots': time_slots,    # Add the time slot analysis
-        'worst_slot': worst_slot,    # The worst slot
-        'daily_stats': daily_stats,  # Daily statistics
-        'worst_day': worst_day,      # The worst day
-        'weekly_breakdown': weekly_breakdown,  # Weekly statistics
-        'worst_week': worst_week,    # The worst week
     }
     
-    return render(request, 'accounts/analyze.html', context)
+    response = render(request, 'accounts/analyze.html', context)
+    response['X-Analysis-Cache'] = 'hit' if cache_hit else 'miss'
+    return set_validator_headers(response, etag, last_modified)
 
 @login_required
 @require_POST # Ensure this view only accepts POST requests
@@ -15,6 +15,8 @@ class ChatbotConfig(AppConfig):
         # Ensure this runs only once, not in reload subprocesses if possible
         # (Checking sys.argv might be necessary for more complex setups)
         print("[ChatbotConfig] ready() method called.")
+
+        from . import search  # noqa: F401  Registers the Q&A index invalidation receivers
         
         # Import manager here to avoid circular imports or issues during initial setup
         from . import mcp_client_manager 
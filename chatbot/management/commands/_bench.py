@@ -0,0 +1,330 @@
+"""Shared helpers for the chatbot benchmark commands and tests (not a command itself)."""
+import json
+import multiprocessing
+import socket
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OPENAPI_SCHEMA = {
+    'openapi': '3.1.0',
+    'paths': {
+        '/get_latest_sensor_data': {'post': {'description': 'Latest reading'}},
+        '/get_sensor_data_in_range': {'post': {'description': 'Readings between two times'}},
+        '/get_user_profile': {'post': {'description': 'Profile of a user'}},
+    },
+}
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Load tests open hundreds of connections at once
+
+
+class StubMCPOHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like mcpo's uvicorn
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without this every keep-alive
+        # response waits for the client's delayed ACK (uvicorn sets it too)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.reply(OPENAPI_SCHEMA)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        arguments = json.loads(self.rfile.read(length) or b'{}')
+        tool = self.path.lstrip('/')
+        server = self.server
+        with server.lock:
+            server.calls.append(tool)
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delays.get(tool, server.delay))
+            self.reply({'tool': tool, 'arguments': arguments})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubMCPOServer:
+    """
+    mcpo stand-in on a free local port: answers every POST /<tool> with the
+    tool name and arguments after `delay` seconds (or delays[tool]). Counts
+    the TCP connections it accepted and keeps the peak number of calls in
+    flight.
+    """
+
+    def __init__(self, delay=0.0, delays=None):
+        self.httpd = StubHTTPServer(('127.0.0.1', 0), StubMCPOHandler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.connections = 0
+        self.httpd.calls = []
+        self.httpd.in_flight = 0
+        self.httpd.peak_in_flight = 0
+        self.httpd.delay = delay
+        self.httpd.delays = delays or {}
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def peak_in_flight(self):
+        return self.httpd.peak_in_flight
+
+    def reset_peak(self):
+        self.httpd.peak_in_flight = 0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def tool_call(call_id, name, arguments):
+    """A tool call as found in an OpenAI chat completion message"""
+    return SimpleNamespace(id=call_id, type='function',
+                           function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+class ScriptedChatClient:
+    """
+    Stand-in for openai.OpenAI: each chat.completions.create() returns the
+    next scripted turn, a list of tool calls, the final answer text or
+    (text, tool calls), and keeps the messages it was sent.
+
+    Generation takes first_token_s plus chunk_s per chunk (a word of the text,
+    or a half of the arguments of a tool call). With stream=True the chunks
+    are yielded as they are "generated", otherwise the whole message is
+    returned at the end.
+    """
+
+    def __init__(self, turns, first_token_s=0.0, chunk_s=0.0, **client_kwargs):
+        self.turns = list(turns)
+        self.first_token_s = first_token_s
+        self.chunk_s = chunk_s
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **kwargs):
+        self.requests.append(list(messages))
+        turn = self.turns.pop(0)
+        if stream:
+            return self._stream(turn)
+        time.sleep(self.first_token_s + self.chunk_s * len(self._deltas(turn)))
+        content, tool_calls = self._split(turn)
+        message = SimpleNamespace(role='assistant', content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _stream(self, turn):
+        time.sleep(self.first_token_s)
+        for delta in self._deltas(turn):
+            time.sleep(self.chunk_s)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    @staticmethod
+    def _split(turn):
+        """(content, tool_calls) of a scripted turn"""
+        if isinstance(turn, str):
+            return turn, None
+        if isinstance(turn, tuple):
+            return turn
+        return None, turn
+
+    @classmethod
+    def _deltas(cls, turn):
+        content, tool_calls = cls._split(turn)
+        deltas = []
+        if content:
+            deltas += [SimpleNamespace(content=word if i == 0 else ' ' + word, tool_calls=None)
+                       for i, word in enumerate(content.split(' '))]
+        for index, call in enumerate(tool_calls or ()):
+            arguments = call.function.arguments
+            half = len(arguments) // 2
+            deltas.append(SimpleNamespace(content=None, tool_calls=[SimpleNamespace(
+                index=index, id=call.id, type='function',
+                function=SimpleNamespace(name=call.function.name, arguments=arguments[:half]))]))
+            deltas.append(SimpleNamespace(content=None, tool_calls=[SimpleNamespace(
+                index=index, id=None, type=None,
+                function=SimpleNamespace(name=None, arguments=arguments[half:]))]))
+        return deltas
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length))
+        server = self.server
+        with server.lock:
+            server.requests.append(body)
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        try:
+            # Tool calls until the model got tool results for the user's message, then the answer
+            answered = body['messages'][-1]['role'] == 'tool'
+            message = ({'role': 'assistant', 'content': server.answer} if answered or not server.tool_calls else
+                       {'role': 'assistant', 'content': None, 'tool_calls': [
+                           {'id': f'call_{i}', 'type': 'function',
+                            'function': {'name': name, 'arguments': json.dumps(arguments)}}
+                           for i, (name, arguments) in enumerate(server.tool_calls)]})
+            time.sleep(server.delay)
+            if body.get('stream'):
+                self.stream(message)
+            else:
+                self.reply({'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                            'choices': [{'index': 0, 'message': message,
+                                         'finish_reason': 'tool_calls' if message.get('tool_calls') else 'stop'}]})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def stream(self, message):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        if message.get('tool_calls'):
+            deltas = [{'tool_calls': [{'index': i, **call}]} for i, call in enumerate(message['tool_calls'])]
+        else:
+            words = message['content'].split(' ')
+            deltas = [{'content': word if i == 0 else ' ' + word} for i, word in enumerate(words)]
+        for delta in deltas:
+            chunk = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': 'stub',
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+            self.wfile.write(b'data: %s\n\n' % json.dumps(chunk).encode())
+            self.wfile.flush()
+            time.sleep(self.server.chunk_delay)
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubLLMServer:
+    """
+    OpenAI-compatible chat completions endpoint on a free local port: the
+    first turn after the user's message asks for `tool_calls`
+    [(name, arguments), ...], the turn after the tool results answers
+    `answer`. Each completion starts after `delay` seconds; streamed ones send
+    a chunk per tool call or word every `chunk_delay` seconds. Keeps the
+    request bodies and the peak number of requests in flight.
+    """
+
+    def __init__(self, tool_calls=(), answer='Done.', delay=0.0, chunk_delay=0.0):
+        self.httpd = StubHTTPServer(('127.0.0.1', 0), StubLLMHandler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = []
+        self.httpd.in_flight = 0
+        self.httpd.peak_in_flight = 0
+        self.httpd.tool_calls = list(tool_calls)
+        self.httpd.answer = answer
+        self.httpd.delay = delay
+        self.httpd.chunk_delay = chunk_delay
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def peak_in_flight(self):
+        return self.httpd.peak_in_flight
+
+    def reset_peak(self):
+        self.httpd.peak_in_flight = 0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _serve_in_child(server_class, kwargs, conn):
+    with server_class(**kwargs) as server:
+        conn.send(server.url)
+        while True:
+            request = conn.recv()
+            if request is None:
+                return
+            action, name = request
+            value = getattr(server, name)
+            conn.send(value() if action == 'call' else value)
+
+
+class ServerProcess:
+    """
+    A stub server run in a child process, so that under load its threads do
+    not compete with the measured process for the GIL, as a remote service
+    would not. Attributes of the server are fetched from the child
+    (`.peak_in_flight`), and call() runs one of its methods there.
+    """
+
+    def __init__(self, server_class, **kwargs):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.get_context('spawn').Process(
+            target=_serve_in_child, args=(server_class, kwargs, child_conn), daemon=True)
+
+    def __enter__(self):
+        self._process.start()
+        self.url = self._conn.recv()
+        return self
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        self._conn.send(('get', name))
+        return self._conn.recv()
+
+    def call(self, name):
+        self._conn.send(('call', name))
+        return self._conn.recv()
+
+    def __exit__(self, *exc_info):
+        self._conn.send(None)
+        self._process.join(5)
@@ -0,0 +1,115 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.search import QAIndex, clean_text
+
+COMMON_WORDS = ['what', 'is', 'the', 'how', 'to', 'do', 'i', 'can', 'a', 'of', 'sensor', 'data', 'my']
+
+
+def scan_best_match(questions, query, threshold=0.6):
+    """find_best_match before the index: every question cleaned and scored per query"""
+    cleaned_query = clean_text(query)
+    query_words = cleaned_query.split()
+    best_match, best_score = None, 0
+    for pk, question in questions:
+        cleaned_question = clean_text(question)
+        question_words = set(cleaned_question.split())
+        word_matches = sum(1 for word in query_words if word in question_words)
+        exact_phrase_bonus = 3 if cleaned_query in cleaned_question else 0
+        if 'data' in query_words and 'analyze' in query_words and 'analyze' not in question_words:
+            continue
+        score = (word_matches / len(query_words) if query_words else 0) + exact_phrase_bonus
+        if score > best_score:
+            best_match, best_score = pk, score
+    return best_match if best_score > threshold else None
+
+
+def make_questions(count, rng, vocabulary):
+    questions = []
+    for pk in range(1, count + 1):
+        words = rng.sample(COMMON_WORDS, rng.randint(1, 3))
+        # Topic words drawn with a long tail, as in real FAQs
+        words += [vocabulary[min(int(rng.paretovariate(1.2)) - 1, len(vocabulary) - 1)] for _ in range(rng.randint(2, 5))]
+        rng.shuffle(words)
+        questions.append((pk, ' '.join(words) + '?'))
+    return questions
+
+
+def make_queries(questions, count, rng, vocabulary):
+    queries = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            # Nothing like any stored question
+            queries.append(' '.join(rng.sample(COMMON_WORDS, 2) + rng.sample(vocabulary, 2)))
+            continue
+        words = rng.choice(questions)[1].rstrip('?').split()
+        # Drop a word and add an unrelated one, so most queries are near misses of a stored question
+        words.pop(rng.randrange(len(words)))
+        words.append(rng.choice(vocabulary))
+        queries.append(' '.join(words))
+    return queries
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latencies(function, queries):
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(function(query))
+        timings.append(time.perf_counter() - started)
+    return timings, results
+
+
+class Command(BaseCommand):
+    help = 'Compare chatbot Q&A matching latency of the full scan and the BM25 term index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, nargs='+', default=[10_000, 100_000],
+                            help='Q&A entries per round')
+        parser.add_argument('--queries', type=int, default=500, help='Queries answered from the index per round')
+        parser.add_argument('--scan-queries', type=int, default=20,
+                            help='Queries answered by the full scan per round (it is slow)')
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Distinct topic words')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [f'term{i}' for i in range(options['vocabulary'])]
+        rows = []
+        disagreements = 0
+        for entries in options['entries']:
+            questions = make_questions(entries, rng, vocabulary)
+            queries = make_queries(questions, options['queries'], rng, vocabulary)
+            started = time.perf_counter()
+            index = QAIndex(questions)
+            build = time.perf_counter() - started
+
+            index_times, index_results = latencies(index.best_match, queries)
+            scan_queries = queries[:options['scan_queries']]
+            scan_times, scan_results = latencies(lambda query: scan_best_match(questions, query), scan_queries)
+            # Rankings differ by design; whether a query matches at all must not
+            disagreements += sum((found is None) != (expected is None)
+                                 for found, expected in zip(index_results, scan_results))
+            matched = sum(found is not None for found in index_results) / len(index_results)
+            rows.append((entries, build, scan_times, index_times, matched))
+
+        self.stdout.write(f"Queries per round: {options['queries']} on the index, {options['scan_queries']} on the scan")
+        self.stdout.write(f"{'entries':>8} {'build (s)':>10} {'scan p50 (ms)':>14} {'index p50 (ms)':>15} "
+                          f"{'index p99 (ms)':>15} {'speedup':>8} {'matched':>8}")
+        for entries, build, scan_times, index_times, matched in rows:
+            scan_p50 = percentile(scan_times, 0.5)
+            index_p50 = percentile(index_times, 0.5)
+            self.stdout.write(
+                f'{entries:8d} {build:10.2f} {scan_p50 * 1e3:14.2f} {index_p50 * 1e3:15.3f} '
+                f'{percentile(index_times, 0.99) * 1e3:15.3f} {scan_p50 / index_p50:7.0f}x {matched:8.0%}'
+            )
+        if disagreements:
+            self.stdout.write(self.style.ERROR(f'{disagreements} queries matched on one path only'))
+        else:
+            self.stdout.write(self.style.SUCCESS('The index matches exactly the queries the full scan matches'))
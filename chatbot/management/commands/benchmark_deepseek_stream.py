@@ -0,0 +1,81 @@
+import json
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from chatbot import views
+from chatbot.mcpo import DEFAULT_MCPO_SETTINGS, MCPOClient, percentile
+from sensor_api.management.commands._bench import benchmark_database
+from ._bench import ScriptedChatClient, StubMCPOServer, tool_call
+
+ANSWER = ' '.join(['The air quality was good for most of the day.'] * 6)
+
+
+class Command(BaseCommand):
+    help = ('Compare when the first answer text reaches the client for the JSON and the streaming '
+            'DeepSeek endpoint, for a tool turn followed by the answer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--first-token-ms', type=float, default=500.0, help='Model latency to the first chunk')
+        parser.add_argument('--chunk-ms', type=float, default=20.0, help='Model time per further chunk')
+        parser.add_argument('--delay-ms', type=float, default=200.0, help='Time the stub mcpo spends per tool call')
+        parser.add_argument('--requests', type=int, default=5, help='Chat requests per mode')
+
+    def handle(self, *args, **options):
+        first_token_s = options['first_token_ms'] / 1000
+        chunk_s = options['chunk_ms'] / 1000
+
+        def scripted_client(**kwargs):
+            calls = [tool_call('call_0', 'get_latest_sensor_data', {}),
+                     tool_call('call_1', 'get_sensor_data_in_range', {'start_time': '2024-01-01T00:00:00Z'})]
+            return ScriptedChatClient([calls, ANSWER], first_token_s=first_token_s, chunk_s=chunk_s)
+
+        rows = []
+        with benchmark_database(), StubMCPOServer(delay=options['delay_ms'] / 1000) as server:
+            user = User.objects.create_user('bench', password='bench')
+            user.profile.api_key = 'bench-key'
+            user.profile.save()
+            factory = RequestFactory()
+            client = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': server.url})
+            views.get_mcpo_openapi_schema.cache_clear()
+            with mock.patch.object(views, 'get_mcpo_client', return_value=client), \
+                    mock.patch.object(views.openai, 'OpenAI', scripted_client):
+                for name, stream in (('json', False), ('stream', True)):
+                    first_events, first_texts, totals = [], [], []
+                    for _ in range(options['requests']):
+                        request = factory.post('/chatbot/deepseek_api/',
+                                               json.dumps({'message': 'How was the air?', 'stream': stream}),
+                                               content_type='application/json')
+                        request.user = user
+                        started = time.perf_counter()
+                        response = views.deepseek_api_view(request)
+                        if not stream:
+                            # Nothing is shown before the whole response arrives
+                            assert json.loads(response.content)['response'] == ANSWER
+                            first_event = first_text = time.perf_counter() - started
+                        else:
+                            first_event = first_text = None
+                            text = []
+                            for event in response.streaming_content:
+                                elapsed = time.perf_counter() - started
+                                first_event = first_event if first_event is not None else elapsed
+                                if event.startswith(b'event: delta'):
+                                    first_text = first_text if first_text is not None else elapsed
+                                    text.append(json.loads(event.split(b'data: ', 1)[1])['content'])
+                            assert ''.join(text) == ANSWER
+                        totals.append(time.perf_counter() - started)
+                        first_events.append(first_event)
+                        first_texts.append(first_text)
+                    rows.append((name, first_events, first_texts, totals))
+            views.get_mcpo_openapi_schema.cache_clear()
+            client.close()
+
+        self.stdout.write(f"Model: {options['first_token_ms']} ms to the first chunk, {options['chunk_ms']} ms per chunk; "
+                          f"stub mcpo: {options['delay_ms']} ms per tool call; {options['requests']} requests per mode")
+        self.stdout.write(f"{'mode':>7} {'first event (ms)':>17} {'first text (ms)':>16} {'complete (ms)':>14}")
+        for name, first_events, first_texts, totals in rows:
+            self.stdout.write(f'{name:>7} {percentile(first_events, 0.5) * 1e3:17.0f} '
+                              f'{percentile(first_texts, 0.5) * 1e3:16.0f} {percentile(totals, 0.5) * 1e3:14.0f}')
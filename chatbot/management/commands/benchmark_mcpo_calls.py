@@ -0,0 +1,45 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from chatbot.mcpo import DEFAULT_MCPO_SETTINGS, MCPOClient, percentile
+from ._bench import StubMCPOServer
+
+TOOL = 'get_latest_sensor_data'
+
+
+class Command(BaseCommand):
+    help = 'Compare N sequential mcpo tool calls with a new connection each against the pooled client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=500, help='Sequential tool calls per path')
+        parser.add_argument('--delay-ms', type=float, default=0.0, help='Time the stub server spends per call')
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+        rows = []
+        with StubMCPOServer(delay=options['delay_ms'] / 1000) as server:
+            def unpooled():
+                # What call_mcpo_tool did before: a module-level requests.post per call
+                return requests.post(f'{server.url}/{TOOL}', json={}, timeout=10).json()
+
+            client = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': server.url})
+            for name, call in (('requests.post', unpooled), ('pooled client', lambda: client.call_tool(TOOL, {}))):
+                connections = server.connections
+                timings = []
+                started = time.perf_counter()
+                for _ in range(calls):
+                    call_started = time.perf_counter()
+                    call()
+                    timings.append(time.perf_counter() - call_started)
+                rows.append((name, time.perf_counter() - started, timings, server.connections - connections))
+            client.close()
+
+        self.stdout.write(f"Sequential calls per path: {calls}, stub mcpo answering after {options['delay_ms']} ms")
+        self.stdout.write(f"{'path':>14} {'total (s)':>10} {'p50 (ms)':>9} {'p99 (ms)':>9} {'connections':>12}")
+        for name, total, timings, connections in rows:
+            self.stdout.write(f'{name:>14} {total:10.3f} {percentile(timings, 0.5) * 1e3:9.3f} '
+                              f'{percentile(timings, 0.99) * 1e3:9.3f} {connections:12d}')
+        self.stdout.write(f'Speed-up: {rows[0][1] / rows[1][1]:.2f}x')
+        self.stdout.write(f'Per-tool metrics of the pooled client: {client.stats()}')
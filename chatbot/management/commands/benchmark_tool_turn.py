@@ -0,0 +1,65 @@
+import json
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from chatbot import views
+from chatbot.mcpo import DEFAULT_MCPO_SETTINGS, MCPOClient, percentile
+from sensor_api.management.commands._bench import benchmark_database
+from ._bench import ScriptedChatClient, StubMCPOServer, tool_call
+
+TOOL = 'get_sensor_data_in_range'
+
+
+class Command(BaseCommand):
+    help = ('Time deepseek_api_view end to end for a turn with several range queries, '
+            'calling the tools one after the other and concurrently')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tool-calls', type=int, default=4, help='Tool calls the model requests in one turn')
+        parser.add_argument('--delay-ms', type=float, default=200.0, help='Time the stub mcpo spends per tool call')
+        parser.add_argument('--requests', type=int, default=10, help='Chat requests per mode')
+
+    def handle(self, *args, **options):
+        count = options['tool_calls']
+        rows = []
+        with benchmark_database(), StubMCPOServer(delay=options['delay_ms'] / 1000) as server:
+            user = User.objects.create_user('bench', password='bench')
+            user.profile.api_key = 'bench-key'
+            user.profile.save()
+            factory = RequestFactory()
+
+            def turns():
+                # One turn of range queries over consecutive days, then the answer
+                calls = [tool_call(f'call_{i}', TOOL, {'start_time': f'2024-01-{i + 1:02d}T00:00:00Z',
+                                                       'end_time': f'2024-01-{i + 2:02d}T00:00:00Z'})
+                         for i in range(count)]
+                return [calls, 'Done.']
+
+            for name, parallel in (('sequential', 1), ('concurrent', DEFAULT_MCPO_SETTINGS['MAX_PARALLEL_CALLS'])):
+                client = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': server.url, 'MAX_PARALLEL_CALLS': parallel})
+                timings = []
+                views.get_mcpo_openapi_schema.cache_clear()
+                with mock.patch.object(views, 'get_mcpo_client', return_value=client), \
+                        mock.patch.object(views.openai, 'OpenAI', lambda **kwargs: ScriptedChatClient(turns())):
+                    for _ in range(options['requests']):
+                        request = factory.post('/chatbot/deepseek/api/', json.dumps({'message': 'Compare the last days'}),
+                                               content_type='application/json')
+                        request.user = user
+                        started = time.perf_counter()
+                        response = views.deepseek_api_view(request)
+                        timings.append(time.perf_counter() - started)
+                        assert len(json.loads(response.content)['tool_interactions']) == count
+                views.get_mcpo_openapi_schema.cache_clear()
+                client.close()
+                rows.append((name, timings))
+
+        self.stdout.write(f"{count} tool calls per turn, stub mcpo answering after {options['delay_ms']} ms, "
+                          f"{options['requests']} requests per mode")
+        self.stdout.write(f"{'mode':>11} {'p50 (ms)':>9} {'max (ms)':>9}")
+        for name, timings in rows:
+            self.stdout.write(f'{name:>11} {percentile(timings, 0.5) * 1e3:9.1f} {max(timings) * 1e3:9.1f}')
+        self.stdout.write(f'Speed-up: {percentile(rows[0][1], 0.5) / percentile(rows[1][1], 0.5):.2f}x')
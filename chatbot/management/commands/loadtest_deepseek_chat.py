@@ -0,0 +1,115 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from chatbot import views
+from chatbot.mcpo import percentile
+from sensor_api.management.commands._bench import benchmark_database
+from ._bench import ServerProcess, StubLLMServer, StubMCPOServer
+
+TOOL_CALLS = [('get_latest_sensor_data', {}),
+              ('get_sensor_data_in_range', {'start_time': '2024-01-01T00:00:00Z', 'end_time': '2024-01-02T00:00:00Z'})]
+
+
+def chat_body(session):
+    return json.dumps({'message': f'How was the air yesterday? ({session})'})
+
+
+class Command(BaseCommand):
+    help = ('Load test: concurrent DeepSeek chat sessions against stub LLM and mcpo servers, served by the '
+            'sync view on a pool of WSGI-like worker threads and by the async view on one event loop')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200, help='Chat sessions started at once')
+        parser.add_argument('--workers', type=int, default=16, help='Worker threads serving the sync view')
+        parser.add_argument('--llm-ms', type=float, default=500.0, help='Time the stub LLM takes per completion')
+        parser.add_argument('--mcpo-ms', type=float, default=100.0, help='Time the stub mcpo takes per tool call')
+
+    def handle(self, *args, **options):
+        sessions = options['sessions']
+        rows = []
+        with benchmark_database(), \
+                ServerProcess(StubLLMServer, tool_calls=TOOL_CALLS, answer='The air was fine.',
+                              delay=options['llm_ms'] / 1000) as llm, \
+                ServerProcess(StubMCPOServer, delay=options['mcpo_ms'] / 1000) as mcpo, \
+                override_settings(DEEPSEEK_BASE_URL=llm.url, MCPO={'BASE_URL': mcpo.url}):
+            user = User.objects.create_user('bench', password='bench')
+            user.profile.api_key = 'bench-key'
+            user.profile.save()
+            views.get_mcpo_openapi_schema.cache_clear()
+            # Tool chatter would dominate the output
+            with mock.patch('builtins.print'):
+                rows.append(self.run_sync(user, sessions, options['workers'], llm))
+                rows.append(self.run_async(user, sessions, llm))
+            views.get_mcpo_openapi_schema.cache_clear()
+
+        self.stdout.write(f"{sessions} concurrent chat sessions, each: completion with {len(TOOL_CALLS)} tool calls, "
+                          f"tool results, answer; stub LLM {options['llm_ms']} ms per completion, "
+                          f"stub mcpo {options['mcpo_ms']} ms per call")
+        self.stdout.write(f"{'view':>28} {'threads':>8} {'wall (s)':>9} {'chats/s':>8} {'p50 (ms)':>9} "
+                          f"{'p95 (ms)':>9} {'LLM peak':>9} {'probe wait (ms)':>16} {'errors':>7}")
+        for name, threads, wall, latencies, peak, probe, errors in rows:
+            self.stdout.write(f'{name:>28} {threads:8d} {wall:9.2f} {sessions / wall:8.1f} '
+                              f'{percentile(latencies, 0.5) * 1e3:9.0f} {percentile(latencies, 0.95) * 1e3:9.0f} '
+                              f'{peak:9d} {probe * 1e3:16.0f} {errors:7d}')
+        self.stdout.write('LLM peak: most completions in flight at once. Probe wait: how long a dashboard request '
+                          'made while the chats run waits to be served.')
+
+    def run_sync(self, user, sessions, workers, llm):
+        factory = RequestFactory()
+        llm.call('reset_peak')
+
+        def chat(session, submitted):
+            request = factory.post('/chatbot/deepseek_api/', chat_body(session), content_type='application/json')
+            request.user = user
+            response = views.deepseek_api_view(request)
+            return time.perf_counter() - submitted, response.status_code == 200
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(chat, session, started) for session in range(sessions)]
+            # A dashboard request arriving now queues behind the chats
+            probe_submitted = time.perf_counter()
+            probe = executor.submit(lambda: time.perf_counter() - probe_submitted)
+            results = [future.result() for future in futures]
+        wall = time.perf_counter() - started
+        return (f'sync view, {workers} workers', workers, wall, [latency for latency, ok in results],
+                llm.peak_in_flight, probe.result(), sum(not ok for latency, ok in results))
+
+    def run_async(self, user, sessions, llm):
+        factory = AsyncRequestFactory()
+        llm.call('reset_peak')
+
+        async def auser():
+            return user
+
+        async def chat(session, submitted):
+            request = factory.post('/chatbot/deepseek_api/async/', chat_body(session), content_type='application/json')
+            request.user = user
+            request.auser = auser
+            response = await views.deepseek_async_api_view(request)
+            return time.perf_counter() - submitted, response.status_code == 200
+
+        async def probe_wait():
+            submitted = time.perf_counter()
+            await asyncio.sleep(0.2)  # Once the chats are under way
+            submitted = time.perf_counter()
+            await asyncio.sleep(0)
+            return time.perf_counter() - submitted
+
+        async def main():
+            started = time.perf_counter()
+            results, probe = await asyncio.gather(
+                asyncio.gather(*(chat(session, started) for session in range(sessions))), probe_wait())
+            return time.perf_counter() - started, results, probe, threading.active_count()
+
+        wall, results, probe, threads = asyncio.run(main())
+        return ('async view, one event loop', threads, wall, [latency for latency, ok in results],
+                llm.peak_in_flight, probe, sum(not ok for latency, ok in results))
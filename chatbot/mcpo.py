@@ -0,0 +1,260 @@
+"""
+HTTP client for the mcpo proxy in front of the MCP server
+
+The DeepSeek tool loop calls mcpo once per tool call. A plain requests.post
+opens a new TCP connection every time; MCPOClient sends everything through one
+requests.Session whose connection pool keeps connections to mcpo alive, so
+only the first call of a pooled connection pays the connection setup. The pool
+is shared by all request threads of the process (urllib3 pools are
+thread-safe); POOL_MAXSIZE bounds the connections kept open.
+
+Only connection failures are retried, with exponential backoff: a tool call
+that reached mcpo may have had side effects (report_issue,
+update_user_profile), so a timeout or error response is returned as is.
+
+call_tools() runs the tool calls of one model turn concurrently on a bounded
+thread pool shared by the process (MAX_PARALLEL_CALLS workers), so a turn
+costs about its slowest call rather than the sum of all calls. Results come
+back in the order the calls were given.
+
+AsyncMCPOClient is the same for the async chat view: an httpx.AsyncClient
+pool (ASYNC_MAX_CONNECTIONS) with the same timeouts, connection retries and
+metrics, and call_tools() running a turn's calls as concurrent tasks. httpx
+clients belong to the event loop they were first used on, so
+get_async_mcpo_client() keeps one per loop; under uvicorn that is one per
+process.
+
+The latency of every call is recorded per tool; stats() returns count, errors
+and latency percentiles over the last LATENCY_SAMPLES calls of each tool.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MCPO_SETTINGS = {
+    'BASE_URL': 'http://localhost:8002',
+    'CONNECT_TIMEOUT_S': 3.0,
+    'READ_TIMEOUT_S': 10.0,
+    'SCHEMA_TIMEOUT_S': 5.0,
+    'POOL_MAXSIZE': 16,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.1,
+    'LATENCY_SAMPLES': 256,
+    'MAX_PARALLEL_CALLS': 8,
+    'ASYNC_MAX_CONNECTIONS': 100,
+}
+
+
+def get_mcpo_settings():
+    return {**DEFAULT_MCPO_SETTINGS, **getattr(settings, 'MCPO', {})}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ToolLatency:
+    """Call count, errors and recent latencies of one tool"""
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=samples)
+
+    def summary(self):
+        latencies = list(self.latencies)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'p50_ms': round(percentile(latencies, 0.5) * 1e3, 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1e3, 2) if latencies else None,
+            'max_ms': round(max(latencies) * 1e3, 2) if latencies else None,
+        }
+
+
+class ToolLatencyStats:
+    """Per-tool call metrics shared by the sync and async clients"""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def _record(self, tool_name, seconds, ok):
+        with self._lock:
+            latency = self._latency.get(tool_name)
+            if latency is None:
+                latency = self._latency[tool_name] = ToolLatency(self.samples)
+            latency.calls += 1
+            latency.errors += not ok
+            latency.latencies.append(seconds)
+        logger.debug('mcpo tool %s took %.1f ms (%s)', tool_name, seconds * 1e3, 'ok' if ok else 'error')
+
+    def stats(self):
+        """{tool name: {'calls', 'errors', 'p50_ms', 'p95_ms', 'max_ms'}}"""
+        with self._lock:
+            return {tool_name: latency.summary() for tool_name, latency in self._latency.items()}
+
+
+class MCPOClient(ToolLatencyStats):
+    """Pooled keep-alive session to mcpo with per-tool latency metrics"""
+
+    def __init__(self, config=None):
+        config = config or get_mcpo_settings()
+        super().__init__(config['LATENCY_SAMPLES'])
+        self.base_url = config['BASE_URL'].rstrip('/')
+        self.timeout = (config['CONNECT_TIMEOUT_S'], config['READ_TIMEOUT_S'])
+        self.schema_timeout = (config['CONNECT_TIMEOUT_S'], config['SCHEMA_TIMEOUT_S'])
+        retry = Retry(total=config['RETRIES'], connect=config['RETRIES'], read=0, status=0, other=0,
+                      backoff_factor=config['BACKOFF_FACTOR'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['POOL_MAXSIZE'], max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.max_parallel_calls = config['MAX_PARALLEL_CALLS']
+        self._executor = None
+
+    def get_openapi_schema(self):
+        """The OpenAPI schema describing the tools; raises requests.RequestException"""
+        response = self.session.get(f'{self.base_url}/openapi.json', timeout=self.schema_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def call_tool(self, tool_name, arguments):
+        """Result of one tool call, or {'mcp_tool_error': ...} when it failed"""
+        tool_url = f'{self.base_url}/{tool_name}'
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.post(tool_url, json=arguments, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            ok = True
+            return result
+        except requests.exceptions.RequestException as e:
+            logger.warning("Calling mcpo tool '%s' at %s failed: %s", tool_name, tool_url, e)
+            return {"mcp_tool_error": f"Failed to call tool '{tool_name}': {str(e)}"}
+        except json.JSONDecodeError:
+            logger.warning("Invalid JSON response from mcpo tool '%s' at %s", tool_name, tool_url)
+            return {"mcp_tool_error": f"Invalid JSON response from tool '{tool_name}'."}
+        finally:
+            self._record(tool_name, time.perf_counter() - started, ok)
+
+    def call_tools(self, calls):
+        """Results of [(tool_name, arguments), ...], called concurrently, in the same order"""
+        if len(calls) <= 1 or self.max_parallel_calls <= 1:
+            return [self.call_tool(tool_name, arguments) for tool_name, arguments in calls]
+        # call_tool handles its own errors, so map() never raises
+        return list(self._get_executor().map(lambda call: self.call_tool(*call), calls))
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_parallel_calls,
+                                                        thread_name_prefix='mcpo-tool')
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_mcpo_client():
+    """Return the process-wide MCPOClient"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MCPOClient()
+    return _client
+
+
+class AsyncMCPOClient(ToolLatencyStats):
+    """MCPOClient for async views, on an httpx.AsyncClient connection pool"""
+
+    def __init__(self, config=None):
+        config = config or get_mcpo_settings()
+        super().__init__(config['LATENCY_SAMPLES'])
+        self.base_url = config['BASE_URL'].rstrip('/')
+        self.timeout = httpx.Timeout(config['READ_TIMEOUT_S'], connect=config['CONNECT_TIMEOUT_S'])
+        self.schema_timeout = httpx.Timeout(config['SCHEMA_TIMEOUT_S'], connect=config['CONNECT_TIMEOUT_S'])
+        self.max_parallel_calls = config['MAX_PARALLEL_CALLS']
+        # httpx retries only failed connection attempts, like the Retry of MCPOClient
+        transport = httpx.AsyncHTTPTransport(retries=config['RETRIES'], limits=httpx.Limits(
+            max_connections=config['ASYNC_MAX_CONNECTIONS'], max_keepalive_connections=config['POOL_MAXSIZE']))
+        self.session = httpx.AsyncClient(transport=transport)
+        # Requests wait here rather than in the httpx pool, whose queue is scanned
+        # against every connection whenever a request starts or ends
+        self._slots = asyncio.Semaphore(config['ASYNC_MAX_CONNECTIONS'])
+
+    async def get_openapi_schema(self):
+        """The OpenAPI schema describing the tools; raises httpx.HTTPError"""
+        response = await self.session.get(f'{self.base_url}/openapi.json', timeout=self.schema_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def call_tool(self, tool_name, arguments):
+        """Result of one tool call, or {'mcp_tool_error': ...} when it failed"""
+        tool_url = f'{self.base_url}/{tool_name}'
+        started = time.perf_counter()
+        ok = False
+        try:
+            async with self._slots:
+                response = await self.session.post(tool_url, json=arguments, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            ok = True
+            return result
+        except httpx.HTTPError as e:
+            logger.warning("Calling mcpo tool '%s' at %s failed: %r", tool_name, tool_url, e)
+            return {"mcp_tool_error": f"Failed to call tool '{tool_name}': {e!r}"}
+        except json.JSONDecodeError:
+            logger.warning("Invalid JSON response from mcpo tool '%s' at %s", tool_name, tool_url)
+            return {"mcp_tool_error": f"Invalid JSON response from tool '{tool_name}'."}
+        finally:
+            self._record(tool_name, time.perf_counter() - started, ok)
+
+    async def call_tools(self, calls):
+        """Results of [(tool_name, arguments), ...], called concurrently, in the same order"""
+        semaphore = asyncio.Semaphore(max(1, self.max_parallel_calls))
+
+        async def call(tool_name, arguments):
+            async with semaphore:
+                return await self.call_tool(tool_name, arguments)
+
+        return await asyncio.gather(*(call(tool_name, arguments) for tool_name, arguments in calls))
+
+    async def close(self):
+        await self.session.aclose()
+
+
+_async_clients = weakref.WeakKeyDictionary()  # Event loop -> AsyncMCPOClient
+
+
+def get_async_mcpo_client():
+    """Return the AsyncMCPOClient of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncMCPOClient()
+    return client
@@ -0,0 +1,275 @@
+"""
+Ranking index for the rule-based chatbot
+
+The ChatbotQA questions and the FAQ keys are each indexed in a TermIndex: a
+sparse term -> document matrix in NumPy arrays (CSR layout: per term a slice
+of document positions and precomputed BM25 weights). Scoring a query adds up
+the postings of its terms with np.bincount, so the cost depends on how often
+the query's terms occur, not on a Python loop over every entry.
+
+ChatbotQA matching keeps its relevance gate: a question is a match when the
+share of query words it contains, plus 3 when it contains the whole cleaned
+query, exceeds MATCH_THRESHOLD (0.6 by default). Questions containing the
+whole query rank first, as before; the rest are ranked by BM25 rather than by
+the share of words, so rare words count for more than "what" or "sensor" and
+shorter questions win ties. Questions containing the query as a substring are
+found with a single str.find pass over all cleaned questions joined together.
+
+The FAQ gate is unchanged too: the share of the key's words found in the
+query must exceed FAQ_THRESHOLD (0.3); BM25 breaks ties.
+
+The ChatbotQA index is rebuilt lazily after a ChatbotQA is saved or deleted in
+this process, and at the latest INDEX_TTL_S after it was built, which covers
+changes made by other processes.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import Counter
+from functools import partial
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ChatbotQA
+
+DEFAULT_CHATBOT_SEARCH_SETTINGS = {
+    'INDEX_TTL_S': 60,
+    'MATCH_THRESHOLD': 0.6,
+    'FAQ_THRESHOLD': 0.3,
+    'BM25_K1': 1.2,
+    'BM25_B': 0.75,
+}
+
+# clean_text removes it, so it never occurs in a cleaned query
+SEPARATOR = '\x00'
+
+
+def get_chatbot_search_settings():
+    return {**DEFAULT_CHATBOT_SEARCH_SETTINGS, **getattr(settings, 'CHATBOT_SEARCH', {})}
+
+
+def clean_text(text):
+    """clean the text, remove the punctuation and special characters, keep the letters, numbers, spaces and decimal points"""
+    # remove the punctuation and special characters, except decimal points
+    # keep the letters, numbers, spaces and decimal points
+    cleaned_text = re.sub(r'[^\w\s\.]', '', text)
+    # convert to lower case
+    cleaned_text = cleaned_text.lower().strip()
+    return cleaned_text
+
+
+class TermIndex:
+    """Term -> document postings with precomputed BM25 weights"""
+
+    def __init__(self, documents, k1=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_K1'],
+                 b=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_B']):
+        """documents: a list of tokens per document"""
+        self.size = len(documents)
+        self.vocabulary = {}
+        term_ids, doc_ids, frequencies = [], [], []
+        lengths = np.zeros(self.size, dtype=np.float64)
+        self.distinct_terms = np.zeros(self.size, dtype=np.int32)
+        for doc, tokens in enumerate(documents):
+            counts = Counter(tokens)
+            lengths[doc] = len(tokens)
+            self.distinct_terms[doc] = len(counts)
+            for token, frequency in counts.items():
+                term_ids.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                doc_ids.append(doc)
+                frequencies.append(frequency)
+
+        term_ids = np.array(term_ids, dtype=np.int32)
+        # Stable, so every term's postings stay in document order
+        order = np.argsort(term_ids, kind='stable')
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)[order]
+        frequencies = np.array(frequencies, dtype=np.float64)[order]
+        document_frequency = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=self.indptr[1:])
+
+        idf = np.log((self.size - document_frequency + 0.5) / (document_frequency + 0.5) + 1.0)
+        average_length = lengths.mean() if self.size and lengths.any() else 1.0
+        norm = k1 * (1 - b + b * lengths[self.doc_ids] / average_length)
+        self.weights = np.repeat(idf, document_frequency) * frequencies * (k1 + 1) / (frequencies + norm)
+
+    def postings(self, token):
+        """Positions of the documents containing `token`"""
+        term = self.vocabulary.get(token)
+        if term is None:
+            return self.doc_ids[:0]
+        return self.doc_ids[self.indptr[term]:self.indptr[term + 1]]
+
+    def score(self, tokens):
+        """
+        Per document: how many of `tokens` it contains (a repeated token counts
+        every time) and its BM25 score for them
+        """
+        docs, repeats, weights = [], [], []
+        for token, repeat in Counter(tokens).items():
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.indptr[term], self.indptr[term + 1]
+            docs.append(self.doc_ids[start:end])
+            repeats.append(np.full(end - start, repeat, dtype=np.float64))
+            weights.append(self.weights[start:end] * repeat)
+        if not docs:
+            return np.zeros(self.size), np.zeros(self.size)
+        docs = np.concatenate(docs)
+        matches = np.bincount(docs, weights=np.concatenate(repeats), minlength=self.size)
+        bm25 = np.bincount(docs, weights=np.concatenate(weights), minlength=self.size)
+        return matches, bm25
+
+
+class QAIndex:
+    """Cleaned ChatbotQA questions in a TermIndex"""
+
+    def __init__(self, questions, k1=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_K1'],
+                 b=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_B']):
+        """questions: (id, question) pairs in id order"""
+        self.ids = []
+        cleaned_questions = []
+        self.starts = []
+        offset = 0
+        for pk, question in questions:
+            cleaned = clean_text(question)
+            self.ids.append(pk)
+            cleaned_questions.append(cleaned)
+            self.starts.append(offset)
+            offset += len(cleaned) + len(SEPARATOR)
+        self.text = SEPARATOR.join(cleaned_questions)
+        # Word sets, as the share of query words a question contains ignores repeats in the question
+        self.terms = TermIndex([list(set(cleaned.split())) for cleaned in cleaned_questions], k1, b)
+
+    @classmethod
+    def from_database(cls, k1=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_K1'], b=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_B']):
+        return cls(ChatbotQA.objects.order_by('pk').values_list('pk', 'question'), k1, b)
+
+    def containing(self, cleaned_query):
+        """Mask of the questions that contain `cleaned_query`"""
+        found = np.zeros(len(self.ids), dtype=bool)
+        if not cleaned_query:
+            found[:] = True
+            return found
+        start = self.text.find(cleaned_query)
+        while start != -1:
+            position = bisect.bisect_right(self.starts, start) - 1
+            found[position] = True
+            # Continue after the question just found
+            following = position + 1
+            if following == len(self.starts):
+                break
+            start = self.text.find(cleaned_query, self.starts[following])
+        return found
+
+    def search(self, query, k=5, threshold=DEFAULT_CHATBOT_SEARCH_SETTINGS['MATCH_THRESHOLD']):
+        """Up to `k` (id, BM25 score) pairs of the questions matching `query`, best first"""
+        if not self.ids:
+            return []
+        cleaned_query = clean_text(query)
+        query_words = cleaned_query.split()
+        matches, bm25 = self.terms.score(query_words)
+        phrase = self.containing(cleaned_query)
+        share = matches / len(query_words) if query_words else np.zeros(len(self.ids))
+        relevant = share + np.where(phrase, 3, 0) > threshold
+
+        # Avoid false triggers for certain keywords
+        if 'data' in query_words and 'analyze' in query_words:
+            with_analyze = np.zeros(len(self.ids), dtype=bool)
+            with_analyze[self.terms.postings('analyze')] = True
+            relevant &= with_analyze
+
+        candidates = np.flatnonzero(relevant)
+        # A question containing the whole query ranks before any other
+        if phrase[candidates].any():
+            candidates = candidates[phrase[candidates]]
+        scores = bm25[candidates]
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        # Highest score first; the lowest id wins a tie
+        order = np.lexsort((candidates, -scores))
+        return [(self.ids[candidates[i]], float(scores[i])) for i in order]
+
+    def best_match(self, query, threshold=DEFAULT_CHATBOT_SEARCH_SETTINGS['MATCH_THRESHOLD']):
+        """Id of the best matching question, or None"""
+        results = self.search(query, k=1, threshold=threshold)
+        return results[0][0] if results else None
+
+
+class FAQIndex:
+    """FAQ keys in a TermIndex"""
+
+    def __init__(self, questions, k1=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_K1'],
+                 b=DEFAULT_CHATBOT_SEARCH_SETTINGS['BM25_B']):
+        self.questions = list(questions)
+        self.terms = TermIndex([list(set(clean_text(question).split())) for question in self.questions], k1, b)
+
+    def best_match(self, cleaned_query, threshold=DEFAULT_CHATBOT_SEARCH_SETTINGS['FAQ_THRESHOLD']):
+        """The key with the largest share of its words in the query, if above `threshold`"""
+        if not self.questions:
+            return None
+        matches, bm25 = self.terms.score(set(cleaned_query.split()))
+        share = np.divide(matches, self.terms.distinct_terms, out=np.zeros(len(self.questions)),
+                          where=self.terms.distinct_terms > 0)
+        best = np.lexsort((-bm25, -share))[0]
+        if share[best] > threshold:
+            return self.questions[best]
+        return None
+
+
+class QAIndexCache:
+    """Builds the QAIndex on first use and again after invalidate() or INDEX_TTL_S"""
+
+    def __init__(self, ttl=DEFAULT_CHATBOT_SEARCH_SETTINGS['INDEX_TTL_S'], loader=QAIndex.from_database):
+        self.ttl = ttl
+        self.loader = loader
+        self._index = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._index = None
+
+    def get_index(self):
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._built_at < self.ttl:
+                return self._index
+            generation = self._generation
+        index = self.loader()
+        with self._lock:
+            # Not kept if a question changed while it was being loaded
+            if generation == self._generation:
+                self._index = index
+                self._built_at = time.monotonic()
+        return index
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_qa_index():
+    """Return the current QAIndex of this process"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_chatbot_search_settings()
+                _cache = QAIndexCache(ttl=config['INDEX_TTL_S'],
+                                      loader=partial(QAIndex.from_database, config['BM25_K1'], config['BM25_B']))
+    return _cache.get_index()
+
+
+@receiver(post_save, sender=ChatbotQA)
+@receiver(post_delete, sender=ChatbotQA)
+def invalidate_qa_index(sender, **kwargs):
+    if _cache is not None:
+        _cache.invalidate()
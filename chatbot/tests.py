@@ -1,8 +1,23 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+import json
+import random
+import re
+import socket
+import warnings
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
+from . import views
+from .management.commands._bench import ScriptedChatClient, StubLLMServer, StubMCPOServer, tool_call
+from .mcpo import DEFAULT_MCPO_SETTINGS, MCPOClient
 from .models import ChatbotQA
+from .search import FAQIndex, QAIndex, clean_text, get_qa_index
+from .views import FAQ, call_mcpo_tool
+
 
 class ChatbotQAModelTests(TestCase):
     """Test the functionality of the ChatbotQA model"""
@@ -67,6 +82,341 @@ class ChatbotQAModelTests(TestCase):
         self.assertIsNone(match)  # Should return None
 
 
+def scan_best_match(questions, query):
+    """The original find_best_match scoring, over every (id, question) pair"""
+    cleaned_query = clean_text(query)
+    query_words = cleaned_query.split()
+    best_match, best_score = None, 0
+    for pk, question in questions:
+        cleaned_question = clean_text(question)
+        question_words = set(cleaned_question.split())
+        word_matches = sum(1 for word in query_words if word in question_words)
+        exact_phrase_bonus = 3 if cleaned_query in cleaned_question else 0
+        if 'data' in query_words and 'analyze' in query_words and 'analyze' not in question_words:
+            continue
+        score = (word_matches / len(query_words) if query_words else 0) + exact_phrase_bonus
+        if score > best_score:
+            best_match, best_score = pk, score
+    return best_match if best_score > 0.6 else None
+
+
+def scan_faq_match(questions, cleaned_query):
+    """The original FAQ scan: the largest share of the key's words found in the query"""
+    best_match, best_match_score = None, 0
+    for question in questions:
+        query_words = set(cleaned_query.split())
+        question_words = set(clean_text(question).split())
+        score = len(query_words & question_words) / len(question_words) if question_words else 0
+        if score > best_match_score:
+            best_match, best_match_score = question, score
+    return best_match, best_match_score
+
+
+class QAIndexTests(TestCase):
+    """Questions sharing words with the query are ranked from the term index"""
+
+    WORDS = ['temperature', 'humidity', 'co2', 'pm2.5', 'sensor', 'data', 'analyze', 'how', 'to', 'what',
+             'is', 'the', 'high', 'level', 'export', 'alert', 'threshold', 'reset', 'temp', 'air']
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.questions = [(pk, ' '.join(rng.choice(self.WORDS) for _ in range(rng.randint(1, 6))) + rng.choice(['?', '', '!']))
+                          for pk in range(1, 400)]
+        self.queries = ['', '?', 'temp', 'analyze data', 'what is the temperature', 'sensor sensor', 'unrelated words',
+                        'pm2.5 level', 'ture hum'] + [' '.join(rng.choice(self.WORDS) for _ in range(rng.randint(1, 4)))
+                                                     for _ in range(300)]
+
+    def test_matches_when_the_full_scan_does(self):
+        index = QAIndex(self.questions)
+        questions = dict(self.questions)
+        for query in self.queries:
+            expected = scan_best_match(self.questions, query)
+            found = index.best_match(query)
+            self.assertEqual(found is None, expected is None, query)
+            if found is not None:
+                # Whatever is chosen passes the same relevance gate
+                self.assertIsNotNone(scan_best_match([(found, questions[found])], query), query)
+
+    def test_rare_words_rank_higher(self):
+        index = QAIndex([(1, 'sensor range'), (2, 'humidity sensor range'), (3, 'co2 sensor'),
+                         (4, 'pm2.5 sensor range')])
+        # Every question contains two of the three words; 'co2' is the rarest
+        self.assertEqual(index.best_match('co2 sensor range'), 3)
+        self.assertEqual([pk for pk, _ in index.search('co2 sensor range', k=2)], [3, 1])
+        # Containing the whole query still ranks first
+        self.assertEqual(index.best_match('humidity sensor'), 2)
+
+    def test_search_returns_top_k(self):
+        index = QAIndex(self.questions)
+        results = index.search('humidity sensor level', k=5)
+        self.assertLessEqual(len(results), 5)
+        scores = [score for _, score in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_faq_gate_matches_the_full_scan(self):
+        faq = FAQIndex(FAQ)
+        for query in ['how to use', 'contact', 'what sensor types', 'is my data secure', 'aqi', 'nothing here',
+                      'how to add data please', 'export', '']:
+            expected, expected_score = scan_faq_match(FAQ, query)
+            found = faq.best_match(query)
+            if expected_score > 0.3:
+                self.assertEqual(scan_faq_match([found], query)[1], expected_score, query)
+            else:
+                self.assertIsNone(found, query)
+
+    @override_settings(CHATBOT_SEARCH={'MATCH_THRESHOLD': 0.7})
+    def test_threshold_is_configurable(self):
+        ChatbotQA.objects.create(question='What is the temperature sensor?', answer='...')
+        # Two of three words: 0.67
+        self.assertIsNone(ChatbotQA.find_best_match('temperature sensor specs'))
+
+    def test_save_and_delete_rebuild_the_index(self):
+        self.assertIsNone(ChatbotQA.find_best_match('calibrate the humidity sensor'))
+        qa = ChatbotQA.objects.create(question='How to calibrate the humidity sensor', answer='...')
+        self.assertEqual(ChatbotQA.find_best_match('calibrate the humidity sensor'), qa)
+        qa.delete()
+        self.assertIsNone(ChatbotQA.find_best_match('calibrate the humidity sensor'))
+
+    def test_index_is_built_once(self):
+        ChatbotQA.objects.create(question='What is the temperature sensor?', answer='...')
+        get_qa_index()
+        with CaptureQueriesContext(connection) as ctx:
+            ChatbotQA.find_best_match('temperature sensor specs')
+        # The exact match lookup and fetching the match
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+
+class MCPOClientTests(TestCase):
+    """Tool calls go through one pooled keep-alive connection"""
+
+    def setUp(self):
+        self.server = StubMCPOServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.client_ = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': self.server.url})
+        self.addCleanup(self.client_.close)
+
+    def test_connection_is_reused(self):
+        for i in range(20):
+            result = self.client_.call_tool('get_latest_sensor_data', {'i': i})
+            self.assertEqual(result, {'tool': 'get_latest_sensor_data', 'arguments': {'i': i}})
+        self.assertEqual(self.server.connections, 1)
+        self.assertIn('paths', self.client_.get_openapi_schema())
+        self.assertEqual(self.server.connections, 1)
+
+    def test_latency_per_tool(self):
+        for tool in ('get_latest_sensor_data', 'get_latest_sensor_data', 'count_sensor_data_points'):
+            self.client_.call_tool(tool, {})
+        stats = self.client_.stats()
+        self.assertEqual(stats['get_latest_sensor_data']['calls'], 2)
+        self.assertEqual(stats['count_sensor_data_points']['errors'], 0)
+        self.assertIsNotNone(stats['count_sensor_data_points']['p95_ms'])
+
+    def test_unreachable_server(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+        client = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': url, 'RETRIES': 1, 'BACKOFF_FACTOR': 0})
+        with self.assertLogs('chatbot.mcpo', 'WARNING') as logs:
+            result = client.call_tool('get_latest_sensor_data', {})
+        self.assertIn('mcp_tool_error', result)
+        self.assertIn("Calling mcpo tool 'get_latest_sensor_data'", logs.output[0])
+        self.assertEqual(client.stats()['get_latest_sensor_data']['errors'], 1)
+
+    def test_call_mcpo_tool_uses_the_shared_client(self):
+        with mock.patch('chatbot.views.get_mcpo_client', return_value=self.client_):
+            self.assertEqual(call_mcpo_tool('report_issue', {'title': 'x'})['tool'], 'report_issue')
+
+
+class DeepSeekTestCase(TestCase):
+    """A logged-in user with an API key, a stub mcpo and no cached tool schema"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='testpass123')
+        self.user.profile.api_key = 'test-key'
+        self.user.profile.save()
+        self.client.login(username='alice', password='testpass123')
+        # The first call is the slowest, so results arrive out of order
+        self.server = StubMCPOServer(delays={'get_sensor_data_in_range': 0.3, 'get_latest_sensor_data': 0.1})
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        mcpo = MCPOClient({**DEFAULT_MCPO_SETTINGS, 'BASE_URL': self.server.url})
+        self.addCleanup(mcpo.close)
+        views.get_mcpo_openapi_schema.cache_clear()
+        self.addCleanup(views.get_mcpo_openapi_schema.cache_clear)
+        patcher = mock.patch.object(views, 'get_mcpo_client', return_value=mcpo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class DeepSeekToolCallTests(DeepSeekTestCase):
+    """The tool calls of one model turn go to mcpo concurrently"""
+
+    def ask(self, turns):
+        llm = ScriptedChatClient(turns)
+        with mock.patch.object(views.openai, 'OpenAI', return_value=llm):
+            response = self.client.post(reverse('chatbot:deepseek_api'), json.dumps({'message': 'hi'}),
+                                        content_type='application/json')
+        return response.json(), llm
+
+    def test_tool_calls_run_concurrently_in_order(self):
+        calls = [
+            tool_call('call_a', 'get_sensor_data_in_range', {'start_time': 'a'}),
+            tool_call('call_b', 'get_latest_sensor_data', {}),
+            tool_call('call_c', 'get_sensor_data_in_range', {'start_time': 'c'}),
+        ]
+        data, llm = self.ask([calls, 'Done.'])
+        self.assertGreaterEqual(self.server.peak_in_flight, 2)
+        self.assertEqual(data['response'], 'Done.')
+        tool_messages = [m for m in llm.requests[1] if isinstance(m, dict) and m['role'] == 'tool']
+        self.assertEqual([m['tool_call_id'] for m in tool_messages], ['call_a', 'call_b', 'call_c'])
+        self.assertEqual(json.loads(tool_messages[2]['content'])['arguments'], {'start_time': 'c'})
+        self.assertEqual([i['name'] for i in data['tool_interactions']],
+                         ['get_sensor_data_in_range', 'get_latest_sensor_data', 'get_sensor_data_in_range'])
+
+    def test_username_is_forced_to_current_user(self):
+        calls = [
+            tool_call('call_a', 'get_user_profile', {'username': 'mallory'}),
+            tool_call('call_b', 'get_user_profile', {}),
+        ]
+        data, llm = self.ask([calls, 'Done.'])
+        for interaction in data['tool_interactions']:
+            self.assertEqual(interaction['result']['arguments'], {'username': 'alice'})
+
+    def test_unknown_tool_and_invalid_arguments_keep_their_place(self):
+        bad_arguments = tool_call('call_b', 'get_latest_sensor_data', {})
+        bad_arguments.function.arguments = '{not json'
+        calls = [
+            tool_call('call_a', 'get_latest_sensor_data', {}),
+            bad_arguments,
+            tool_call('call_c', 'drop_tables', {}),
+        ]
+        data, llm = self.ask([calls, 'Done.'])
+        tool_messages = [m for m in llm.requests[1] if isinstance(m, dict) and m['role'] == 'tool']
+        self.assertEqual([m['tool_call_id'] for m in tool_messages], ['call_a', 'call_b', 'call_c'])
+        self.assertIn('error', json.loads(tool_messages[1]['content']))
+        self.assertIn('not found', json.loads(tool_messages[2]['content'])['error'])
+        self.assertEqual(self.server.calls, ['get_latest_sensor_data'])
+
+
+class DeepSeekStreamTests(DeepSeekTestCase):
+    """With "stream": true the tool loop is relayed as Server-Sent Events"""
+
+    def stream(self, turns):
+        llm = ScriptedChatClient(turns)
+        with mock.patch.object(views.openai, 'OpenAI', return_value=llm):
+            response = self.client.post(reverse('chatbot:deepseek_api'), json.dumps({'message': 'hi', 'stream': True}),
+                                        content_type='application/json')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            body = b''.join(response.streaming_content).decode()
+        events = [(event, json.loads(data)) for event, data in re.findall(r'event: (\w+)\ndata: (.*)\n\n', body)]
+        return events, llm
+
+    def test_deltas_tool_progress_and_done(self):
+        calls = [
+            tool_call('call_a', 'get_sensor_data_in_range', {'start_time': 'a'}),
+            tool_call('call_b', 'get_user_profile', {'username': 'mallory'}),
+        ]
+        events, llm = self.stream([calls, 'All good today.'])
+        self.assertEqual([event for event, data in events],
+                         ['tool_calls', 'tool_result', 'tool_result', 'delta', 'delta', 'delta', 'done'])
+        self.assertEqual(events[0][1]['calls'], [{'id': 'call_a', 'name': 'get_sensor_data_in_range'},
+                                                 {'id': 'call_b', 'name': 'get_user_profile'}])
+        self.assertEqual(events[1][1]['result']['arguments'], {'start_time': 'a'})
+        self.assertEqual(events[2][1]['result']['arguments'], {'username': 'alice'})
+        self.assertEqual(''.join(data['content'] for event, data in events if event == 'delta'), 'All good today.')
+        self.assertEqual(events[-1][1], {'response': 'All good today.'})
+
+        # The tool calls were assembled from their deltas and answered in order
+        assistant, *tool_messages = llm.requests[1][-3:]
+        self.assertEqual(assistant['tool_calls'][0]['function'],
+                         {'name': 'get_sensor_data_in_range', 'arguments': json.dumps({'start_time': 'a'})})
+        self.assertEqual([m['tool_call_id'] for m in tool_messages], ['call_a', 'call_b'])
+
+    def test_streamed_content_is_not_repeated_at_max_iterations(self):
+        turn = ('Let me check that.', [tool_call('call_a', 'get_latest_sensor_data', {})])
+        with mock.patch.object(views, 'MAX_TOOL_ITERATIONS', 1):
+            events, llm = self.stream([turn])
+        self.assertEqual([event for event, data in events],
+                         ['delta', 'delta', 'delta', 'delta', 'tool_calls', 'tool_result', 'done'])
+        self.assertEqual(''.join(data['content'] for event, data in events if event == 'delta'), 'Let me check that.')
+        # The text before the tool calls is on screen already; done does not repeat it
+        self.assertEqual(events[-1][1], {'response': ''})
+
+    async def test_streams_under_asgi(self):
+        llm = ScriptedChatClient(['Fine.'])
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(views.openai, 'OpenAI', return_value=llm), warnings.catch_warnings():
+            # Django warns before reading a sync iterator to the end
+            warnings.simplefilter('error')
+            response = await self.async_client.post(reverse('chatbot:deepseek_api'), {'message': 'hi', 'stream': True},
+                                                    content_type='application/json')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertIn(b'event: done\ndata: {"response": "Fine."}', body)
+
+    def test_errors_become_events(self):
+        events, llm = self.stream([])  # The model has nothing to say: create() raises
+        self.assertEqual([event for event, data in events], ['error'])
+
+
+class DeepSeekAsyncViewTests(TestCase):
+    """The async chat endpoint against stub DeepSeek and mcpo servers"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='testpass123')
+        self.user.profile.api_key = 'test-key'
+        self.user.profile.save()
+        self.mcpo = StubMCPOServer(delay=0.2)
+        self.llm = StubLLMServer(tool_calls=[('get_sensor_data_in_range', {'start_time': 'a'}),
+                                             ('get_user_profile', {'username': 'mallory'})],
+                                 answer='All good today.')
+        for server in (self.mcpo, self.llm):
+            server.__enter__()
+            self.addCleanup(server.__exit__, None, None, None)
+        overrides = override_settings(DEEPSEEK_BASE_URL=self.llm.url, MCPO={'BASE_URL': self.mcpo.url})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        views.get_mcpo_openapi_schema.cache_clear()
+        self.addCleanup(views.get_mcpo_openapi_schema.cache_clear)
+
+    async def post(self, stream=False):
+        await self.async_client.aforce_login(self.user)
+        return await self.async_client.post(reverse('chatbot:deepseek_async_api'),
+                                            {'message': 'hi', 'stream': stream}, content_type='application/json')
+
+    async def test_tool_loop(self):
+        data = (await self.post()).json()
+        self.assertGreaterEqual(self.mcpo.peak_in_flight, 2)  # The two mcpo calls overlap
+        self.assertEqual(data['response'], 'All good today.')
+        self.assertEqual([i['result']['arguments'] for i in data['tool_interactions']],
+                         [{'start_time': 'a'}, {'username': 'alice'}])
+        tool_messages = [m for m in self.llm.requests[1]['messages'] if m['role'] == 'tool']
+        self.assertEqual([m['tool_call_id'] for m in tool_messages], ['call_0', 'call_1'])
+
+    async def test_stream(self):
+        response = await self.post(stream=True)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = re.findall(r'event: (\w+)\n', body)
+        self.assertEqual(events, ['tool_calls', 'tool_result', 'tool_result', 'delta', 'delta', 'delta', 'done'])
+        self.assertIn('"username": "alice"', body)
+
+    def test_needs_asgi(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('chatbot:deepseek_async_api'), {'message': 'hi'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+    async def test_chat_page_uses_the_async_endpoint_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('chatbot:deepseek_chat'))
+        self.assertContains(response, reverse('chatbot:deepseek_async_api'))
+
+    def test_anonymous_is_redirected_to_login(self):
+        response = self.client.post(reverse('chatbot:deepseek_async_api'), {'message': 'hi'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+
+
 class ChatbotAPIViewTests(TestCase):
     """Test the functionality of the ChatbotAPIView"""
     
@@ -8,4 +8,5 @@ urlpatterns = [
     path('api/', views.chatbot_api, name='chatbot_api'),
     path('deepseek/', views.deepseek_chat_view, name='deepseek_chat'), # Page for DeepSeek chat
     path('deepseek_api/', views.deepseek_api_view, name='deepseek_api'), # API endpoint for DeepSeek chat
+    path('deepseek_api/async/', views.deepseek_async_api_view, name='deepseek_async_api'), # Same, for the ASGI application
 ] 
\ No newline at end of file
@@ -1,19 +1,27 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.urls import reverse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
+import asyncio
 import json
+import weakref
 import openai
-from sensor_api.models import SensorData
-from django.db.models import Avg, Max, Min
+from sensor_api.snapshot import current_sensor_state
+from sensor_api.aqi import calculate_aqi_from_pm, calculate_pm25_aqi, calculate_pm10_aqi
 from .models import ChatbotQA
-import re
+from .search import FAQIndex, clean_text, get_chatbot_search_settings
+from .mcpo import get_async_mcpo_client, get_mcpo_client
 from accounts.models import UserProfile
 import requests # Import requests
 from functools import lru_cache # For simple caching
 from django.utils import timezone
 import pytz
 from datetime import datetime
+from types import SimpleNamespace
 
 # Simple FAQ dictionary
 FAQ = {
@@ -52,6 +60,34 @@ QUESTION_SUGGESTIONS = [
     "What is the weather?"
 ]
 
+# FAQ answer for a suggested question, by the first phrase it contains
+SUGGESTION_PHRASES = [
+    ("contact support", "contact support"),
+    ("what is this system", "what is this system"),
+    ("how do i use", "how to use"),
+    ("features", "features"),
+    ("add a new data", "how to add data"),
+    ("who created", "who created"),
+    ("sensors are supported", "sensor types"),
+    ("export", "export data"),
+    ("system requirements", "system requirements"),
+    ("mobile", "mobile access"),
+]
+
+def suggestion_faq_key(suggestion):
+    """FAQ key answering a suggested question, or None when it is answered otherwise"""
+    for phrase, key in SUGGESTION_PHRASES:
+        if phrase in suggestion.lower():
+            return key
+    return None
+
+# Cleaned suggestion -> FAQ key, so a suggestion asked verbatim is one lookup
+SUGGESTION_FAQ_KEYS = {}
+for suggestion in QUESTION_SUGGESTIONS:
+    SUGGESTION_FAQ_KEYS.setdefault(clean_text(suggestion), suggestion_faq_key(suggestion))
+
+FAQ_INDEX = FAQIndex(FAQ)
+
 # Sensor data interpretation thresholds
 SENSOR_THRESHOLDS = {
     'co2': {
@@ -146,19 +182,16 @@ SENSOR_THRESHOLDS = {
 }
 
 # --- mcpo OpenAPI Schema Handling ---
-MCPO_OPENAPI_URL = "http://localhost:8002/openapi.json"
-MCPO_BASE_URL = "http://localhost:8002"
-
 @lru_cache(maxsize=1) # Simple cache for the OpenAPI schema
 def get_mcpo_openapi_schema():
     """Fetches and caches the OpenAPI schema from the mcpo proxy."""
+    client = get_mcpo_client()
     try:
-        response = requests.get(MCPO_OPENAPI_URL, timeout=5)
-        response.raise_for_status()
+        schema = client.get_openapi_schema()
         print("Successfully fetched mcpo OpenAPI schema.")
-        return response.json()
+        return schema
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Could not fetch mcpo OpenAPI schema from {MCPO_OPENAPI_URL}: {e}")
+        print(f"ERROR: Could not fetch mcpo OpenAPI schema from {client.base_url}/openapi.json: {e}")
         return None
 
 def parse_openapi_schema_for_tools(schema):
@@ -214,21 +247,125 @@ def parse_openapi_schema_for_tools(schema):
     return openai_tools
 
 def call_mcpo_tool(tool_name: str, arguments: dict):
-    """Calls the specified tool via the mcpo proxy."""
-    tool_url = f"{MCPO_BASE_URL}/{tool_name}"
-    try:
-        response = requests.post(tool_url, json=arguments, timeout=10)
-        response.raise_for_status()
-        # Return the JSON response, assuming it's the tool result
-        # mcpo might wrap it, adjust if needed
-        return response.json() 
-    except requests.exceptions.RequestException as e:
-        print(f"ERROR calling mcpo tool '{tool_name}' at {tool_url}: {e}")
-        # Return an error structure that can be serialized
-        return {"mcp_tool_error": f"Failed to call tool '{tool_name}': {str(e)}"}
-    except json.JSONDecodeError:
-        print(f"ERROR decoding JSON response from mcpo tool '{tool_name}' at {tool_url}")
-        return {"mcp_tool_error": f"Invalid JSON response from tool '{tool_name}'."}
+    """Calls the specified tool via the mcpo proxy, over the pooled keep-alive client."""
+    return get_mcpo_client().call_tool(tool_name, arguments)
+
+def call_mcpo_tools(calls):
+    """Calls [(tool_name, arguments), ...] concurrently via the mcpo proxy; results in the same order."""
+    return get_mcpo_client().call_tools(calls)
+
+async def acall_mcpo_tools(calls):
+    """call_mcpo_tools for async views, over the event loop's AsyncMCPOClient."""
+    return await get_async_mcpo_client().call_tools(calls)
+
+# Define user-specific tools that require username injection
+USER_SPECIFIC_TOOLS = {"report_issue", "get_user_profile", "update_user_profile"}
+USERNAME_ARG_MAP = { # Maps tool name to its username argument name
+    "report_issue": "reporter_username",
+    "get_user_profile": "username",
+    "update_user_profile": "username"
+}
+
+def prepare_tool_calls(tool_calls, available_functions, current_username):
+    """
+    Decodes the arguments of one model turn's tool calls and forces the
+    username of user-specific tools to the current user.
+
+    Returns [tool_call, function_name, args, result, logged] entries in the
+    order of tool_calls; the calls still to be sent to mcpo have result None.
+    """
+    prepared = []  # [tool_call, function_name, args or raw arguments, result, log it]
+    for tool_call in tool_calls:
+        function_name = tool_call.function.name
+        function_to_call = available_functions.get(function_name)
+        function_args = {}
+        function_result = None
+        is_valid_args = False
+        try:
+            function_args = json.loads(tool_call.function.arguments)
+            is_valid_args = True
+        except json.JSONDecodeError:
+            print(f"ERROR: Could not decode arguments for tool {function_name}: {tool_call.function.arguments}")
+            function_result = {"error": "Invalid arguments format from LLM."}
+        
+        # === Inject/Verify Username for User-Specific Tools ===
+        if function_name in USER_SPECIFIC_TOOLS and is_valid_args:
+            username_arg_name = USERNAME_ARG_MAP[function_name]
+            ai_provided_username = function_args.get(username_arg_name)
+            
+            if ai_provided_username and ai_provided_username != current_username:
+                print(f"Warning: Model tried to call {function_name} for user '{ai_provided_username}' but the current user is '{current_username}'. Forcing correct username.")
+            elif not ai_provided_username:
+                 print(f"Info: Model did not provide username for {function_name}. Injecting current user '{current_username}'.")
+                 
+            # Force the correct username
+            function_args[username_arg_name] = current_username
+            print(f"  - Updated args for {function_name}: {function_args}")
+        # =======================================================
+
+        if function_to_call and is_valid_args:
+            print(f"  - Calling tool: {function_name} with final args: {function_args}")
+            prepared.append([tool_call, function_name, function_args, None, True])
+        elif not function_to_call:
+             print(f"ERROR: Model requested unknown tool: {function_name}")
+             function_result = {"error": f"Tool '{function_name}' not found or configured."}
+             prepared.append([tool_call, function_name,
+                              function_args if is_valid_args else tool_call.function.arguments, function_result, True])
+        else: # invalid args already logged, result set
+             prepared.append([tool_call, function_name, function_args, function_result, False])
+    return prepared
+
+def finish_tool_calls(prepared, pending, results):
+    """
+    Stores the mcpo results of the pending entries of prepare_tool_calls().
+    Returns the tool messages and interaction log entries in the order of the
+    tool calls, and how many calls produced a result.
+    """
+    for entry, function_result in zip(pending, results):
+        print(f"  - Tool result: {function_result}")
+        entry[3] = function_result
+
+    tool_messages, interactions, tool_results_added = [], [], 0
+    for tool_call, function_name, function_args, function_result, logged in prepared:
+        if logged:
+            interactions.append({
+                'name': function_name,
+                'args': function_args, # Log the potentially modified args
+                'result': function_result
+            })
+        tool_messages.append(
+            {
+                "tool_call_id": tool_call.id,
+                "role": "tool",
+                "name": function_name,
+                "content": json.dumps(function_result), 
+            }
+        )
+        if function_result is not None:
+             tool_results_added += 1
+    return tool_messages, interactions, tool_results_added
+
+def run_tool_calls(tool_calls, available_functions, current_username):
+    """
+    Executes the tool calls of one model turn.
+
+    Arguments are decoded and the username of user-specific tools is forced to
+    the current user first, one call after the other; then all valid calls go
+    to mcpo concurrently. Returns the tool messages and interaction log entries
+    in the order of tool_calls, and how many calls produced a result.
+    """
+    prepared = prepare_tool_calls(tool_calls, available_functions, current_username)
+    # All calls of the turn at once: the turn waits for the slowest, not for the sum
+    pending = [entry for entry in prepared if entry[3] is None]
+    results = call_mcpo_tools([(entry[1], entry[2]) for entry in pending])
+    return finish_tool_calls(prepared, pending, results)
+
+async def arun_tool_calls(tool_calls, available_functions, current_username):
+    """run_tool_calls() for the async view"""
+    prepared = prepare_tool_calls(tool_calls, available_functions, current_username)
+    pending = [entry for entry in prepared if entry[3] is None]
+    results = await acall_mcpo_tools([(entry[1], entry[2]) for entry in pending])
+    return finish_tool_calls(prepared, pending, results)
 
 @login_required
 def chatbot_view(request):
@@ -286,67 +423,6 @@ def get_sensor_data_interpretation(sensor_type, value):
     
     return f"{sensor_type}: {value}{unit}"
 
-def calculate_aqi_from_pm(pm25_value, pm10_value):
-    """Calculate AQI value from PM2.5 and PM10"""
-    # PM2.5 AQI calculation
-    pm25_aqi = calculate_pm25_aqi(pm25_value)
-    
-    # PM10 AQI calculation
-    pm10_aqi = calculate_pm10_aqi(pm10_value)
-    
-    # Take the maximum of the two as AQI
-    aqi = max(pm25_aqi, pm10_aqi)
-    
-    return round(aqi)
-
-def calculate_pm25_aqi(pm25):
-    """Calculate PM2.5 AQI value"""
-    # PM2.5 concentration to AQI mapping
-    pm25_breakpoints = [
-        (0, 12, 0, 50),
-        (12.1, 35.4, 51, 100),
-        (35.5, 55.4, 101, 150),
-        (55.5, 150.4, 151, 200),
-        (150.5, 250.4, 201, 300),
-        (250.5, 350.4, 301, 400),
-        (350.5, 500.4, 401, 500)
-    ]
-    
-    for low_conc, high_conc, low_aqi, high_aqi in pm25_breakpoints:
-        if low_conc <= pm25 <= high_conc:
-            # Linear interpolation to calculate AQI
-            aqi = ((high_aqi - low_aqi) / (high_conc - low_conc)) * (pm25 - low_conc) + low_aqi
-            return aqi
-    
-    # If out of range
-    if pm25 > 500.4:
-        return 500
-    return 0
-
-def calculate_pm10_aqi(pm10):
-    """Calculate PM10 AQI value"""
-    # PM10 concentration to AQI mapping
-    pm10_breakpoints = [
-        (0, 54, 0, 50),
-        (55, 154, 51, 100),
-        (155, 254, 101, 150),
-        (255, 354, 151, 200),
-        (355, 424, 201, 300),
-        (425, 504, 301, 400),
-        (505, 604, 401, 500)
-    ]
-    
-    for low_conc, high_conc, low_aqi, high_aqi in pm10_breakpoints:
-        if low_conc <= pm10 <= high_conc:
-            # Linear interpolation to calculate AQI
-            aqi = ((high_aqi - low_aqi) / (high_conc - low_conc)) * (pm10 - low_conc) + low_aqi
-            return aqi
-    
-    # If out of range
-    if pm10 > 604:
-        return 500
-    return 0
-
 def get_aqi_level(aqi):
     """Get AQI level description"""
     if aqi <= 50:
@@ -368,18 +444,17 @@ def get_sensor_info(query):
         # clean the query
         cleaned_query = clean_text(query)
         
-        # get the latest sensor data
-        latest_data = SensorData.objects.order_by('-timestamp').first()
-        
-        # calculate the average values
-        avg_data = SensorData.objects.aggregate(
-            avg_temp=Avg('temperature'),
-            avg_humidity=Avg('humidity'),
-            avg_co2=Avg('co2'),
-            avg_pm1=Avg('pm1_0'),
-            avg_pm25=Avg('pm2_5'),
-            avg_pm10=Avg('pm10_0')
-        )
+        # get the latest sensor data and the running averages from the in-memory snapshot
+        state = current_sensor_state()
+        latest_data = state.latest
+        avg_data = {
+            'avg_temp': state.average('temperature'),
+            'avg_humidity': state.average('humidity'),
+            'avg_co2': state.average('co2'),
+            'avg_pm1': state.average('pm1_0'),
+            'avg_pm25': state.average('pm2_5'),
+            'avg_pm10': state.average('pm10_0'),
+        }
         
         # query about AQI
         if any(word in cleaned_query for word in ['aqi', 'air quality index', 'air index']):
@@ -387,7 +462,7 @@ def get_sensor_info(query):
                 return "No air quality data available."
             
             # calculate the AQI
-            aqi_value = calculate_aqi_from_pm(latest_data.pm2_5, latest_data.pm10_0)
+            aqi_value = state.aqi
             aqi_level = get_aqi_level(aqi_value)
             
             result = f"Current AQI: {aqi_value}\n"
@@ -445,7 +520,7 @@ def get_sensor_info(query):
                 return "No air quality data available."
             
             # 计算AQI
-            aqi_value = calculate_aqi_from_pm(latest_data.pm2_5, latest_data.pm10_0)
+            aqi_value = state.aqi
             aqi_level = get_aqi_level(aqi_value)
             
             result = f"Air Quality Status:\n"
@@ -483,7 +558,7 @@ def get_sensor_info(query):
                 return "No sensor data available."
             
             # calculate the AQI
-            aqi_value = calculate_aqi_from_pm(latest_data.pm2_5, latest_data.pm10_0)
+            aqi_value = state.aqi
             
             result = "Latest Sensor Readings:\n"
             result += f"Time: {latest_data.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n"
@@ -502,15 +577,6 @@ def get_sensor_info(query):
     except Exception as e:
         return f"Error analyzing sensor data: {str(e)}"
 
-def clean_text(text):
-    """clean the text, remove the punctuation and special characters, keep the letters, numbers, spaces and decimal points"""
-    # remove the punctuation and special characters, except decimal points
-    # keep the letters, numbers, spaces and decimal points
-    cleaned_text = re.sub(r'[^\w\s\.]', '', text)
-    # convert to lower case
-    cleaned_text = cleaned_text.lower().strip()
-    return cleaned_text
-
 @login_required
 @require_POST
 def chatbot_api(request):
@@ -522,32 +588,9 @@ def chatbot_api(request):
             cleaned_query = clean_text(query)  # use the cleaned query
 
             # directly match the questions in the question suggestion list
-            for suggestion in QUESTION_SUGGESTIONS:
-                cleaned_suggestion = clean_text(suggestion)
-                if cleaned_query == cleaned_suggestion:
-                    # find the corresponding FAQ keyword
-                    if "contact support" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["contact support"], 'status': 'success'})
-                    elif "what is this system" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["what is this system"], 'status': 'success'})
-                    elif "how do i use" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["how to use"], 'status': 'success'})
-                    elif "features" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["features"], 'status': 'success'})
-                    elif "add a new data" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["how to add data"], 'status': 'success'})
-                    elif "add a new sensor" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["how to add sensor"], 'status': 'success'})
-                    elif "who created" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["who created"], 'status': 'success'})
-                    elif "sensors are supported" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["sensor types"], 'status': 'success'})
-                    elif "export" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["export data"], 'status': 'success'})
-                    elif "system requirements" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["system requirements"], 'status': 'success'})
-                    elif "mobile" in suggestion.lower():
-                        return JsonResponse({'response': FAQ["mobile access"], 'status': 'success'})
+            faq_key = SUGGESTION_FAQ_KEYS.get(cleaned_query)
+            if faq_key:
+                return JsonResponse({'response': FAQ[faq_key], 'status': 'success'})
             
             # specific keyword matching
             if "contact" in cleaned_query and any(word in cleaned_query for word in ["support", "help", "service"]):
@@ -603,24 +646,10 @@ def chatbot_api(request):
                 return JsonResponse({'response': db_match.answer, 'status': 'success'})
                 
             # 如果没有找到匹配的数据库问答对，尝试使用内置FAQ
-            best_match = None
-            best_match_score = 0
-            
-            for question in FAQ:
-                cleaned_faq_question = clean_text(question)
-                # improved keyword matching
-                query_words = set(cleaned_query.split())
-                question_words = set(cleaned_faq_question.split())
-                # calculate the size of the intersection of the two sets
-                common_words = query_words.intersection(question_words)
-                score = len(common_words) / len(question_words) if question_words else 0
-                
-                if score > best_match_score:
-                    best_match = question
-                    best_match_score = score
+            best_match = FAQ_INDEX.best_match(cleaned_query, get_chatbot_search_settings()['FAQ_THRESHOLD'])
             
             # If a match is found, return the answer
-            if best_match and best_match_score > 0.3:  # Decrease threshold to increase matching probability
+            if best_match:
                 response = FAQ[best_match]
             else:
                 response = "I'm sorry, I don't have an answer to that question. Please try asking something about the system features, usage, sensor data, or contact information. Type 'help' to see what you can ask."
@@ -642,76 +671,300 @@ def chatbot_api(request):
 
 # --- DeepSeek Chat Views ---
 
+MAX_TOOL_ITERATIONS = 15
+MAX_HISTORY_MESSAGES = 10
+
+def build_deepseek_messages(request, user_message, history, current_username):
+    """System prompt, the recent valid history from the client and the user's message"""
+    # Validate and sanitize history (basic validation)
+    validated_history = []
+    if isinstance(history, list):
+        for msg in history:
+            if isinstance(msg, dict) and 'role' in msg and 'content' in msg and msg['role'] in ['user', 'assistant']:
+                 validated_history.append({'role': msg['role'], 'content': str(msg['content'])}) 
+
+    validated_history = validated_history[-MAX_HISTORY_MESSAGES:]
+
+    # === Get user timezone from request headers ===
+    user_timezone_str = request.META.get('HTTP_X_TIMEZONE')
+    if user_timezone_str:
+        try:
+            user_timezone = pytz.timezone(user_timezone_str)
+            current_time = datetime.now(user_timezone).strftime("%Y-%m-%d %H:%M:%S %Z")
+        except:
+            current_time = timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z")
+    else:
+        current_time = timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z")
+
+    # === Add System Prompt ===
+    user_timezone_info = f" (user's local timezone: {user_timezone_str})" if user_timezone_str else " (server timezone)"
+    system_prompt = (
+        f"You are an intelligent assistant designed for the Air Monitoring Interface (AMI) system. The current date and time is {current_time}{user_timezone_info}. "
+        f"IMPORTANT TIMEZONE INSTRUCTIONS: "
+        f"- The user is currently in timezone '{user_timezone_str or 'server default'}'. ALL time-related queries and responses should be interpreted and presented in the user's timezone context. "
+        f"- When using time-based tools (get_sensor_data_summary, get_sensor_data_in_range), you MUST convert user's time references to proper ISO 8601 format with timezone information. "
+        f"- When presenting time data to the user, always consider their timezone context. If the user asks about 'yesterday', 'this morning', 'last week', etc., calculate these relative to their current local time. "
+        f"- Always include timezone information when calling time-based MCP tools. Use formats like '2023-10-27T10:00:00Z' (UTC) or '2023-10-27T18:00:00+08:00' (with timezone offset). "
+        f"SENSOR QUALITY THRESHOLDS:\n"
+        f"- Temperature: <18°C (Cold), 18-25°C (Comfortable), 25-30°C (Hot), >30°C (Very Hot)\n"
+        f"- Humidity: <30% (Dry), 30-60% (Comfortable), 60-70% (Humid), >70% (Very Humid)\n"
+        f"- CO2: <800ppm (Good), 800-1500ppm (Moderate), 1500-2000ppm (Poor), >2000ppm (Very Poor)\n"
+        f"- PM1.0: <10μg/m³ (Good), 10-25 (Moderate), 25-45 (Unhealthy), >45 (Very Unhealthy)\n"
+        f"- PM2.5: <12μg/m³ (Good), 12-35.4 (Moderate), 35.4-55.4 (Unhealthy), >55.4 (Very Unhealthy)\n"
+        f"- PM10: <54μg/m³ (Good), 54-154 (Moderate), 154-254 (Unhealthy), >254 (Very Unhealthy)\n"
+        f"- AQI: 0-50 (Good), 51-100 (Moderate), 101-150 (Unhealthy for Sensitive), 151-200 (Unhealthy), 201-300 (Very Unhealthy), 301+ (Hazardous)\n"
+        f"Your primary role is to assist user '{current_username}' in querying real-time or historical sensor data, providing air quality related explanations, and managing user data (such as reporting issues, viewing, or updating personal settings). "
+        f"When the user requests to query data or perform system operations, you should strive to use the available tools to provide accurate and timely information, and offer relevant analysis or suggestions based on the data. "
+        f"Under all circumstances, you MUST ensure that all your actions are restricted to the current user '{current_username}'. When using tools such as 'report_issue', 'get_user_profile', or 'update_user_profile', you MUST and can ONLY act on behalf of user '{current_username}'. It is strictly forbidden to attempt to access or modify information for other users, or to impersonate others. If the user asks you to perform these actions for someone else, politely refuse and reiterate that you can only serve '{current_username}'. "
+        f"Your responses should be clear, concise, professional, and helpful. If you cannot answer a specific question or perform an operation, please state so honestly and guide the user to ask a clearer question or provide alternative solutions. "
+        f"Please remember that your main goal is to provide assistance related to the AMI system's functionalities. For questions outside this scope, you may politely decline to answer or guide the user towards questions within the system's capabilities."
+        f"If the user asks about the system's purpose, features, Q&A, or how it works, you should use the tool to get the information, don't base your response on your hallucination."
+    )
+
+    # Start conversation message list with system prompt, then history, then current user message
+    return [
+        {"role": "system", "content": system_prompt}
+    ] + validated_history + [{"role": "user", "content": user_message}]
+
+def get_deepseek_tools():
+    """The mcpo tools in OpenAI tool format, or [] when the schema cannot be fetched."""
+    openapi_schema = get_mcpo_openapi_schema()
+    if not openapi_schema:
+        print("Warning: Proceeding without MCP tools as schema fetch failed.")
+        return []
+    return parse_openapi_schema_for_tools(openapi_schema)
+
+def deepseek_error(e):
+    """(message, HTTP status) to report for an exception of the DeepSeek chat"""
+    if isinstance(e, openai.AuthenticationError):
+        return 'DeepSeek API authentication failed. Check API Key in profile.', 401
+    if isinstance(e, openai.RateLimitError):
+        return 'DeepSeek API rate limit exceeded.', 429
+    if isinstance(e, openai.APIConnectionError):
+        return 'Could not connect to DeepSeek API.', 503
+    # Catch-all for other errors (JSON parsing, unexpected issues)
+    print(f"Error in DeepSeek API view: {e}") 
+    import traceback
+    print(traceback.format_exc()) # Print full traceback for debugging
+    return f'An unexpected error occurred: {str(e)}', 500
+
+def last_assistant_content(messages):
+    """Content of the last assistant message, an OpenAI message object or a dict"""
+    for message in reversed(messages):
+        if isinstance(message, dict):
+            if message['role'] == 'assistant':
+                return message.get('content')
+        elif getattr(message, 'role', None) == 'assistant':
+            return message.content
+    return None
+
+def sse_event(event, payload):
+    """One Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tell nginx not to buffer the stream
+    return response
+
+async def iterate_in_thread(iterator):
+    """Async iterator over a blocking iterator, each item fetched in a worker thread"""
+    done = object()
+    while True:
+        item = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+        if item is done:
+            return
+        yield item
+
+class StreamedMessage:
+    """An assistant message assembled from the chunks of a stream=True completion"""
+
+    def __init__(self):
+        self.content_parts = []
+        self.calls = {}  # Tool call deltas by index: {'id', 'name', 'arguments'}
+
+    def add(self, chunk):
+        """Fold in one chunk; returns its content text, if any"""
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        for call_delta in delta.tool_calls or []:
+            call = self.calls.setdefault(call_delta.index, {'id': None, 'name': '', 'arguments': ''})
+            if call_delta.id:
+                call['id'] = call_delta.id
+            if call_delta.function is not None:
+                call['name'] += call_delta.function.name or ''
+                call['arguments'] += call_delta.function.arguments or ''
+        if delta.content:
+            self.content_parts.append(delta.content)
+        return delta.content or None
+
+    @property
+    def content(self):
+        return ''.join(self.content_parts) or None
+
+    @property
+    def tool_calls(self):
+        """The tool calls, shaped like those of a non-streamed message"""
+        return [SimpleNamespace(id=call['id'], function=SimpleNamespace(name=call['name'], arguments=call['arguments']))
+                for index, call in sorted(self.calls.items())]
+
+    def as_message(self):
+        return {
+            "role": "assistant",
+            "content": self.content,
+            "tool_calls": [{"id": call.id, "type": "function",
+                            "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                           for call in self.tool_calls]
+        }
+
+def tool_calls_event(tool_calls):
+    return sse_event('tool_calls', {'calls': [{'id': call.id, 'name': call.function.name} for call in tool_calls]})
+
+def deepseek_stream_events(client, messages, openai_tools, current_username):
+    """
+    The tool calling loop of deepseek_api_view as Server-Sent Events.
+
+    Each completion is requested with stream=True and its content is relayed
+    as `delta` events while it arrives. Tool calls are assembled from their
+    deltas, announced with a `tool_calls` event, run with run_tool_calls() and
+    reported with a `tool_result` event each before the next completion.
+    Ends with a `done` event carrying the final response, or an `error` event.
+    When the loop stops after a turn with tool calls, that turn's content was
+    already streamed and `done` only carries a response if there was none.
+    """
+    available_functions = {tool['function']['name']: call_mcpo_tool for tool in openai_tools}
+    message = StreamedMessage()
+    try:
+        for tool_iteration in range(1, MAX_TOOL_ITERATIONS + 1):
+            print(f"[DeepSeek Stream Iteration {tool_iteration}] Sending {len(messages)} messages.")
+            stream = client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                tools=openai_tools if openai_tools else None,
+                tool_choice="auto",
+                stream=True
+            )
+            message = StreamedMessage()
+            for chunk in stream:
+                content = message.add(chunk)
+                if content:
+                    yield sse_event('delta', {'content': content})
+
+            tool_calls = message.tool_calls
+            if not tool_calls:
+                yield sse_event('done', {'response': message.content or ""})
+                return
+
+            messages.append(message.as_message())
+            yield tool_calls_event(tool_calls)
+            print(f"[DeepSeek Stream Iteration {tool_iteration}] Model requested {len(tool_calls)} tool call(s).")
+
+            tool_messages, interactions, tool_results_added = run_tool_calls(
+                tool_calls, available_functions, current_username)
+            messages.extend(tool_messages)
+            for interaction in interactions:
+                yield sse_event('tool_result', interaction)
+
+            if tool_results_added == 0:
+                print("Warning: Tool calls were requested, but none could be successfully processed.")
+                # Any content of this turn was already streamed as delta events
+                yield sse_event('done', {'response': ""})
+                return
+
+        print(f"Warning: Tool calling loop reached max iterations ({MAX_TOOL_ITERATIONS}) without final response.")
+        yield sse_event('done', {'response': "" if message.content else "Processing incomplete due to maximum iterations."})
+
+    # The response has already started, so errors are reported as events
+    except Exception as e:
+        yield sse_event('error', {'message': deepseek_error(e)[0]})
+
+async def adeepseek_stream_events(client, messages, openai_tools, current_username):
+    """deepseek_stream_events() for the async view"""
+    available_functions = {tool['function']['name']: call_mcpo_tool for tool in openai_tools}
+    message = StreamedMessage()
+    try:
+        for tool_iteration in range(1, MAX_TOOL_ITERATIONS + 1):
+            stream = await client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                tools=openai_tools if openai_tools else None,
+                tool_choice="auto",
+                stream=True
+            )
+            message = StreamedMessage()
+            async for chunk in stream:
+                content = message.add(chunk)
+                if content:
+                    yield sse_event('delta', {'content': content})
+
+            tool_calls = message.tool_calls
+            if not tool_calls:
+                yield sse_event('done', {'response': message.content or ""})
+                return
+
+            messages.append(message.as_message())
+            yield tool_calls_event(tool_calls)
+
+            tool_messages, interactions, tool_results_added = await arun_tool_calls(
+                tool_calls, available_functions, current_username)
+            messages.extend(tool_messages)
+            for interaction in interactions:
+                yield sse_event('tool_result', interaction)
+
+            if tool_results_added == 0:
+                print("Warning: Tool calls were requested, but none could be successfully processed.")
+                # Any content of this turn was already streamed as delta events
+                yield sse_event('done', {'response': ""})
+                return
+
+        print(f"Warning: Tool calling loop reached max iterations ({MAX_TOOL_ITERATIONS}) without final response.")
+        yield sse_event('done', {'response': "" if message.content else "Processing incomplete due to maximum iterations."})
+
+    except Exception as e:
+        yield sse_event('error', {'message': deepseek_error(e)[0]})
+
+_deepseek_http_clients = weakref.WeakKeyDictionary()  # Event loop -> httpx.AsyncClient
+
+def get_deepseek_http_client():
+    """
+    The HTTP client of the running event loop for openai.AsyncOpenAI. Sharing
+    it keeps connections to DeepSeek alive between chats and saves building a
+    client (and its SSL context, tens of milliseconds of CPU) for each request.
+    """
+    loop = asyncio.get_running_loop()
+    http_client = _deepseek_http_clients.get(loop)
+    if http_client is None:
+        http_client = _deepseek_http_clients[loop] = openai.DefaultAsyncHttpxClient()
+    return http_client
+
 @login_required
 def deepseek_chat_view(request):
     """Render the chat page for DeepSeek integration."""
-    # We can pass initial context if needed
-    return render(request, 'chatbot/deepseek_chat.html')
+    # Under ASGI the page talks to the async endpoint, which holds no thread while waiting
+    api_view = 'chatbot:deepseek_async_api' if isinstance(request, ASGIRequest) else 'chatbot:deepseek_api'
+    return render(request, 'chatbot/deepseek_chat.html', {'deepseek_api_url': reverse(api_view)})
 
 @login_required
 @require_POST
 def deepseek_api_view(request):
-    """Handle AJAX requests for DeepSeek chat, allows model to call MCP tools via mcpo."""
-    MAX_HISTORY_MESSAGES = 10 # Define the constant here
+    """
+    Handle AJAX requests for DeepSeek chat, allows model to call MCP tools via mcpo.
+
+    With "stream": true in the request body the answer is streamed as
+    Server-Sent Events (see deepseek_stream_events) instead of one JSON response.
+    """
     try:
         # 1. Get User Input & History
         data = json.loads(request.body)
         user_message = data.get('message')
-        history = data.get('history', []) # Get history from request
         current_username = request.user.username # Get the current logged-in username
 
         if not user_message:
             return JsonResponse({'status': 'error', 'message': 'No message provided.'}, status=400)
         
-        # Validate and sanitize history (basic validation)
-        validated_history = []
-        if isinstance(history, list):
-            for msg in history:
-                if isinstance(msg, dict) and 'role' in msg and 'content' in msg and msg['role'] in ['user', 'assistant']:
-                     validated_history.append({'role': msg['role'], 'content': str(msg['content'])}) 
-        
-        validated_history = validated_history[-MAX_HISTORY_MESSAGES:]
-
-        # === Get user timezone from request headers ===
-        user_timezone_str = request.META.get('HTTP_X_TIMEZONE')
-        if user_timezone_str:
-            try:
-                user_timezone = pytz.timezone(user_timezone_str)
-                current_time = datetime.now(user_timezone).strftime("%Y-%m-%d %H:%M:%S %Z")
-            except:
-                current_time = timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z")
-        else:
-            current_time = timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z")
-        
-        # === Add System Prompt ===
-        user_timezone_info = f" (user's local timezone: {user_timezone_str})" if user_timezone_str else " (server timezone)"
-        system_prompt = (
-            f"You are an intelligent assistant designed for the Air Monitoring Interface (AMI) system. The current date and time is {current_time}{user_timezone_info}. "
-            f"IMPORTANT TIMEZONE INSTRUCTIONS: "
-            f"- The user is currently in timezone '{user_timezone_str or 'server default'}'. ALL time-related queries and responses should be interpreted and presented in the user's timezone context. "
-            f"- When using time-based tools (get_sensor_data_summary, get_sensor_data_in_range), you MUST convert user's time references to proper ISO 8601 format with timezone information. "
-            f"- When presenting time data to the user, always consider their timezone context. If the user asks about 'yesterday', 'this morning', 'last week', etc., calculate these relative to their current local time. "
-            f"- Always include timezone information when calling time-based MCP tools. Use formats like '2023-10-27T10:00:00Z' (UTC) or '2023-10-27T18:00:00+08:00' (with timezone offset). "
-            f"SENSOR QUALITY THRESHOLDS:\n"
-            f"- Temperature: <18°C (Cold), 18-25°C (Comfortable), 25-30°C (Hot), >30°C (Very Hot)\n"
-            f"- Humidity: <30% (Dry), 30-60% (Comfortable), 60-70% (Humid), >70% (Very Humid)\n"
-            f"- CO2: <800ppm (Good), 800-1500ppm (Moderate), 1500-2000ppm (Poor), >2000ppm (Very Poor)\n"
-            f"- PM1.0: <10μg/m³ (Good), 10-25 (Moderate), 25-45 (Unhealthy), >45 (Very Unhealthy)\n"
-            f"- PM2.5: <12μg/m³ (Good), 12-35.4 (Moderate), 35.4-55.4 (Unhealthy), >55.4 (Very Unhealthy)\n"
-            f"- PM10: <54μg/m³ (Good), 54-154 (Moderate), 154-254 (Unhealthy), >254 (Very Unhealthy)\n"
-            f"- AQI: 0-50 (Good), 51-100 (Moderate), 101-150 (Unhealthy for Sensitive), 151-200 (Unhealthy), 201-300 (Very Unhealthy), 301+ (Hazardous)\n"
-            f"Your primary role is to assist user '{current_username}' in querying real-time or historical sensor data, providing air quality related explanations, and managing user data (such as reporting issues, viewing, or updating personal settings). "
-            f"When the user requests to query data or perform system operations, you should strive to use the available tools to provide accurate and timely information, and offer relevant analysis or suggestions based on the data. "
-            f"Under all circumstances, you MUST ensure that all your actions are restricted to the current user '{current_username}'. When using tools such as 'report_issue', 'get_user_profile', or 'update_user_profile', you MUST and can ONLY act on behalf of user '{current_username}'. It is strictly forbidden to attempt to access or modify information for other users, or to impersonate others. If the user asks you to perform these actions for someone else, politely refuse and reiterate that you can only serve '{current_username}'. "
-            f"Your responses should be clear, concise, professional, and helpful. If you cannot answer a specific question or perform an operation, please state so honestly and guide the user to ask a clearer question or provide alternative solutions. "
-            f"Please remember that your main goal is to provide assistance related to the AMI system's functionalities. For questions outside this scope, you may politely decline to answer or guide the user towards questions within the system's capabilities."
-            f"If the user asks about the system's purpose, features, Q&A, or how it works, you should use the tool to get the information, don't base your response on your hallucination."
-        )
-        
-        # Start conversation message list with system prompt, then history, then current user message
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ] + validated_history + [{"role": "user", "content": user_message}]
+        messages = build_deepseek_messages(request, user_message, data.get('history', []), current_username)
 
         # 2. Get User API Key
         try:
@@ -723,31 +976,25 @@ def deepseek_api_view(request):
              return JsonResponse({'status': 'error', 'message': 'User profile not found.'}, status=500)
 
         # 3. Get Tool Definitions
-        openapi_schema = get_mcpo_openapi_schema()
-        if not openapi_schema:
-            print("Warning: Proceeding without MCP tools as schema fetch failed.")
-            openai_tools = []
-        else:
-             openai_tools = parse_openapi_schema_for_tools(openapi_schema)
+        openai_tools = get_deepseek_tools()
 
         # 4. Initialize DeepSeek Client
         client = openai.OpenAI(
-            base_url="https://api.deepseek.com/v1",
+            base_url=settings.DEEPSEEK_BASE_URL,
             api_key=deepseek_api_key
         )
 
+        if data.get('stream'):
+            events = deepseek_stream_events(client, messages, openai_tools, current_username)
+            if isinstance(request, ASGIRequest):
+                # Django's ASGI handler would read a sync iterator to the end before sending anything
+                events = iterate_in_thread(events)
+            return event_stream_response(events)
+
         # --- Start Tool Calling Loop ---
-        MAX_TOOL_ITERATIONS = 15
         tool_iterations = 0
         final_bot_response = None
         tool_interactions_log = [] 
-        # Define user-specific tools that require username injection
-        USER_SPECIFIC_TOOLS = {"report_issue", "get_user_profile", "update_user_profile"}
-        USERNAME_ARG_MAP = { # Maps tool name to its username argument name
-            "report_issue": "reporter_username",
-            "get_user_profile": "username",
-            "update_user_profile": "username"
-        }
 
         while tool_iterations < MAX_TOOL_ITERATIONS:
             tool_iterations += 1
@@ -774,65 +1021,10 @@ def deepseek_api_view(request):
             print(f"[DeepSeek Loop Iteration {tool_iterations}] Model requested {len(tool_calls)} tool call(s).")
             available_functions = {tool['function']['name']: call_mcpo_tool for tool in openai_tools}
             
-            tool_results_added = 0
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_to_call = available_functions.get(function_name)
-                function_args = {}
-                function_result = None
-                is_valid_args = False
-                try:
-                    function_args = json.loads(tool_call.function.arguments)
-                    is_valid_args = True
-                except json.JSONDecodeError:
-                    print(f"ERROR: Could not decode arguments for tool {function_name}: {tool_call.function.arguments}")
-                    function_result = {"error": "Invalid arguments format from LLM."}
-                
-                # === Inject/Verify Username for User-Specific Tools ===
-                if function_name in USER_SPECIFIC_TOOLS and is_valid_args:
-                    username_arg_name = USERNAME_ARG_MAP[function_name]
-                    ai_provided_username = function_args.get(username_arg_name)
-                    
-                    if ai_provided_username and ai_provided_username != current_username:
-                        print(f"Warning: Model tried to call {function_name} for user '{ai_provided_username}' but the current user is '{current_username}'. Forcing correct username.")
-                    elif not ai_provided_username:
-                         print(f"Info: Model did not provide username for {function_name}. Injecting current user '{current_username}'.")
-                         
-                    # Force the correct username
-                    function_args[username_arg_name] = current_username
-                    print(f"  - Updated args for {function_name}: {function_args}")
-                # =======================================================
-
-                if function_to_call and is_valid_args:
-                    print(f"  - Calling tool: {function_name} with final args: {function_args}")
-                    function_result = call_mcpo_tool(tool_name=function_name, arguments=function_args)
-                    print(f"  - Tool result: {function_result}")
-                    tool_interactions_log.append({
-                        'name': function_name,
-                        'args': function_args, # Log the potentially modified args
-                        'result': function_result
-                    })
-                elif not function_to_call:
-                     print(f"ERROR: Model requested unknown tool: {function_name}")
-                     function_result = {"error": f"Tool '{function_name}' not found or configured."}
-                     tool_interactions_log.append({
-                        'name': function_name,
-                        'args': function_args if is_valid_args else tool_call.function.arguments,
-                        'result': function_result
-                    })
-                # else: invalid args already logged, result set
-                
-                function_result_content = json.dumps(function_result)
-                messages.append(
-                    {
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": function_result_content, 
-                    }
-                )
-                if function_result is not None:
-                     tool_results_added += 1
+            tool_messages, interactions, tool_results_added = run_tool_calls(
+                tool_calls, available_functions, current_username)
+            messages.extend(tool_messages)
+            tool_interactions_log.extend(interactions)
             
             if tool_results_added == 0:
                  print("Warning: Tool calls were requested, but none could be successfully processed.")
@@ -844,10 +1036,7 @@ def deepseek_api_view(request):
 
         if final_bot_response is None:
              print(f"Warning: Tool calling loop reached max iterations ({MAX_TOOL_ITERATIONS}) without final response.")
-             last_assistant_message = next((m for m in reversed(messages) if m['role'] == 'assistant'), None)
-             # Use .content for OpenAI response objects, or direct access for dicts
-             final_bot_response = getattr(last_assistant_message, 'content', None) if hasattr(last_assistant_message, 'role') else last_assistant_message.get('content') 
-             final_bot_response = final_bot_response if final_bot_response else "Processing incomplete due to maximum iterations."
+             final_bot_response = last_assistant_content(messages) or "Processing incomplete due to maximum iterations."
 
         response_data = {
              'status': 'success',
@@ -858,15 +1047,86 @@ def deepseek_api_view(request):
             
         return JsonResponse(response_data)
 
-    except openai.AuthenticationError:
-        return JsonResponse({'status': 'error', 'message': 'DeepSeek API authentication failed. Check API Key in profile.'}, status=401)
-    except openai.RateLimitError:
-        return JsonResponse({'status': 'error', 'message': 'DeepSeek API rate limit exceeded.'}, status=429)
-    except openai.APIConnectionError:
-        return JsonResponse({'status': 'error', 'message': 'Could not connect to DeepSeek API.'}, status=503)
     except Exception as e:
-        # Catch-all for other errors (JSON parsing, unexpected issues)
-        print(f"Error in DeepSeek API view: {e}") 
-        import traceback
-        print(traceback.format_exc()) # Print full traceback for debugging
-        return JsonResponse({'status': 'error', 'message': f'An unexpected error occurred: {str(e)}'}, status=500)
+        message, status = deepseek_error(e)
+        return JsonResponse({'status': 'error', 'message': message}, status=status)
+
+@login_required
+@require_POST
+async def deepseek_async_api_view(request):
+    """
+    deepseek_api_view as a coroutine, for the ASGI application (config/asgi.py).
+
+    DeepSeek is called with openai.AsyncOpenAI and mcpo with the event loop's
+    AsyncMCPOClient, both on connection pools shared by the chats of the loop,
+    so a chat waiting on either holds no thread and one process serves many
+    chats at once. Under WSGI it answers 503 and the chat page uses
+    deepseek_api_view instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'status': 'error', 'message': 'This endpoint is only served by the ASGI application.'}, status=503)
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message')
+        user = await request.auser()
+        current_username = user.username
+
+        if not user_message:
+            return JsonResponse({'status': 'error', 'message': 'No message provided.'}, status=400)
+
+        messages = build_deepseek_messages(request, user_message, data.get('history', []), current_username)
+
+        user_profile = await UserProfile.objects.filter(user=user).afirst()
+        if user_profile is None:
+            return JsonResponse({'status': 'error', 'message': 'User profile not found.'}, status=500)
+        if not user_profile.api_key:
+            return JsonResponse({'status': 'error', 'message': 'API Key not configured in profile.'}, status=400)
+
+        # Fetched once per process (cached), so a worker thread is fine
+        openai_tools = await sync_to_async(get_deepseek_tools, thread_sensitive=False)()
+        available_functions = {tool['function']['name']: call_mcpo_tool for tool in openai_tools}
+
+        client = openai.AsyncOpenAI(base_url=settings.DEEPSEEK_BASE_URL, api_key=user_profile.api_key,
+                                    http_client=get_deepseek_http_client())
+        if data.get('stream'):
+            return event_stream_response(adeepseek_stream_events(client, messages, openai_tools, current_username))
+
+        final_bot_response = None
+        tool_interactions_log = []
+        for tool_iteration in range(1, MAX_TOOL_ITERATIONS + 1):
+            response = await client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                tools=openai_tools if openai_tools else None,
+                tool_choice="auto"
+            )
+            response_message = response.choices[0].message
+            messages.append(response_message)
+
+            tool_calls = response_message.tool_calls
+            if not tool_calls:
+                final_bot_response = response_message.content
+                break
+
+            tool_messages, interactions, tool_results_added = await arun_tool_calls(
+                tool_calls, available_functions, current_username)
+            messages.extend(tool_messages)
+            tool_interactions_log.extend(interactions)
+
+            if tool_results_added == 0:
+                print("Warning: Tool calls were requested, but none could be successfully processed.")
+                final_bot_response = response_message.content
+                break
+
+        if final_bot_response is None:
+            print(f"Warning: Tool calling loop reached max iterations ({MAX_TOOL_ITERATIONS}) without final response.")
+            final_bot_response = last_assistant_content(messages) or "Processing incomplete due to maximum iterations."
+
+        response_data = {'status': 'success', 'response': final_bot_response or ""}
+        if tool_interactions_log:
+            response_data['tool_interactions'] = tool_interactions_log
+        return JsonResponse(response_data)
+
+    except Exception as e:
+        message, status = deepseek_error(e)
+        return JsonResponse({'status': 'error', 'message': message}, status=status)
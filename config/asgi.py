@@ -3,6 +3,12 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live stream of readings (/api/sensor/stream/) is only served here, e.g.
+``uvicorn config.asgi:application``; its broker is per process, so run a
+single worker. Served here, the DeepSeek chat page uses the async chat
+endpoint (/chatbot/deepseek_api/async/), which waits on DeepSeek and mcpo
+without holding a thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
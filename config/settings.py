@@ -164,6 +164,118 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Sensor ingestion
+# Maximum number of readings accepted by one batch upload to /api/sensor/ or /api/sensor/batch/
+SENSOR_BATCH_MAX_SIZE = 5000
+
+# Optional write-behind buffer: readings are queued in memory and a flusher thread
+# group-commits them every FLUSH_INTERVAL_MS or MAX_BATCH_SIZE rows, whichever comes first.
+# DURABILITY is 'ack_after_flush' (respond once the rows are committed) or
+# 'ack_on_enqueue' (respond 202 immediately; queued rows are lost if the process dies).
+# Counters are available to staff at /api/sensor/ingest/stats/
+SENSOR_INGEST_BUFFER = {
+    'ENABLED': os.getenv('SENSOR_INGEST_BUFFER', 'false').lower() == 'true',
+    'FLUSH_INTERVAL_MS': 200,
+    'MAX_BATCH_SIZE': 500,
+    'DURABILITY': 'ack_after_flush',
+    'ACK_TIMEOUT_S': 5.0,
+}
+
+# Analysis page statistics are cached (default cache) per local date and latest reading;
+# new readings invalidate them, this only bounds how long unused entries are kept
+ANALYSIS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Background export jobs: WORKERS threads write files to MEDIA_ROOT/exports/.
+# Identical requests reuse a running job, or a finished one for REUSE_SECONDS;
+# finished jobs and files are deleted after RETENTION_SECONDS. A pending/running
+# job without progress for STALE_SECONDS (e.g. after a restart) is not reused.
+SENSOR_EXPORT_JOBS = {
+    'WORKERS': 2,
+    'REUSE_SECONDS': 600,
+    'RETENTION_SECONDS': 24 * 60 * 60,
+    'STALE_SECONDS': 120,
+    'PROGRESS_INTERVAL_S': 0.5,
+}
+
+# Live stream of new readings at /api/sensor/stream/ (Server-Sent Events, ASGI only).
+# Idle connections get a comment every HEARTBEAT_S; clients reconnect after RETRY_MS.
+# A client more than QUEUE_SIZE batches behind is disconnected and resumes from its
+# Last-Event-ID; a resume with more than REPLAY_LIMIT missed readings gets a 'reset' event.
+SENSOR_LIVE_STREAM = {
+    'HEARTBEAT_S': 15,
+    'RETRY_MS': 3000,
+    'QUEUE_SIZE': 256,
+    'REPLAY_LIMIT': 2000,
+}
+
+# Threshold alerts: every committed reading is checked against the thresholds of users
+# with email notifications enabled (accounts/alerts.py). The in-memory threshold index is
+# rebuilt after profile changes in this process and at least every INDEX_TTL_S seconds.
+# An alert opens once a metric stays beyond the threshold for MIN_DURATION_S and closes when
+# it is back inside by the metric's HYSTERESIS band (accounts/alert_state.py). An alert that
+# opens again within COOLDOWN_S of its last email is not sent again, and a user gets at most
+# one email (a digest of the alerts opened meanwhile) per DIGEST_S. Alert state is kept per
+# process and written to AlertState every PERSIST_INTERVAL_S: with several worker processes
+# each tracks and overwrites it on its own, duplicating alerts, so serve with one worker.
+SENSOR_ALERTS = {
+    'ENABLED': os.getenv('SENSOR_ALERTS', 'true').lower() == 'true',
+    'INDEX_TTL_S': 60,
+    'MIN_DURATION_S': 60,
+    'HYSTERESIS': {'temperature': 0.5, 'humidity': 2.0, 'co2': 50.0, 'pm2_5': 2.0, 'pm10_0': 5.0, 'aqi': 5.0},
+    'COOLDOWN_S': 30 * 60,
+    'DIGEST_S': 10 * 60,
+    'PERSIST_INTERVAL_S': 30,
+}
+
+# Alert emails are written to an outbox table and sent by a background worker thread,
+# BATCH_SIZE messages per mail connection. A failed message is retried after BACKOFF_BASE_S
+# seconds, doubling up to BACKOFF_MAX_S, and marked failed after MAX_ATTEMPTS. The worker
+# starts in a process the first time it enqueues an email, so emails left queued by a
+# previous run wait for the next alert. With WORKER off, or to send those right away,
+# run `manage.py deliver_alert_emails --loop` as a service (or without --loop from cron).
+SENSOR_ALERT_DELIVERY = {
+    'WORKER': os.getenv('SENSOR_ALERT_WORKER', 'true').lower() == 'true',
+    'BATCH_SIZE': 100,
+    'POLL_INTERVAL_S': 5.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE_S': 30,
+    'BACKOFF_MAX_S': 3600,
+    'STALE_SECONDS': 300,
+    'RETENTION_SECONDS': 7 * 24 * 60 * 60,
+}
+
+# Rule-based chatbot: ChatbotQA questions and FAQ keys are ranked with BM25 from in-memory
+# term indexes (chatbot/search.py). A question matches when the share of query words it
+# contains exceeds MATCH_THRESHOLD, an FAQ key when the share of its words in the query
+# exceeds FAQ_THRESHOLD. The Q&A index is rebuilt after changes in this process and at
+# least every INDEX_TTL_S.
+CHATBOT_SEARCH = {
+    'INDEX_TTL_S': 60,
+    'MATCH_THRESHOLD': 0.6,
+    'FAQ_THRESHOLD': 0.3,
+    'BM25_K1': 1.2,
+    'BM25_B': 0.75,
+}
+
+# mcpo proxy serving the MCP tools to the DeepSeek chat (chatbot/mcpo.py). Calls share one
+# keep-alive connection pool of up to POOL_MAXSIZE connections; connection failures are
+# retried RETRIES times with exponential backoff starting at BACKOFF_FACTOR seconds. The
+# async chat view uses up to ASYNC_MAX_CONNECTIONS connections per event loop.
+MCPO = {
+    'BASE_URL': os.getenv('MCPO_BASE_URL', 'http://localhost:8002'),
+    'CONNECT_TIMEOUT_S': 3.0,
+    'READ_TIMEOUT_S': 10.0,
+    'SCHEMA_TIMEOUT_S': 5.0,
+    'POOL_MAXSIZE': 16,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.1,
+    'MAX_PARALLEL_CALLS': 8,
+    'ASYNC_MAX_CONNECTIONS': 100,
+}
+
+# OpenAI-compatible endpoint of the DeepSeek chat
+DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+
 # Login and logout redirection
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/accounts/login/'
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SensorApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sensor_api'
+
+    def ready(self):
+        # Register signal receivers (rollup maintenance on ingest)
+        from . import signals  # noqa: F401
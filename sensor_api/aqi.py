@@ -0,0 +1,68 @@
+"""
+Air Quality Index from particulate readings
+
+US EPA breakpoints for PM2.5 and PM10; the AQI of a reading is the larger of
+the two sub-indices. Used by the chatbot's answers and the threshold alerts.
+"""
+
+
+def calculate_aqi_from_pm(pm25_value, pm10_value):
+    """Calculate AQI value from PM2.5 and PM10"""
+    # PM2.5 AQI calculation
+    pm25_aqi = calculate_pm25_aqi(pm25_value)
+    
+    # PM10 AQI calculation
+    pm10_aqi = calculate_pm10_aqi(pm10_value)
+    
+    # Take the maximum of the two as AQI
+    aqi = max(pm25_aqi, pm10_aqi)
+    
+    return round(aqi)
+
+def calculate_pm25_aqi(pm25):
+    """Calculate PM2.5 AQI value"""
+    # PM2.5 concentration to AQI mapping
+    pm25_breakpoints = [
+        (0, 12, 0, 50),
+        (12.1, 35.4, 51, 100),
+        (35.5, 55.4, 101, 150),
+        (55.5, 150.4, 151, 200),
+        (150.5, 250.4, 201, 300),
+        (250.5, 350.4, 301, 400),
+        (350.5, 500.4, 401, 500)
+    ]
+    
+    for low_conc, high_conc, low_aqi, high_aqi in pm25_breakpoints:
+        if low_conc <= pm25 <= high_conc:
+            # Linear interpolation to calculate AQI
+            aqi = ((high_aqi - low_aqi) / (high_conc - low_conc)) * (pm25 - low_conc) + low_aqi
+            return aqi
+    
+    # If out of range
+    if pm25 > 500.4:
+        return 500
+    return 0
+
+def calculate_pm10_aqi(pm10):
+    """Calculate PM10 AQI value"""
+    # PM10 concentration to AQI mapping
+    pm10_breakpoints = [
+        (0, 54, 0, 50),
+        (55, 154, 51, 100),
+        (155, 254, 101, 150),
+        (255, 354, 151, 200),
+        (355, 424, 201, 300),
+        (425, 504, 301, 400),
+        (505, 604, 401, 500)
+    ]
+    
+    for low_conc, high_conc, low_aqi, high_aqi in pm10_breakpoints:
+        if low_conc <= pm10 <= high_conc:
+            # Linear interpolation to calculate AQI
+            aqi = ((high_aqi - low_aqi) / (high_conc - low_conc)) * (pm10 - low_conc) + low_aqi
+            return aqi
+    
+    # If out of range
+    if pm10 > 604:
+        return 500
+    return 0
@@ -0,0 +1,85 @@
+"""
+Column-oriented responses of the list API
+
+With ?format=columnar the list API returns one array per field instead of an
+array of row objects:
+
+    {"timestamps": [...], "co2": [...], "humidity": [...], ...}
+
+Timestamps are ISO 8601 strings as in the row format, or integer milliseconds
+since the Unix epoch with ?timestamps=epoch_ms.
+
+With ?format=binary (or Accept: application/octet-stream) the same columns
+are sent as raw little-endian arrays that a browser can wrap in typed arrays
+without parsing: first the timestamps as float64 epoch milliseconds (float32
+cannot hold them exactly), then every other column as float32, each
+X-Row-Count values long, in the order listed by the X-Columns header.
+"""
+import datetime
+
+import numpy as np
+
+from .serializers import format_timestamps
+
+TIMESTAMP_FORMATS = ('iso', 'epoch_ms')
+
+COLUMNAR_RENDER_FORMATS = ('columnar', 'binary')
+
+BINARY_TIMESTAMP_DTYPE = np.dtype('<f8')
+BINARY_VALUE_DTYPE = np.dtype('<f4')
+
+
+class ColumnarData(dict):
+    """Mapping of column name to a list of values, all of the same length"""
+
+    @property
+    def row_count(self):
+        return len(self['timestamps'])
+
+
+def epoch_milliseconds(values):
+    """int64 milliseconds since the epoch for a list of aware datetimes"""
+    seconds = np.fromiter((value.timestamp() for value in values), dtype=np.float64, count=len(values))
+    return np.rint(seconds * 1e6).astype(np.int64) // 1000
+
+
+def _timestamp_column(values, epoch_ms):
+    return epoch_milliseconds(values).tolist() if epoch_ms else format_timestamps(values)
+
+
+def queryset_columns(queryset, fields, epoch_ms=False):
+    """Columns for the rows of queryset, fetched with values_list and transposed"""
+    rows = list(queryset.values_list('timestamp', *fields))
+    if not rows:
+        return ColumnarData({'timestamps': [], **{field: [] for field in fields}})
+    columns = list(zip(*rows))
+    data = ColumnarData(timestamps=_timestamp_column(columns[0], epoch_ms))
+    for field, column in zip(fields, columns[1:]):
+        data[field] = list(column)
+    return data
+
+
+def rows_to_columns(rows, fields, epoch_ms=False):
+    """
+    Columns for rows already in the list API's row format, e.g. downsampled
+    series. fields names the columns to use when there are no rows.
+    """
+    if not rows:
+        return ColumnarData({'timestamps': [], **{field: [] for field in fields}})
+    names = [name for name in rows[0] if name != 'timestamp']
+    timestamps = [row['timestamp'] for row in rows]
+    if epoch_ms:
+        timestamps = epoch_milliseconds([datetime.datetime.fromisoformat(value) for value in timestamps]).tolist()
+    data = ColumnarData(timestamps=timestamps)
+    for name in names:
+        data[name] = [row[name] for row in rows]
+    return data
+
+
+def encode_binary(data):
+    """The binary layout described above; timestamps must be epoch milliseconds"""
+    parts = [np.asarray(data['timestamps'], dtype=BINARY_TIMESTAMP_DTYPE).tobytes()]
+    for name, column in data.items():
+        if name != 'timestamps':
+            parts.append(np.asarray(column, dtype=BINARY_VALUE_DTYPE).tobytes())
+    return b''.join(parts)
@@ -0,0 +1,103 @@
+"""
+Conditional reads (ETag / Last-Modified) of sensor data
+
+What a read of a time window returns is fixed by the newest stored reading,
+the data generation (bumped whenever a stored reading is edited or deleted, see
+signals.py) and, for windows that slide with the clock ("the last N hours"), by
+the newest reading that has already left the window. All are index or primary
+key lookups, so a validator costs a few tiny queries instead of reading and
+serializing the window, and a request whose If-None-Match / If-Modified-Since
+still matches is answered with 304 without touching the rows.
+
+Rows changed with QuerySet.update() or raw SQL send no signals; bump the
+generation by hand after such changes.
+
+Last-Modified has one-second resolution, so a reading stored in the same second
+as a previous response can be missed by If-Modified-Since alone; clients that
+keep the ETag (browsers send both) are not affected.
+"""
+import hashlib
+
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import SensorData, SensorDataGeneration
+
+
+class ReadValidator:
+    """ETag and Last-Modified of a read, plus the newest reading id they were computed from"""
+
+    def __init__(self, etag, last_modified, latest_id):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.latest_id = latest_id
+
+
+def make_etag(*parts):
+    """Strong, quoted ETag for the values that determine a response"""
+    digest = hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def data_generation():
+    """(generation, when it was last bumped) of the stored readings"""
+    row = SensorDataGeneration.objects.filter(pk=1).values_list('value', 'changed_at').first()
+    return row or (0, None)
+
+
+def bump_data_generation():
+    """Mark every validator and cache keyed on the data generation as stale"""
+    now = timezone.now()
+    if not SensorDataGeneration.objects.filter(pk=1).update(value=F('value') + 1, changed_at=now):
+        SensorDataGeneration.objects.get_or_create(pk=1, defaults={'value': 1, 'changed_at': now})
+
+
+def read_validator(key, window=None):
+    """
+    Validator for a read of the stored readings described by `key` (the
+    request parameters that change the output).
+
+    window: length of a sliding window ending now. Readings leaving it change
+    the result too, so the newest reading before the window start is part of
+    the ETag, and the response counts as modified when it left.
+    """
+    generation, changed_at = data_generation()
+    latest_id = SensorData.objects.aggregate(last=Max('id'))['last']
+    if latest_id is None:
+        return ReadValidator(make_etag(key, None, generation), changed_at, 0)
+    # Readings backfilled with older timestamps are caught by the id in the ETag
+    last_modified = SensorData.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+    if changed_at is not None:
+        last_modified = max(last_modified, changed_at)
+    departed = None
+    if window is not None:
+        start = timezone.now() - window
+        departed = (SensorData.objects.filter(timestamp__lt=start)
+                    .order_by('-timestamp', '-id').values_list('id', 'timestamp').first())
+        if departed is not None:
+            last_modified = max(last_modified, departed[1] + window)
+            departed = departed[0]
+    return ReadValidator(make_etag(key, latest_id, generation, departed), last_modified, latest_id)
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """304 (or 412) response when the request's conditional headers match, else None"""
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validator_headers(response, etag, last_modified=None, vary=()):
+    """
+    Send the validators and make browsers revalidate on every use, so a
+    repeated poll costs a 304 rather than a full response.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
@@ -0,0 +1,208 @@
+"""
+Downsampling of SensorData series for charts
+
+Two methods are offered by the list API:
+
+- bucket: avg/min/max per fixed-width time bucket, aggregated in SQL. Buckets
+  are aligned to multiples of their width since the Unix epoch (UTC). When the
+  width is a whole number of minutes the rollups are used for the part of the
+  window they cover, so only the partial minutes at the edges are read from
+  raw rows.
+- lttb: Largest-Triangle-Three-Buckets on one metric, computed with NumPy. It
+  keeps the raw readings that best preserve the shape of that metric's curve.
+"""
+import datetime
+import math
+
+import numpy as np
+from django.db import models
+from django.db.models import Count, Max, Min, Sum
+
+from .models import METRICS
+from .rollups import EPOCH, RESOLUTIONS, ceil_to, floor_to
+from .serializers import format_timestamps
+
+DOWNSAMPLE_METHODS = ('bucket', 'lttb')
+
+# Upper bound for max_points; nothing draws more than this usefully
+MAX_POINTS_LIMIT = 10000
+
+# Bucket widths picked for max_points, so buckets line up with clock boundaries
+BUCKET_STEPS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600,
+                2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600]
+
+class EpochBucket(models.Func):
+    """Integer index of the `width`-second bucket since the epoch containing a datetime"""
+    output_field = models.BigIntegerField()
+
+    def __init__(self, expression, width, **extra):
+        self.width = int(width)
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Generic fallback (MySQL/MariaDB)
+        return super().as_sql(compiler, connection,
+                              template=f'FLOOR(UNIX_TIMESTAMP(%(expressions)s) / {self.width})', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template=f"(CAST(strftime('%%%%s', %(expressions)s) AS INTEGER) / {self.width})",
+                              **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template=f'FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / {self.width})::bigint',
+                              **extra_context)
+
+
+def choose_bucket_seconds(start, end, max_points):
+    """Smallest step from BUCKET_STEPS giving at most max_points buckets over [start, end]"""
+    span = max((end - start).total_seconds(), 1)
+    needed = span / max_points
+    for step in BUCKET_STEPS:
+        if step >= needed:
+            return step
+    return int(math.ceil(needed / BUCKET_STEPS[-1])) * BUCKET_STEPS[-1]
+
+
+def _merge(buckets, index, count, sums, minimums, maximums):
+    bucket = buckets.get(index)
+    if bucket is None:
+        buckets[index] = {'count': count, 'sum': sums, 'min': minimums, 'max': maximums}
+        return
+    bucket['count'] += count
+    for metric in METRICS:
+        bucket['sum'][metric] += sums[metric]
+        bucket['min'][metric] = min(bucket['min'][metric], minimums[metric])
+        bucket['max'][metric] = max(bucket['max'][metric], maximums[metric])
+
+
+def _collect(buckets, rows, prefix_sum, prefix_min, prefix_max):
+    for row in rows:
+        if not row['count']:
+            continue
+        _merge(
+            buckets, row['bucket'], row['count'],
+            {metric: row[prefix_sum + metric] for metric in METRICS},
+            {metric: row[prefix_min + metric] for metric in METRICS},
+            {metric: row[prefix_max + metric] for metric in METRICS},
+        )
+
+
+def _rollup_for(width):
+    """(model, step) of the coarsest rollup whose buckets nest in width-second buckets"""
+    for model, step, _ in RESOLUTIONS:
+        if width % int(step.total_seconds()) == 0:
+            return model, step
+    return None
+
+
+def _raw_aggregates():
+    aggregates = {'count': Count('id')}
+    for metric in METRICS:
+        aggregates[f'sum_{metric}'] = Sum(metric)
+        aggregates[f'min_{metric}'] = Min(metric)
+        aggregates[f'max_{metric}'] = Max(metric)
+    return aggregates
+
+
+def bucket_series(queryset, width, start=None, end=None):
+    """
+    avg/min/max per `width`-second bucket for the rows of queryset.
+
+    When start/end give the window the queryset covers (and it has no other
+    filters), the inner aligned part comes from the coarsest rollup whose
+    buckets divide width, e.g. hour rollups for 2-hour buckets. Returns a list of dicts in time order with the
+    keys of the list API (timestamp = bucket start, metric = average) plus
+    count, <metric>_min and <metric>_max.
+    """
+    buckets = {}
+    raw = queryset.order_by()
+    rollup = _rollup_for(width) if start is not None and end is not None else None
+    if rollup:
+        model, step = rollup
+        inner_start, inner_end = ceil_to(start, step), floor_to(end, step)
+        if inner_start < inner_end:
+            rollup_aggregates = {'count': Sum('count')}
+            for metric in METRICS:
+                rollup_aggregates[f'sum_{metric}'] = Sum(f'{metric}_sum')
+                rollup_aggregates[f'min_{metric}'] = Min(f'{metric}_min')
+                rollup_aggregates[f'max_{metric}'] = Max(f'{metric}_max')
+            rows = (model.objects
+                    .filter(bucket_start__gte=inner_start, bucket_start__lt=inner_end)
+                    .annotate(bucket=EpochBucket('bucket_start', width))
+                    .values('bucket').annotate(**rollup_aggregates).order_by())
+            _collect(buckets, rows, 'sum_', 'min_', 'max_')
+            raw = raw.exclude(timestamp__gte=inner_start, timestamp__lt=inner_end)
+
+    rows = raw.annotate(bucket=EpochBucket('timestamp', width)).values('bucket').annotate(**_raw_aggregates())
+    _collect(buckets, rows, 'sum_', 'min_', 'max_')
+
+    indices = sorted(buckets)
+    timestamps = format_timestamps([EPOCH + datetime.timedelta(seconds=index * width) for index in indices])
+    series = []
+    for index, timestamp in zip(indices, timestamps):
+        bucket = buckets[index]
+        count = bucket['count']
+        point = {}
+        for metric in METRICS:
+            point[metric] = bucket['sum'][metric] / count
+        point['timestamp'] = timestamp
+        point['count'] = count
+        for metric in METRICS:
+            point[f'{metric}_min'] = bucket['min'][metric]
+            point[f'{metric}_max'] = bucket['max'][metric]
+        series.append(point)
+    return series
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    x must be increasing. The first and last points are always kept; each of
+    the threshold - 2 buckets in between contributes the point forming the
+    largest triangle with the previously kept point and the next bucket's mean.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        # Mean of the next bucket (the last point for the final bucket)
+        next_start = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - mean_x) * (y[start:end] - ay) - (ax - x[start:end]) * (mean_y - ay))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def lttb_series(queryset, max_points, metric='co2'):
+    """
+    Raw readings picked by LTTB on `metric`, in the list API's row format.
+
+    Rows are fetched as tuples rather than model instances; only the chosen
+    ones are turned into dicts.
+    """
+    rows = list(queryset.values_list('timestamp', *METRICS))
+    if not rows:
+        return []
+    x = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    column = 1 + METRICS.index(metric)
+    y = np.fromiter((row[column] for row in rows), dtype=np.float64, count=len(rows))
+    chosen = [rows[i] for i in lttb_indices(x, y, max_points)]
+    timestamps = format_timestamps([row[0] for row in chosen])
+    return [{**dict(zip(METRICS, row[1:])), 'timestamp': timestamp} for row, timestamp in zip(chosen, timestamps)]
@@ -0,0 +1,235 @@
+"""
+Streaming export of SensorData
+
+Rows are read with values_list().iterator() and encoded a chunk at a time, so
+an export never holds more than one chunk of rows (and their text) in memory,
+whatever the size of the requested range.
+
+Text formats (CSV/JSON, optionally gzip-compressed) are generated as a stream
+of byte chunks. Columnar formats (NumPy .npz, Parquet when pyarrow is
+installed) store float32 metric columns and an int64 timestamp column holding
+microseconds since the Unix epoch (UTC); they are written to a file object.
+"""
+import csv
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+import zlib
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+from .models import SensorData
+
+# Column order of exported files, after the timestamp
+EXPORT_FIELDS = ['temperature', 'humidity', 'co2', 'pm1_0', 'pm2_5', 'pm10_0']
+
+# Rows fetched from the database per round trip, and encoded per yielded chunk
+EXPORT_CHUNK_SIZE = 2000
+
+# Columnar formats convert larger chunks at once; each one becomes a Parquet row group
+COLUMNAR_CHUNK_SIZE = 65536
+
+VALUE_DTYPE = np.dtype('<f4')
+TIMESTAMP_DTYPE = np.dtype('<i8')
+
+GZIP_LEVEL = 6
+
+
+def select_fields(sensor_types):
+    """Exported metric columns for the sensor types picked on the export page"""
+    if 'all' in sensor_types:
+        return list(EXPORT_FIELDS)
+    return [field for field in EXPORT_FIELDS if field in sensor_types]
+
+
+def export_queryset(start_date, end_date):
+    return SensorData.objects.filter(
+        timestamp__gte=start_date,
+        timestamp__lte=end_date
+    ).order_by('timestamp')
+
+
+def iter_chunks(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """
+    Yield lists of (timestamp, *fields) tuples without materialising the queryset.
+
+    progress, if given, is called with the number of rows in each chunk once
+    the consumer has processed it.
+    """
+    chunk = []
+    for row in queryset.values_list('timestamp', *fields).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            if progress:
+                progress(len(chunk))
+            chunk = []
+    if chunk:
+        yield chunk
+        if progress:
+            progress(len(chunk))
+
+
+def format_timestamp(timestamp):
+    """'YYYY-MM-DD HH:MM:SS', as strftime('%Y-%m-%d %H:%M:%S') but several times faster"""
+    return timestamp.isoformat(' ', 'seconds')[:19]
+
+
+def stream_csv(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """Yield the CSV export as encoded chunks: a header line, then chunk_size rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['timestamp'] + fields)
+    yield _drain(buffer)
+
+    for chunk in iter_chunks(queryset, fields, chunk_size, progress):
+        writer.writerows((format_timestamp(row[0]),) + row[1:] for row in chunk)
+        yield _drain(buffer)
+
+
+def stream_json(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """
+    Yield the JSON export as encoded chunks.
+
+    The array is written incrementally, one object at a time, with the same
+    layout as json.dumps(rows, indent=4) of the whole list.
+    """
+    # Keys are fixed for the whole export, so each object is rendered from a
+    # template instead of a json.dumps call per row
+    template = '{\n        "timestamp": "%s"' + ''.join(
+        f',\n        {json.dumps(field)}: %s' for field in fields
+    ) + '\n    }'
+    yield b'['
+    first = True
+    for chunk in iter_chunks(queryset, fields, chunk_size, progress):
+        parts = []
+        for row in chunk:
+            values = (format_timestamp(row[0]),) + tuple(_json_number(value) for value in row[1:])
+            parts.append(('\n    ' if first else ',\n    ') + template % values)
+            first = False
+        yield ''.join(parts).encode('utf-8')
+    yield b']' if first else b'\n]'
+
+
+# json.dumps spellings of the floats whose repr is not valid JSON
+_JSON_CONSTANTS = {'nan': 'NaN', 'inf': 'Infinity', '-inf': '-Infinity'}
+
+
+def _json_number(value):
+    text = repr(value)
+    return _JSON_CONSTANTS.get(text, text)
+
+
+def gzip_stream(chunks, compresslevel=GZIP_LEVEL):
+    """Compress a stream of byte chunks into a gzip member on the fly"""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_csv_gz(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    return gzip_stream(stream_csv(queryset, fields, chunk_size, progress))
+
+
+def stream_json_gz(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    return gzip_stream(stream_json(queryset, fields, chunk_size, progress))
+
+
+def chunk_columns(chunk, fields):
+    """
+    Convert a chunk of (timestamp, *fields) rows into NumPy columns.
+
+    Timestamps become int64 microseconds since the epoch, metrics float32.
+    """
+    seconds = np.fromiter((row[0].timestamp() for row in chunk), dtype=np.float64, count=len(chunk))
+    columns = {'timestamp': np.rint(seconds * 1e6).astype(TIMESTAMP_DTYPE)}
+    values = np.array([row[1:] for row in chunk], dtype=VALUE_DTYPE).reshape(len(chunk), len(fields))
+    for i, field in enumerate(fields):
+        columns[field] = np.ascontiguousarray(values[:, i])
+    return columns
+
+
+def write_npz(queryset, fields, fileobj, chunk_size=COLUMNAR_CHUNK_SIZE, progress=None):
+    """
+    Write a compressed NumPy archive with one 1-D array per column.
+
+    Rows arrive in time order but .npy members are column-major, so each column
+    is spooled to a temporary file first; memory stays at one chunk of rows.
+    The archive loads with numpy.load(path).
+    """
+    columns = ['timestamp'] + fields
+    spools = {name: tempfile.TemporaryFile() for name in columns}
+    rows = 0
+    try:
+        for chunk in iter_chunks(queryset, fields, chunk_size, progress):
+            for name, array in chunk_columns(chunk, fields).items():
+                spools[name].write(array.tobytes())
+            rows += len(chunk)
+
+        with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for name in columns:
+                dtype = TIMESTAMP_DTYPE if name == 'timestamp' else VALUE_DTYPE
+                header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)}
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, header)
+                    spools[name].seek(0)
+                    shutil.copyfileobj(spools[name], member, 1024 * 1024)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+
+def write_parquet(queryset, fields, fileobj, chunk_size=COLUMNAR_CHUNK_SIZE, progress=None):
+    """Write a Parquet file, one row group per chunk (requires pyarrow)"""
+    if pq is None:
+        raise RuntimeError('Parquet export requires pyarrow')
+    timestamp_type = pa.timestamp('us', tz='UTC')
+    schema = pa.schema([('timestamp', timestamp_type)] + [(field, pa.float32()) for field in fields])
+    with pq.ParquetWriter(fileobj, schema, compression='zstd') as writer:
+        for chunk in iter_chunks(queryset, fields, chunk_size, progress):
+            columns = chunk_columns(chunk, fields)
+            arrays = [pa.array(columns['timestamp'], type=timestamp_type)]
+            arrays += [pa.array(columns[field]) for field in fields]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+# Export formats offered on the export page. Text formats provide a 'stream'
+# generator of byte chunks, columnar formats a 'write' function taking a file.
+EXPORT_FORMATS = {
+    'csv': {'extension': 'csv', 'content_type': 'text/csv', 'stream': stream_csv},
+    'json': {'extension': 'json', 'content_type': 'application/json', 'stream': stream_json},
+    'csv_gz': {'extension': 'csv.gz', 'content_type': 'application/gzip', 'stream': stream_csv_gz},
+    'json_gz': {'extension': 'json.gz', 'content_type': 'application/gzip', 'stream': stream_json_gz},
+    'npz': {'extension': 'npz', 'content_type': 'application/octet-stream', 'write': write_npz},
+}
+if pq is not None:
+    EXPORT_FORMATS['parquet'] = {'extension': 'parquet', 'content_type': 'application/vnd.apache.parquet',
+                                 'write': write_parquet}
+
+
+def write_export(format_type, queryset, fields, fileobj, progress=None):
+    """Write an export in any of EXPORT_FORMATS to a binary file object"""
+    export_format = EXPORT_FORMATS[format_type]
+    if 'write' in export_format:
+        export_format['write'](queryset, fields, fileobj, progress=progress)
+    else:
+        for chunk in export_format['stream'](queryset, fields, progress=progress):
+            fileobj.write(chunk)
+
+
+def _drain(buffer):
+    data = buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    return data
@@ -0,0 +1,230 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import SensorData
+from .signals import sensor_data_ingested
+
+logger = logging.getLogger(__name__)
+
+ACK_AFTER_FLUSH = 'ack_after_flush'
+ACK_ON_ENQUEUE = 'ack_on_enqueue'
+
+DEFAULT_BUFFER_SETTINGS = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 200,
+    'MAX_BATCH_SIZE': 500,
+    'DURABILITY': ACK_AFTER_FLUSH,
+    'ACK_TIMEOUT_S': 5.0,
+}
+
+
+def save_readings(validated_readings):
+    """
+    Persist a list of validated readings with a single bulk_create
+
+    All rows are written inside one transaction, so a batch is either stored
+    completely or not at all. Receivers of sensor_data_ingested run inside the
+    same transaction. Returns the created SensorData instances.
+    """
+    objs = [SensorData(**reading) for reading in validated_readings]
+    with transaction.atomic():
+        SensorData.objects.bulk_create(objs)
+        sensor_data_ingested.send(sender=SensorData, readings=objs)
+    return objs
+
+
+class PendingWrite:
+    """Readings handed to the buffer by one request, waiting for their group commit"""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.objects = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, objects=None, error=None):
+        self.objects = objects
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the readings are flushed; returns False on timeout"""
+        return self._done.wait(timeout)
+
+
+class IngestBuffer:
+    """
+    Write-behind buffer that group-commits SensorData rows
+
+    Requests enqueue validated readings and a single flusher thread writes
+    everything that arrived within one flush interval (or up to max_batch_size
+    rows) with one bulk_create. With SQLite this turns many short write
+    transactions competing for the database lock into a few larger ones.
+    """
+
+    def __init__(self, flush_interval_ms=200, max_batch_size=500, durability=ACK_AFTER_FLUSH, autostart=True):
+        if durability not in (ACK_AFTER_FLUSH, ACK_ON_ENQUEUE):
+            raise ValueError(f"Unknown durability mode '{durability}'")
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.durability = durability
+        self.autostart = autostart
+
+        self._queue = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._counters = {
+            'enqueued_rows': 0,
+            'flushed_rows': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def submit(self, readings):
+        """Queue validated readings and return a PendingWrite for them"""
+        # Stamp readings now, not when the flusher gets to them
+        now = timezone.now()
+        readings = [dict(reading) for reading in readings]
+        for reading in readings:
+            reading.setdefault('timestamp', now)
+
+        pending = PendingWrite(readings)
+        self._queue.put(pending)
+        with self._stats_lock:
+            self._counters['enqueued_rows'] += len(readings)
+        if self.autostart:
+            self.start()
+        return pending
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sensor-ingest-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher thread and write whatever is still queued"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2 + 5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            rows = len(first.readings)
+            deadline = time.monotonic() + self.flush_interval
+            while rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                rows += len(pending.readings)
+            self._write(batch)
+        close_old_connections()
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        readings = [reading for pending in batch for reading in pending.readings]
+        started = time.perf_counter()
+        with self._flush_lock:
+            try:
+                close_old_connections()
+                objects = save_readings(readings)
+            except Exception as e:
+                logger.exception('Group commit of %d sensor readings failed', len(readings))
+                with self._stats_lock:
+                    self._counters['failed_flushes'] += 1
+                for pending in batch:
+                    pending.resolve(error=e)
+                return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            counters = self._counters
+            counters['flushes'] += 1
+            counters['flushed_rows'] += len(objects)
+            counters['last_batch_size'] = len(objects)
+            counters['last_flush_ms'] = elapsed_ms
+            counters['max_flush_ms'] = max(counters['max_flush_ms'], elapsed_ms)
+            counters['total_flush_ms'] += elapsed_ms
+
+        offset = 0
+        for pending in batch:
+            count = len(pending.readings)
+            pending.resolve(objects=objects[offset:offset + count])
+            offset += count
+
+    def stats(self):
+        """Snapshot of the buffer counters, including the current queue depth"""
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['flushes'] if stats['flushes'] else 0.0
+        stats['durability'] = self.durability
+        stats['flush_interval_ms'] = self.flush_interval * 1000
+        stats['max_batch_size'] = self.max_batch_size
+        return stats
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer_settings():
+    return {**DEFAULT_BUFFER_SETTINGS, **getattr(settings, 'SENSOR_INGEST_BUFFER', {})}
+
+
+def get_ingest_buffer():
+    """Return the process-wide IngestBuffer, or None when buffering is disabled"""
+    global _buffer
+    config = get_buffer_settings()
+    if not config['ENABLED']:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = IngestBuffer(
+                    flush_interval_ms=config['FLUSH_INTERVAL_MS'],
+                    max_batch_size=config['MAX_BATCH_SIZE'],
+                    durability=config['DURABILITY'],
+                )
+                atexit.register(_buffer.stop)
+    return _buffer
@@ -0,0 +1,192 @@
+"""
+Background export jobs
+
+Large exports are written by a small thread pool instead of the request
+thread: the POST only records an ExportJob and returns, the worker streams the
+rows into a file under MEDIA_ROOT/exports/ and keeps rows_written up to date so
+clients can poll for progress, then download the finished artifact.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .export import EXPORT_FORMATS, export_queryset, write_export
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_SETTINGS = {
+    'WORKERS': 2,
+    'REUSE_SECONDS': 600,
+    'RETENTION_SECONDS': 24 * 60 * 60,
+    'STALE_SECONDS': 120,
+    'PROGRESS_INTERVAL_S': 0.5,
+}
+
+
+def get_job_settings():
+    return {**DEFAULT_JOB_SETTINGS, **getattr(settings, 'SENSOR_EXPORT_JOBS', {})}
+
+
+def params_hash(format_type, params, fields):
+    """
+    Identity of an export request.
+
+    params are the range selection as submitted (e.g. {'time_range': '7days'}),
+    not the resolved datetimes, so repeated requests for a relative range match
+    for as long as the artifact is reused.
+    """
+    payload = json.dumps({'format': format_type, 'params': params, 'fields': fields}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def find_reusable_job(digest):
+    """A running or recently finished job for the same parameters, if any"""
+    config = get_job_settings()
+    now = timezone.now()
+    active = ExportJob.objects.filter(
+        params_hash=digest,
+        status__in=['pending', 'running'],
+        updated_at__gte=now - timedelta(seconds=config['STALE_SECONDS']),
+    ).first()
+    if active:
+        return active
+    done = ExportJob.objects.filter(
+        params_hash=digest,
+        status='done',
+        finished_at__gte=now - timedelta(seconds=config['REUSE_SECONDS']),
+    ).first()
+    if done and done.file and default_storage.exists(done.file.name):
+        return done
+    return None
+
+
+class ExportJobRunner:
+    """Thread pool running ExportJobs, one export per worker at a time"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, user, format_type, params, start, end, fields):
+        """
+        Return (job, created): an existing job for the same parameters, or a new
+        one queued on the pool.
+        """
+        if format_type not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{format_type}'")
+        digest = params_hash(format_type, params, fields)
+        # The lock keeps two identical requests in this process from both creating a job
+        with self._lock:
+            job = find_reusable_job(digest)
+            if job:
+                return job, False
+            job = ExportJob.objects.create(
+                requested_by=user if user and user.is_authenticated else None,
+                params_hash=digest,
+                format=format_type,
+                fields=','.join(fields),
+                start=start,
+                end=end,
+            )
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sensor-export')
+        # Start once the job row is visible to the worker's connection
+        transaction.on_commit(lambda: self._executor.submit(self.run, job.pk))
+        return job, True
+
+    def run(self, job_id):
+        try:
+            run_export_job(job_id)
+        except Exception:
+            logger.exception('Export job %s failed', job_id)
+        finally:
+            close_old_connections()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def run_export_job(job_id):
+    """Write the export for one job to MEDIA_ROOT, recording progress as it goes"""
+    close_old_connections()
+    config = get_job_settings()
+    job = ExportJob.objects.get(pk=job_id)
+    queryset = export_queryset(job.start, job.end)
+    fields = job.fields.split(',') if job.fields else []
+    total = queryset.count()
+    ExportJob.objects.filter(pk=job.pk).update(status='running', rows_total=total, updated_at=timezone.now())
+
+    written = 0
+    last_update = time.monotonic()
+
+    def progress(rows):
+        nonlocal written, last_update
+        written += rows
+        if time.monotonic() - last_update >= config['PROGRESS_INTERVAL_S']:
+            last_update = time.monotonic()
+            ExportJob.objects.filter(pk=job.pk).update(rows_written=written, updated_at=timezone.now())
+
+    extension = EXPORT_FORMATS[job.format]['extension']
+    name = f'exports/sensor_data_{job.start:%Y%m%d}_to_{job.end:%Y%m%d}_{job.pk.hex[:12]}.{extension}'
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.part'
+    try:
+        with open(partial, 'wb') as output:
+            write_export(job.format, queryset, fields, output, progress=progress)
+        os.replace(partial, path)
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status='failed', error=str(e), rows_written=written,
+            updated_at=timezone.now(), finished_at=timezone.now(),
+        )
+        raise
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='done', file=name, size=os.path.getsize(path), rows_written=written,
+        rows_total=max(total, written), updated_at=timezone.now(), finished_at=timezone.now(),
+    )
+    purge_expired_jobs()
+
+
+def purge_expired_jobs():
+    """Delete finished jobs, and their files, older than RETENTION_SECONDS"""
+    cutoff = timezone.now() - timedelta(seconds=get_job_settings()['RETENTION_SECONDS'])
+    expired = ExportJob.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff)
+    for job in expired:
+        if job.file:
+            default_storage.delete(job.file.name)
+    expired.delete()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_export_job_runner():
+    """Return the process-wide ExportJobRunner"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = ExportJobRunner(workers=get_job_settings()['WORKERS'])
+                atexit.register(_runner.shutdown, wait=False)
+    return _runner
@@ -0,0 +1,207 @@
+"""
+Live stream of new readings (Server-Sent Events)
+
+Readings reach the stream from the ingest path: the sensor_data_ingested
+receiver hands every committed batch to the process-wide ReadingBroker, which
+encodes each reading once and fans the same bytes out to every connected
+client's queue on its event loop. The stream view is async, so under the ASGI
+entry point (config/asgi.py) an idle connection costs a queue and a suspended
+coroutine rather than a thread.
+
+Event ids are SensorData ids, the same cursor as the list API's X-Next-Cursor.
+A client resumes with the Last-Event-ID header (sent automatically by
+EventSource when it reconnects) or ?since=<cursor>; readings stored after the
+cursor are replayed from the database before live events. A client that falls
+too far behind is disconnected and catches up the same way.
+
+The broker is in-process: run the ASGI server with a single worker, or readings
+ingested by another worker only reach clients when they reconnect.
+"""
+import asyncio
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+from .models import METRICS, SensorData
+from .renderers import encode_json
+from .serializers import format_timestamps
+
+DEFAULT_STREAM_SETTINGS = {
+    'HEARTBEAT_S': 15,
+    'RETRY_MS': 3000,
+    'QUEUE_SIZE': 256,
+    'REPLAY_LIMIT': 2000,
+}
+
+# Sent, with the current cursor, when the backlog after a client's cursor is longer
+# than REPLAY_LIMIT: the client should reload from the list API
+RESET_EVENT = b'id: %d\nevent: reset\ndata: {}\n\n'
+
+HEARTBEAT = b': ping\n\n'
+
+
+def get_stream_settings():
+    return {**DEFAULT_STREAM_SETTINGS, **getattr(settings, 'SENSOR_LIVE_STREAM', {})}
+
+
+def encode_events(rows):
+    """
+    SSE 'reading' events for (id, *METRICS, timestamp) tuples.
+
+    The data of each event is the reading in the list API's row format. Returns
+    a list of (id, bytes) pairs.
+    """
+    timestamps = format_timestamps([row[-1] for row in rows])
+    events = []
+    for row, timestamp in zip(rows, timestamps):
+        data = encode_json({**dict(zip(METRICS, row[1:-1])), 'timestamp': timestamp})
+        events.append((row[0], b'id: %d\nevent: reading\ndata: %s\n\n' % (row[0], data)))
+    return events
+
+
+class Subscription:
+    """One connected client: a bounded queue of event batches on its event loop"""
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def deliver(self, events):
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            # The client is not keeping up; the stream ends and it resumes from its cursor
+            self.overflowed = True
+
+
+class ReadingBroker:
+    """Fan-out of ingested readings to the subscriptions of every event loop"""
+
+    def __init__(self, queue_size=DEFAULT_STREAM_SETTINGS['QUEUE_SIZE']):
+        self.queue_size = queue_size
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self):
+        """Register a subscription on the running event loop"""
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(loop, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.loop)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.loop]
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, readings):
+        """
+        Send stored SensorData instances to every subscriber. Safe to call from
+        any thread; the events are encoded once, and each event loop is woken
+        once per batch rather than once per subscriber.
+        """
+        with self._lock:
+            targets = [(loop, list(subscriptions)) for loop, subscriptions in self._subscriptions.items()]
+        if not targets or not readings:
+            return
+        events = encode_events([
+            (reading.pk, *(getattr(reading, metric) for metric in METRICS), reading.timestamp)
+            for reading in readings if reading.pk is not None
+        ])
+        self.published += len(events)
+        for loop, subscriptions in targets:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(_deliver_all, subscriptions, events)
+
+
+def _deliver_all(subscriptions, events):
+    for subscription in subscriptions:
+        subscription.deliver(events)
+
+
+def latest_id():
+    return SensorData.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def replay_events(cursor, limit):
+    """Events for readings stored after cursor, or None when there are more than limit"""
+    rows = list(SensorData.objects.filter(id__gt=cursor).order_by('id')
+                .values_list('id', *METRICS, 'timestamp')[:limit + 1])
+    if len(rows) > limit:
+        return None
+    return encode_events(rows)
+
+
+def parse_cursor(value):
+    """Event id / since cursor as an int, or None when missing or malformed"""
+    if value is None:
+        return None
+    value = value.strip()
+    return int(value) if value.isdigit() else None
+
+
+async def reading_stream(broker, cursor=None, config=None):
+    """
+    Async iterator of SSE bytes: replay after cursor, then live events with a
+    comment every HEARTBEAT_S seconds while nothing happens.
+    """
+    config = config or get_stream_settings()
+    subscription = broker.subscribe()
+    try:
+        # Subscribe before reading the backlog so nothing stored meanwhile is missed;
+        # events at or below the cursor are skipped below
+        if cursor is None:
+            cursor = await sync_to_async(latest_id)()
+            backlog = []
+        else:
+            backlog = await sync_to_async(replay_events)(cursor, config['REPLAY_LIMIT'])
+        # An id-only block sets the client's Last-Event-ID without dispatching an event
+        yield b'retry: %d\nid: %d\n\n' % (config['RETRY_MS'], cursor)
+        if backlog is None:
+            cursor = await sync_to_async(latest_id)()
+            yield RESET_EVENT % cursor
+            backlog = []
+        if backlog:
+            cursor = backlog[-1][0]
+            yield b''.join(chunk for _, chunk in backlog)
+
+        while not subscription.overflowed:
+            try:
+                events = await asyncio.wait_for(subscription.queue.get(), config['HEARTBEAT_S'])
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            fresh = [(event_id, chunk) for event_id, chunk in events if event_id > cursor]
+            if fresh:
+                cursor = max(cursor, fresh[-1][0])
+                yield b''.join(chunk for _, chunk in fresh)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_reading_broker():
+    """Return the process-wide ReadingBroker"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = ReadingBroker(queue_size=get_stream_settings()['QUEUE_SIZE'])
+    return _broker
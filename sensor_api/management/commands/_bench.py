@@ -0,0 +1,53 @@
+"""Shared helpers for the benchmark management commands (not a command itself)."""
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database(on_disk=True):
+    """
+    Run the body against a freshly migrated throwaway database.
+
+    Benchmarks must never write into the real db.sqlite3. With SQLite the
+    temporary database is put on disk by default so commit costs are realistic.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous_test_name = test_settings.get('NAME')
+    tmpdir = None
+    if on_disk and connection.vendor == 'sqlite':
+        tmpdir = tempfile.mkdtemp(prefix='sensor_bench_')
+        test_settings['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous_test_name
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@contextmanager
+def timed(results, label):
+    """Store the wall-clock duration of the body in results[label]"""
+    start = time.perf_counter()
+    yield
+    results[label] = time.perf_counter() - start
+
+
+def sample_reading(i):
+    """A deterministic, plausible reading for benchmark data"""
+    return {
+        'co2': 400.0 + (i % 600),
+        'humidity': 40.0 + (i % 30),
+        'temperature': 20.0 + (i % 10) / 2,
+        'pm1_0': 5.0 + (i % 20),
+        'pm2_5': 8.0 + (i % 40),
+        'pm10_0': 15.0 + (i % 80),
+    }
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from sensor_api.models import SensorData
+from sensor_api.rollups import rebuild_rollups
+from sensor_api.views import SensorDataListAPIView
+from ._bench import benchmark_database, timed, sample_reading
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and latency of the raw list API with bucket and LTTB downsampling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=7 * 24, help='Window requested from the list API')
+        parser.add_argument('--interval', type=int, default=10, help='Seconds between stored readings')
+        parser.add_argument('--max-points', type=int, default=800, help='Points requested when downsampling')
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per variant; the fastest is reported')
+        parser.add_argument('--insert-batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        hours = options['hours']
+        interval = options['interval']
+        max_points = options['max_points']
+        batch_size = options['insert_batch_size']
+        rows = hours * 3600 // interval
+        variants = {
+            'raw': {'hours': hours},
+            'bucket': {'hours': hours, 'max_points': max_points},
+            'lttb': {'hours': hours, 'max_points': max_points, 'method': 'lttb'},
+        }
+        results = {}
+        sizes = {}
+        points = {}
+
+        with benchmark_database():
+            end = timezone.now()
+            start = end - timedelta(seconds=interval * rows)
+            for offset in range(0, rows, batch_size):
+                SensorData.objects.bulk_create([
+                    SensorData(timestamp=start + timedelta(seconds=interval * (i + 1)), **sample_reading(i))
+                    for i in range(offset, min(offset + batch_size, rows))
+                ])
+            # bulk_create skips the ingest signal, so build the rollups in one pass
+            rebuild_rollups()
+
+            user = User.objects.create_user(username='bench', password='bench')
+            factory = APIRequestFactory()
+            view = SensorDataListAPIView.as_view()
+            for name, params in variants.items():
+                timings = {}
+                for attempt in range(options['repeat']):
+                    request = factory.get('/api/sensor/list/', params)
+                    force_authenticate(request, user=user)
+                    with timed(timings, attempt):
+                        response = view(request)
+                        response.render()
+                results[name] = min(timings.values())
+                sizes[name] = len(response.content)
+                points[name] = len(response.data)
+
+        self.stdout.write(f'Window: {hours}h, {rows} readings, max_points={max_points}')
+        self.stdout.write(f"{'variant':>8} {'points':>8} {'size (KB)':>10} {'vs raw':>7} {'time (ms)':>10} {'speedup':>8}")
+        for name, elapsed in results.items():
+            self.stdout.write(
+                f'{name:>8} {points[name]:8d} {sizes[name] / 1e3:10.1f} {sizes[name] / sizes["raw"]:6.3f}x '
+                f'{elapsed * 1e3:10.1f} {results["raw"] / elapsed:7.1f}x'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Bucket payload is {sizes["raw"] / sizes["bucket"]:.0f}x smaller and '
+            f'{results["raw"] / results["bucket"]:.0f}x faster than raw'
+        ))
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sensor_api.export import EXPORT_FIELDS, EXPORT_FORMATS, export_queryset, write_export
+from sensor_api.models import SensorData
+from ._bench import benchmark_database, timed, sample_reading
+
+
+class CountingSink:
+    """Binary file object that only counts what is written to it"""
+
+    closed = False
+
+    def __init__(self):
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the size and generation time of every export format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Readings in the exported range')
+        parser.add_argument('--insert-batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['insert_batch_size']
+        results = {}
+        sizes = {}
+
+        with benchmark_database():
+            # One reading every 10 seconds, ending now
+            end = timezone.now()
+            start = end - timedelta(seconds=10 * rows)
+            for offset in range(0, rows, batch_size):
+                SensorData.objects.bulk_create([
+                    SensorData(timestamp=start + timedelta(seconds=10 * i), **sample_reading(i))
+                    for i in range(offset, min(offset + batch_size, rows))
+                ])
+
+            queryset = export_queryset(start, end)
+            for format_type in EXPORT_FORMATS:
+                sink = CountingSink()
+                with timed(results, format_type):
+                    write_export(format_type, queryset, list(EXPORT_FIELDS), sink)
+                sizes[format_type] = sink.size
+
+        self.stdout.write(f'Rows exported: {rows} (all sensor types)')
+        self.stdout.write(f"{'format':>8} {'size (MB)':>10} {'vs csv':>7} {'time (s)':>9} {'rows/sec':>11}")
+        for format_type, elapsed in results.items():
+            size = sizes[format_type]
+            self.stdout.write(
+                f'{format_type:>8} {size / 1e6:10.2f} {size / sizes["csv"]:6.2f}x {elapsed:9.3f} {rows / elapsed:11.0f}'
+            )
+        smallest = min(sizes, key=sizes.get)
+        self.stdout.write(self.style.SUCCESS(
+            f'Smallest: {smallest}, {sizes["csv"] / sizes[smallest]:.1f}x smaller than CSV'
+        ))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from sensor_api.models import SensorData
+from ._bench import benchmark_database, timed, sample_reading
+
+
+class Command(BaseCommand):
+    help = 'Compare ingest throughput (rows/sec) of single-reading POSTs against batch uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Readings to ingest per path')
+        parser.add_argument('--batch-size', type=int, default=500, help='Readings per batch request')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['batch_size']
+        readings = [sample_reading(i) for i in range(rows)]
+        results = {}
+
+        with benchmark_database():
+            client = APIClient()
+
+            with timed(results, 'single'):
+                url = reverse('sensor-create')
+                for reading in readings:
+                    client.post(url, reading, format='json')
+
+            SensorData.objects.all().delete()
+
+            with timed(results, 'batch'):
+                url = reverse('sensor-batch-create')
+                for start in range(0, rows, batch_size):
+                    client.post(url, readings[start:start + batch_size], format='json')
+
+            stored = SensorData.objects.count()
+
+        if stored != rows:
+            self.stderr.write(self.style.WARNING(f'Expected {rows} rows after the batch run, found {stored}'))
+
+        self.stdout.write(f'Rows per path: {rows} (batch size {batch_size})')
+        for label in ('single', 'batch'):
+            elapsed = results[label]
+            self.stdout.write(f'{label:>7}: {elapsed:8.3f}s  {rows / elapsed:12.1f} rows/sec')
+        self.stdout.write(self.style.SUCCESS(f"Batch speed-up: {results['single'] / results['batch']:.1f}x"))
@@ -0,0 +1,64 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from sensor_api import renderers
+from sensor_api.models import SensorData
+from sensor_api.renderers import SensorJSONRenderer
+from sensor_api.serializers import SensorDataSerializer, serialize_rows
+from ._bench import benchmark_database, timed, sample_reading
+
+
+class Command(BaseCommand):
+    help = 'Compare the ModelSerializer read path of the list API with the values_list fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='Row counts to serialize')
+        parser.add_argument('--insert-batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['insert_batch_size']
+        report = []
+        mismatches = []
+
+        with benchmark_database():
+            inserted = 0
+            end = timezone.now()
+            for rows in sorted(options['rows']):
+                # Top up the table to `rows` readings, one every 10 seconds before end
+                for offset in range(inserted, rows, batch_size):
+                    SensorData.objects.bulk_create([
+                        SensorData(timestamp=end - timedelta(seconds=10 * i, microseconds=i % 1000), **sample_reading(i))
+                        for i in range(offset, min(offset + batch_size, rows))
+                    ])
+                inserted = rows
+                queryset = SensorData.objects.order_by('timestamp')
+
+                results = {}
+                with timed(results, 'ModelSerializer'):
+                    expected = JSONRenderer().render(SensorDataSerializer(queryset, many=True).data)
+                with timed(results, 'values_list+stdlib'), mock.patch.object(renderers, 'orjson', None):
+                    stdlib = SensorJSONRenderer().render(serialize_rows(queryset))
+                outputs = {'values_list+stdlib': stdlib}
+                if renderers.orjson is not None:
+                    with timed(results, 'values_list+orjson'):
+                        outputs['values_list+orjson'] = SensorJSONRenderer().render(serialize_rows(queryset))
+                mismatches += [f'{name} at {rows} rows' for name, output in outputs.items() if output != expected]
+                report.append((rows, results))
+
+        self.stdout.write(f"{'rows':>8} {'path':>20} {'time (s)':>9} {'rows/sec':>11} {'speedup':>8}")
+        for rows, results in report:
+            baseline = results['ModelSerializer']
+            for name, elapsed in results.items():
+                self.stdout.write(
+                    f'{rows:8d} {name:>20} {elapsed:9.3f} {rows / elapsed:11.0f} {baseline / elapsed:7.1f}x'
+                )
+        if renderers.orjson is None:
+            self.stdout.write('orjson is not installed; only the stdlib encoder was measured')
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"Output differs from ModelSerializer: {', '.join(mismatches)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('All outputs are byte-identical to the ModelSerializer path'))
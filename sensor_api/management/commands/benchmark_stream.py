@@ -0,0 +1,120 @@
+import asyncio
+import os
+import re
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from sensor_api.ingest import save_readings
+from sensor_api.live import get_reading_broker, get_stream_settings, latest_id, reading_stream
+from ._bench import benchmark_database, sample_reading
+
+EVENT_ID = re.compile(rb'id: (\d+)\nevent: reading\n')
+
+
+def resident_set_size():
+    """Current RSS in bytes, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = 'Measure how fast the live stream fans ingested readings out to many connected clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000, 5000],
+                            help='Connected stream clients per round')
+        parser.add_argument('--events', type=int, default=20, help='Readings ingested per round')
+        parser.add_argument('--interval-ms', type=int, default=50, help='Pause between ingested readings')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for all deliveries')
+
+    def handle(self, *args, **options):
+        rows = []
+        with benchmark_database():
+            for clients in options['clients']:
+                rows.append((clients, *self.run_round(clients, options)))
+
+        self.stdout.write(f"Events per round: {options['events']}, one reading each, "
+                          f"{options['interval_ms']} ms apart, ingested through save_readings()")
+        self.stdout.write(f"{'clients':>8} {'delivered':>10} {'p50 (ms)':>9} {'p99 (ms)':>9} "
+                          f"{'max (ms)':>9} {'connect (s)':>11} {'KB/client':>10}")
+        for clients, delivered, latencies, connect_time, memory in rows:
+            memory_text = f'{memory / clients / 1024:10.1f}' if memory is not None else f"{'n/a':>10}"
+            self.stdout.write(
+                f'{clients:8d} {delivered:10d} {percentile(latencies, 0.5) * 1e3:9.2f} '
+                f'{percentile(latencies, 0.99) * 1e3:9.2f} {max(latencies) * 1e3:9.2f} '
+                f'{connect_time:11.2f} {memory_text}'
+            )
+        missing = [clients for clients, delivered, *_ in rows if delivered < clients * options['events']]
+        if missing:
+            self.stdout.write(self.style.ERROR(f'Some events were not delivered with {missing} clients'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every event reached every client'))
+
+    def run_round(self, clients, options):
+        """Connect `clients` streams on one event loop thread, ingest readings and time their arrival"""
+        broker = get_reading_broker()
+        # No heartbeats during the measurement
+        config = {**get_stream_settings(), 'HEARTBEAT_S': 3600}
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        arrivals = []
+        connected = 0
+        all_connected = threading.Event()
+        lock = threading.Lock()
+        cursor = latest_id()
+
+        async def client():
+            nonlocal connected
+            stream = reading_stream(broker, cursor, config)
+            try:
+                await stream.__anext__()  # Subscribed and replayed
+                with lock:
+                    connected += 1
+                    if connected == clients:
+                        all_connected.set()
+                async for chunk in stream:
+                    received = time.perf_counter()
+                    arrivals.extend((int(event_id), received) for event_id in EVENT_ID.findall(chunk))
+            finally:
+                await stream.aclose()
+
+        rss_before = resident_set_size()
+        started = time.perf_counter()
+        futures = [asyncio.run_coroutine_threadsafe(client(), loop) for _ in range(clients)]
+        all_connected.wait(options['timeout'])
+        connect_time = time.perf_counter() - started
+        rss_after = resident_set_size()
+
+        sent = {}
+        for i in range(options['events']):
+            ingested = time.perf_counter()
+            reading = save_readings([sample_reading(i)])[0]
+            sent[reading.pk] = ingested
+            time.sleep(options['interval_ms'] / 1000)
+
+        deadline = time.monotonic() + options['timeout']
+        while len(arrivals) < clients * options['events'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        for future in futures:
+            future.cancel()
+        time.sleep(0.1)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+        latencies = [received - sent[event_id] for event_id, received in arrivals if event_id in sent]
+        memory = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        return len(latencies), latencies, connect_time, memory
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sensor_api.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the minute/hour/day SensorData rollup tables from raw readings'
+
+    def handle(self, *args, **kwargs):
+        written = rebuild_rollups()
+        for name, count in written.items():
+            self.stdout.write(f'{name}: {count} buckets')
+        self.stdout.write(self.style.SUCCESS('Rollups rebuilt from raw sensor data'))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=models.Index(fields=['timestamp', 'co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0'], name='sensordata_ts_covering_idx'),
+        ),
+    ]
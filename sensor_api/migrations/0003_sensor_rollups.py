@@ -0,0 +1,160 @@
+# Generated by Django 5.2 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+# Frozen copies of the rollup layout at this migration, so the backfill does not
+# change when sensor_api.rollups does
+METRICS = ('co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0')
+ROLLUP_TABLES = [
+    ('sensor_api_sensorrollupday', 'day'),
+    ('sensor_api_sensorrolluphour', 'hour'),
+    ('sensor_api_sensorrollupminute', 'minute'),
+]
+SQLITE_TRUNC_FORMATS = {
+    'day': '%Y-%m-%d 00:00:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'minute': '%Y-%m-%d %H:%M:00',
+}
+
+
+def backfill_rollups(apps, schema_editor):
+    connection = schema_editor.connection
+    columns = ['bucket_start', 'count']
+    selects = ['COUNT(*)']
+    for metric in METRICS:
+        columns += [f'{metric}_sum', f'{metric}_sumsq', f'{metric}_min', f'{metric}_max']
+        selects += [f'SUM({metric})', f'SUM({metric} * {metric})', f'MIN({metric})', f'MAX({metric})']
+
+    with connection.cursor() as cursor:
+        for table, unit in ROLLUP_TABLES:
+            if connection.vendor == 'sqlite':
+                # Timestamps are stored as UTC text
+                bucket = f"strftime('{SQLITE_TRUNC_FORMATS[unit]}', timestamp)"
+            else:
+                bucket = f"date_trunc('{unit}', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'SELECT {bucket}, {", ".join(selects)} '
+                f'FROM sensor_api_sensordata GROUP BY {bucket}'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor_api', '0002_sensordata_timestamp_covering_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollupDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('co2_sum', models.FloatField(default=0)),
+                ('co2_sumsq', models.FloatField(default=0)),
+                ('co2_min', models.FloatField(null=True)),
+                ('co2_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_sumsq', models.FloatField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_sumsq', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('pm1_0_sum', models.FloatField(default=0)),
+                ('pm1_0_sumsq', models.FloatField(default=0)),
+                ('pm1_0_min', models.FloatField(null=True)),
+                ('pm1_0_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(default=0)),
+                ('pm2_5_sumsq', models.FloatField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_0_sum', models.FloatField(default=0)),
+                ('pm10_0_sumsq', models.FloatField(default=0)),
+                ('pm10_0_min', models.FloatField(null=True)),
+                ('pm10_0_max', models.FloatField(null=True)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('co2_sum', models.FloatField(default=0)),
+                ('co2_sumsq', models.FloatField(default=0)),
+                ('co2_min', models.FloatField(null=True)),
+                ('co2_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_sumsq', models.FloatField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_sumsq', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('pm1_0_sum', models.FloatField(default=0)),
+                ('pm1_0_sumsq', models.FloatField(default=0)),
+                ('pm1_0_min', models.FloatField(null=True)),
+                ('pm1_0_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(default=0)),
+                ('pm2_5_sumsq', models.FloatField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_0_sum', models.FloatField(default=0)),
+                ('pm10_0_sumsq', models.FloatField(default=0)),
+                ('pm10_0_min', models.FloatField(null=True)),
+                ('pm10_0_max', models.FloatField(null=True)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('co2_sum', models.FloatField(default=0)),
+                ('co2_sumsq', models.FloatField(default=0)),
+                ('co2_min', models.FloatField(null=True)),
+                ('co2_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_sumsq', models.FloatField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_sumsq', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('pm1_0_sum', models.FloatField(default=0)),
+                ('pm1_0_sumsq', models.FloatField(default=0)),
+                ('pm1_0_min', models.FloatField(null=True)),
+                ('pm1_0_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(default=0)),
+                ('pm2_5_sumsq', models.FloatField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_0_sum', models.FloatField(default=0)),
+                ('pm10_0_sumsq', models.FloatField(default=0)),
+                ('pm10_0_min', models.FloatField(null=True)),
+                ('pm10_0_max', models.FloatField(null=True)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor_api', '0004_export_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorDataGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,12 @@
+import uuid
+
+from django.contrib.auth.models import User
 from django.db import models
 from django.utils import timezone
 
+# Measured quantities stored on every reading
+METRICS = ('co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0')
+
 class SensorData(models.Model):
     co2 = models.FloatField()
     humidity = models.FloatField()
@@ -10,5 +16,134 @@ class SensorData(models.Model):
     pm10_0 = models.FloatField()
     timestamp = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Every read filters on a timestamp range. Leading with timestamp makes this
+            # the timestamp index; the metric columns (plus the implicit rowid/id) let
+            # SQLite answer the list, export, aggregate and MCP queries from the index alone.
+            models.Index(
+                fields=['timestamp', 'co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0'],
+                name='sensordata_ts_covering_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Sensor Data {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class SensorRollup(models.Model):
+    """
+    Pre-aggregated statistics for one time bucket of SensorData
+
+    Buckets are aligned to UTC. Each metric keeps count/sum/min/max/sum-of-squares,
+    which is enough to merge buckets and derive avg, min, max and standard deviation.
+    """
+    bucket_start = models.DateTimeField(unique=True)
+    count = models.PositiveIntegerField(default=0)
+
+    co2_sum = models.FloatField(default=0)
+    co2_sumsq = models.FloatField(default=0)
+    co2_min = models.FloatField(null=True)
+    co2_max = models.FloatField(null=True)
+
+    humidity_sum = models.FloatField(default=0)
+    humidity_sumsq = models.FloatField(default=0)
+    humidity_min = models.FloatField(null=True)
+    humidity_max = models.FloatField(null=True)
+
+    temperature_sum = models.FloatField(default=0)
+    temperature_sumsq = models.FloatField(default=0)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+
+    pm1_0_sum = models.FloatField(default=0)
+    pm1_0_sumsq = models.FloatField(default=0)
+    pm1_0_min = models.FloatField(null=True)
+    pm1_0_max = models.FloatField(null=True)
+
+    pm2_5_sum = models.FloatField(default=0)
+    pm2_5_sumsq = models.FloatField(default=0)
+    pm2_5_min = models.FloatField(null=True)
+    pm2_5_max = models.FloatField(null=True)
+
+    pm10_0_sum = models.FloatField(default=0)
+    pm10_0_sumsq = models.FloatField(default=0)
+    pm10_0_min = models.FloatField(null=True)
+    pm10_0_max = models.FloatField(null=True)
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket_start']
+
+    def __str__(self):
+        return f"{self.__class__.__name__} {self.bucket_start.strftime('%Y-%m-%d %H:%M')} ({self.count} readings)"
+
+class SensorRollupMinute(SensorRollup):
+    """1-minute buckets"""
+
+class SensorRollupHour(SensorRollup):
+    """1-hour buckets"""
+
+class SensorRollupDay(SensorRollup):
+    """1-day buckets (UTC days)"""
+
+
+class SensorDataGeneration(models.Model):
+    """
+    Counter of edits and deletes of SensorData (a single row)
+
+    New readings show up as a new newest id; changes to stored rows do not,
+    so validators and caches of sensor data also key on this counter.
+    """
+    value = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"Sensor data generation {self.value}"
+
+
+class ExportJob(models.Model):
+    """
+    An export run in the background and written to MEDIA_ROOT
+
+    Jobs with the same params_hash (format, range selection and sensor types)
+    share one artifact while running or for a while after completing.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    params_hash = models.CharField(max_length=64, db_index=True)
+    format = models.CharField(max_length=20)
+    fields = models.CharField(max_length=100)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_written = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to='exports/', blank=True)
+    size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Export {self.format} {self.start:%Y-%m-%d}..{self.end:%Y-%m-%d} ({self.status})"
+
+    @property
+    def progress(self):
+        """Fraction of the estimated rows written, 0.0-1.0"""
+        if self.status == 'done':
+            return 1.0
+        if not self.rows_total:
+            return 0.0
+        return min(self.rows_written / self.rows_total, 1.0)
@@ -0,0 +1,69 @@
+"""
+Rendering of serialized sensor rows and columns
+
+DRF's JSONRenderer runs the stdlib encoder; for large lists of readings
+SensorJSONRenderer encodes SerializedRows (and ColumnarData) with orjson when
+it is installed.
+The output stays byte-identical to JSONRenderer: orjson spells some floats
+differently (1e16 instead of 1e+16, 0.00001 instead of 1e-05, null for NaN),
+so payloads containing any of those are re-encoded with the stdlib encoder.
+"""
+import json
+import re
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .columnar import ColumnarData, encode_binary
+from .serializers import SerializedRows
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder gives the same bytes
+    orjson = None
+
+# Number spellings where orjson and json.dumps disagree. Keys and timestamps
+# never match: no key has a digit followed by 'e', and timestamp seconds have two digits.
+_ORJSON_MISMATCH = re.compile(rb'\de|null|[:\-]0\.0000')
+
+
+def encode_json(data):
+    """Compact JSON for serialized rows or columns, as JSONRenderer would produce it"""
+    if orjson is not None:
+        encoded = orjson.dumps(data)
+        if not _ORJSON_MISMATCH.search(encoded):
+            return encoded
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+class SensorJSONRenderer(JSONRenderer):
+    """JSONRenderer with a fast path for SerializedRows and ColumnarData"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (isinstance(data, (SerializedRows, ColumnarData)) and self.compact and not self.ensure_ascii
+                and self.strict and self.get_indent(accepted_media_type, renderer_context or {}) is None):
+            return encode_json(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ColumnarJSONRenderer(SensorJSONRenderer):
+    """JSON selected with ?format=columnar; the view returns ColumnarData for it"""
+    format = 'columnar'
+
+
+class Float32ColumnsRenderer(BaseRenderer):
+    """
+    Raw little-endian columns (see columnar.py), selected with ?format=binary
+    or Accept: application/octet-stream. Anything else, such as an error
+    response, is rendered as JSON.
+    """
+    media_type = 'application/octet-stream'
+    format = 'binary'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, ColumnarData):
+            return encode_binary(data)
+        if renderer_context and renderer_context.get('response') is not None:
+            renderer_context['response']['Content-Type'] = 'application/json'
+        return SensorJSONRenderer().render(data)
@@ -0,0 +1,363 @@
+"""
+Minute/hour/day rollups of SensorData
+
+Rollups are updated incrementally as readings are ingested (see signals.py),
+their buckets are recomputed when a reading is changed or deleted, and they
+can be rebuilt from raw data with `manage.py rebuild_rollups`. Aggregate
+queries over long windows read whole buckets from the coarsest rollup that
+fits and only touch raw rows for the partial minutes at the edges.
+"""
+import datetime
+import math
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+
+from .models import METRICS, SensorData, SensorRollupDay, SensorRollupHour, SensorRollupMinute
+
+UTC = datetime.timezone.utc
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+# Coarsest first: range planning tries each resolution in this order
+RESOLUTIONS = [
+    (SensorRollupDay, datetime.timedelta(days=1), TruncDay),
+    (SensorRollupHour, datetime.timedelta(hours=1), TruncHour),
+    (SensorRollupMinute, datetime.timedelta(minutes=1), TruncMinute),
+]
+
+# Smallest step of a stored timestamp, used to turn a closed range into a half-open one
+RESOLUTION_EPSILON = datetime.timedelta(microseconds=1)
+
+
+def floor_to(ts, step):
+    """Start of the UTC-aligned bucket of size `step` containing ts"""
+    return EPOCH + ((ts - EPOCH) // step) * step
+
+
+def ceil_to(ts, step):
+    floored = floor_to(ts, step)
+    return floored if floored == ts else floored + step
+
+
+# --- Incremental maintenance ---
+
+def _empty_bucket():
+    bucket = {'count': 0}
+    for metric in METRICS:
+        bucket[f'{metric}_sum'] = 0.0
+        bucket[f'{metric}_sumsq'] = 0.0
+        bucket[f'{metric}_min'] = None
+        bucket[f'{metric}_max'] = None
+    return bucket
+
+
+def _accumulate(bucket, reading):
+    bucket['count'] += 1
+    for metric in METRICS:
+        value = getattr(reading, metric)
+        bucket[f'{metric}_sum'] += value
+        bucket[f'{metric}_sumsq'] += value * value
+        current_min = bucket[f'{metric}_min']
+        current_max = bucket[f'{metric}_max']
+        bucket[f'{metric}_min'] = value if current_min is None else min(current_min, value)
+        bucket[f'{metric}_max'] = value if current_max is None else max(current_max, value)
+
+
+BUCKET_FIELDS = ['count'] + [
+    f'{metric}_{stat}' for metric in METRICS for stat in ('sum', 'sumsq', 'min', 'max')
+]
+
+_upsert_sql_cache = {}
+
+
+def _upsert_sql(model):
+    """
+    INSERT ... ON CONFLICT DO UPDATE statement merging a partial bucket into its row.
+
+    One statement per bucket handles both the first reading of a bucket and
+    concurrent writers, and avoids building ORM update expressions per reading.
+    """
+    key = (connection.alias, model)
+    if key not in _upsert_sql_cache:
+        qn = connection.ops.quote_name
+        least, greatest = ('MIN', 'MAX') if connection.vendor == 'sqlite' else ('LEAST', 'GREATEST')
+        assignments = []
+        for field in BUCKET_FIELDS:
+            column = qn(field)
+            if field.endswith('_min'):
+                value = f'{least}({column}, excluded.{column})'
+            elif field.endswith('_max'):
+                value = f'{greatest}({column}, excluded.{column})'
+            else:
+                value = f'{column} + excluded.{column}'
+            assignments.append(f'{column} = {value}')
+        columns = ['bucket_start'] + BUCKET_FIELDS
+        _upsert_sql_cache[key] = (
+            f"INSERT INTO {qn(model._meta.db_table)} ({', '.join(qn(c) for c in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({qn('bucket_start')}) DO UPDATE SET {', '.join(assignments)}"
+        )
+    return _upsert_sql_cache[key]
+
+
+def _upsert_buckets(model, buckets):
+    """Add partial buckets ({bucket_start: stats}) to the stored rows"""
+    bucket_field = model._meta.get_field('bucket_start')
+    params = [
+        [bucket_field.get_db_prep_value(bucket_start, connection)] + [bucket[f] for f in BUCKET_FIELDS]
+        for bucket_start, bucket in buckets.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(_upsert_sql(model), params)
+
+
+def apply_readings(readings):
+    """Fold newly stored SensorData instances into the minute, hour and day rollups"""
+    if not readings:
+        return
+    with transaction.atomic():
+        for model, step, _ in RESOLUTIONS:
+            buckets = {}
+            for reading in readings:
+                bucket_start = floor_to(reading.timestamp, step)
+                if bucket_start not in buckets:
+                    buckets[bucket_start] = _empty_bucket()
+                _accumulate(buckets[bucket_start], reading)
+            _upsert_buckets(model, buckets)
+
+
+def _raw_aggregates():
+    """Bucket statistics of raw SensorData rows"""
+    aggregates = {'count': Count('id')}
+    for metric in METRICS:
+        aggregates[f'{metric}_sum'] = Sum(metric)
+        aggregates[f'{metric}_sumsq'] = Sum(F(metric) * F(metric))
+        aggregates[f'{metric}_min'] = Min(metric)
+        aggregates[f'{metric}_max'] = Max(metric)
+    return aggregates
+
+
+def _rollup_aggregates():
+    """Bucket statistics of finer rollup rows"""
+    aggregates = {'count': Sum('count')}
+    for metric in METRICS:
+        aggregates[f'{metric}_sum'] = Sum(f'{metric}_sum')
+        aggregates[f'{metric}_sumsq'] = Sum(f'{metric}_sumsq')
+        aggregates[f'{metric}_min'] = Min(f'{metric}_min')
+        aggregates[f'{metric}_max'] = Max(f'{metric}_max')
+    return aggregates
+
+
+# Buckets per OR-ed range filter (SQLite limits expression depth)
+REFRESH_CHUNK = 200
+
+
+def refresh_rollups(timestamps):
+    """
+    Recompute the minute, hour and day buckets containing `timestamps`.
+
+    Used when readings are changed or deleted, which apply_readings() cannot
+    subtract (min/max are not reversible). Minutes are recomputed from raw
+    rows, hours from those minutes and days from those hours, so the cost
+    per bucket stays small at every resolution.
+    """
+    timestamps = {ts for ts in timestamps if ts is not None}
+    if not timestamps:
+        return
+    source, source_field, aggregates = SensorData, 'timestamp', _raw_aggregates()
+    with transaction.atomic():
+        # Finest first: each resolution is computed from the one refreshed before it
+        for model, step, trunc in reversed(RESOLUTIONS):
+            starts = sorted({floor_to(ts, step) for ts in timestamps})
+            model.objects.filter(bucket_start__in=starts).delete()
+            for i in range(0, len(starts), REFRESH_CHUNK):
+                in_buckets = Q()
+                for bucket_start in starts[i:i + REFRESH_CHUNK]:
+                    in_buckets |= Q(**{f'{source_field}__gte': bucket_start,
+                                       f'{source_field}__lt': bucket_start + step})
+                rows = (
+                    source.objects.filter(in_buckets)
+                    .annotate(bucket=trunc(source_field, tzinfo=UTC))
+                    .values('bucket')
+                    .annotate(**aggregates)
+                    .order_by()
+                )
+                model.objects.bulk_create([model(bucket_start=row.pop('bucket'), **row) for row in rows])
+            source, source_field, aggregates = model, 'bucket_start', _rollup_aggregates()
+
+
+def rebuild_rollups(sensor_model=SensorData, rollup_models=None, batch_size=1000):
+    """
+    Recompute every rollup table from raw rows with grouped queries.
+
+    The models are parameters so the data migration can pass historical models.
+    Returns a dict mapping rollup model name to the number of buckets written.
+    """
+    if rollup_models is None:
+        rollup_models = [model for model, _, _ in RESOLUTIONS]
+    truncs = {model.__name__: trunc for model, _, trunc in RESOLUTIONS}
+    aggregates = _raw_aggregates()
+
+    written = {}
+    with transaction.atomic():
+        for model in rollup_models:
+            trunc = truncs[model.__name__]
+            model.objects.all().delete()
+            rows = (
+                sensor_model.objects
+                .annotate(bucket=trunc('timestamp', tzinfo=UTC))
+                .values('bucket')
+                .annotate(**aggregates)
+                .order_by('bucket')
+            )
+            batch = []
+            total = 0
+            for row in rows.iterator():
+                bucket_start = row.pop('bucket')
+                batch.append(model(bucket_start=bucket_start, **row))
+                if len(batch) >= batch_size:
+                    model.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_create(batch)
+                total += len(batch)
+            written[model.__name__] = total
+    return written
+
+
+# --- Range queries ---
+
+def plan_range(start, end, level=0):
+    """
+    Split the half-open range [start, end) into segments.
+
+    Returns a list of (model, lo, hi) tuples in time order, where model is a
+    rollup model covering whole buckets in [lo, hi), or None for raw rows.
+    """
+    if start >= end:
+        return []
+    if level >= len(RESOLUTIONS):
+        return [(None, start, end)]
+    model, step, _ = RESOLUTIONS[level]
+    aligned_start = ceil_to(start, step)
+    aligned_end = floor_to(end, step)
+    if aligned_start >= aligned_end:
+        return plan_range(start, end, level + 1)
+    return (
+        plan_range(start, aligned_start, level + 1)
+        + [(model, aligned_start, aligned_end)]
+        + plan_range(aligned_end, end, level + 1)
+    )
+
+
+def _segments_by_source(segments):
+    grouped = {}
+    for model, lo, hi in segments:
+        grouped.setdefault(model, []).append((lo, hi))
+    return grouped
+
+
+def _range_filter(field, ranges):
+    condition = Q()
+    for lo, hi in ranges:
+        condition |= Q(**{f'{field}__gte': lo, f'{field}__lt': hi})
+    return condition
+
+
+def aggregate_range(start, end, metrics=METRICS):
+    """
+    Count/avg/min/max/sum/sum-of-squares/stddev for readings with start <= timestamp <= end.
+
+    Issues at most one query per rollup resolution plus one for the raw edges,
+    regardless of the length of the window. Keys follow the `<stat>_<metric>`
+    naming used by the views, e.g. avg_co2, max_temperature; averages, extrema
+    and deviations are None when the range holds no readings.
+    """
+    segments = plan_range(start, end + RESOLUTION_EPSILON)
+    totals = {'count': 0}
+    for metric in metrics:
+        totals[f'sum_{metric}'] = 0.0
+        totals[f'sumsq_{metric}'] = 0.0
+        totals[f'min_{metric}'] = None
+        totals[f'max_{metric}'] = None
+
+    for model, ranges in _segments_by_source(segments).items():
+        if model is None:
+            aggregates = {'count': Count('id')}
+            for metric in metrics:
+                aggregates[f'sum_{metric}'] = Sum(metric)
+                aggregates[f'sumsq_{metric}'] = Sum(F(metric) * F(metric))
+                aggregates[f'min_{metric}'] = Min(metric)
+                aggregates[f'max_{metric}'] = Max(metric)
+            part = SensorData.objects.filter(_range_filter('timestamp', ranges)).aggregate(**aggregates)
+        else:
+            aggregates = {'count': Sum('count')}
+            for metric in metrics:
+                aggregates[f'sum_{metric}'] = Sum(f'{metric}_sum')
+                aggregates[f'sumsq_{metric}'] = Sum(f'{metric}_sumsq')
+                aggregates[f'min_{metric}'] = Min(f'{metric}_min')
+                aggregates[f'max_{metric}'] = Max(f'{metric}_max')
+            part = model.objects.filter(_range_filter('bucket_start', ranges)).aggregate(**aggregates)
+
+        if not part['count']:
+            continue
+        totals['count'] += part['count']
+        for metric in metrics:
+            totals[f'sum_{metric}'] += part[f'sum_{metric}']
+            totals[f'sumsq_{metric}'] += part[f'sumsq_{metric}']
+            for key, pick in ((f'min_{metric}', min), (f'max_{metric}', max)):
+                totals[key] = part[key] if totals[key] is None else pick(totals[key], part[key])
+
+    count = totals['count']
+    for metric in metrics:
+        if count:
+            mean = totals[f'sum_{metric}'] / count
+            variance = max(totals[f'sumsq_{metric}'] / count - mean * mean, 0.0)
+            totals[f'avg_{metric}'] = mean
+            totals[f'stddev_{metric}'] = math.sqrt(variance)
+        else:
+            totals[f'avg_{metric}'] = None
+            totals[f'stddev_{metric}'] = None
+    return totals
+
+
+def find_extreme_reading(metric, start, end, extreme='min', value=None):
+    """
+    The earliest reading holding the min (or max) of `metric` in [start, end].
+
+    The extreme value comes from aggregate_range unless the caller already has
+    it; the row is then located by drilling down from the earliest matching day
+    bucket to hour, minute and finally raw rows, so usually only one bucket per
+    resolution is inspected. Later matching buckets are tried if it misses.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}'")
+    if value is None:
+        value = aggregate_range(start, end, metrics=[metric])[f'{extreme}_{metric}']
+    if value is None:
+        return None
+    return _locate(metric, f'{metric}_{extreme}', value, start, end + RESOLUTION_EPSILON, 0)
+
+
+def _locate(metric, rollup_field, value, start, end, level):
+    for model, lo, hi in plan_range(start, end, level):
+        if model is None:
+            reading = (SensorData.objects
+                       .filter(timestamp__gte=lo, timestamp__lt=hi, **{metric: value})
+                       .order_by('timestamp').first())
+            if reading:
+                return reading
+            continue
+        candidates = (model.objects
+                      .filter(bucket_start__gte=lo, bucket_start__lt=hi, **{rollup_field: value})
+                      .order_by('bucket_start').values_list('bucket_start', flat=True))
+        step = next(s for m, s, _ in RESOLUTIONS if m is model)
+        next_level = next(i for i, (m, _, _) in enumerate(RESOLUTIONS) if m is model) + 1
+        # The earliest bucket nearly always holds the row; a stale one falls through to the next
+        for bucket_start in candidates:
+            reading = _locate(metric, rollup_field, value, bucket_start, bucket_start + step, next_level)
+            if reading:
+                return reading
+    return None
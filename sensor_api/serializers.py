@@ -1,8 +1,65 @@
-from rest_framework import serializers
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import SensorData
 
 class SensorDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = SensorData
         fields = ['co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0', 'timestamp']
-        read_only_fields = ['timestamp'] 
\ No newline at end of file
+        read_only_fields = ['timestamp']
+
+class SensorDataBatchItemSerializer(SensorDataSerializer):
+    """A single reading inside a batch upload.
+
+    Gateways that buffer readings while offline send the time each reading was
+    taken, so the timestamp is writable here and defaults to the ingest time.
+    """
+    class Meta(SensorDataSerializer.Meta):
+        read_only_fields = []
+        extra_kwargs = {'timestamp': {'required': False}}
+
+
+class SerializedRows(list):
+    """
+    Readings already in their serialized form (a list of dicts).
+
+    Returned by the fast read path; SensorJSONRenderer recognises it and may
+    encode it with orjson.
+    """
+
+
+def format_timestamps(values):
+    """
+    Format datetimes exactly as serializers.DateTimeField would, for a whole column.
+
+    With the default ISO 8601 output the conversion to the current timezone and
+    the isoformat call are done in one pass, without going through the field
+    for every value.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    if not settings.USE_TZ or output_format is None or output_format.lower() != ISO_8601:
+        field = serializers.DateTimeField()
+        return [field.to_representation(value) for value in values]
+    tz = timezone.get_current_timezone()
+    formatted = [value.astimezone(tz).isoformat() for value in values]
+    return [text[:-6] + 'Z' if text.endswith('+00:00') else text for text in formatted]
+
+
+def serialize_rows(queryset, fields=SensorDataSerializer.Meta.fields, local_time=True):
+    """
+    Serialize SensorData rows without instantiating models or serializer fields.
+
+    Rows are fetched with values_list and turned into dicts keyed by fields, in
+    that order. With local_time (the default) the output is identical to
+    SensorDataSerializer(queryset, many=True).data; otherwise timestamps are
+    the isoformat() of the stored (UTC) value.
+    """
+    rows = list(queryset.values_list(*fields))
+    if 'timestamp' in fields and rows:
+        position = fields.index('timestamp')
+        column = [row[position] for row in rows]
+        timestamps = format_timestamps(column) if local_time else [value.isoformat() for value in column]
+        rows = [row[:position] + (timestamp,) + row[position + 1:] for row, timestamp in zip(rows, timestamps)]
+    return SerializedRows(dict(zip(fields, row)) for row in rows)
@@ -0,0 +1,81 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from .models import SensorData
+
+# Sent once per write with `readings`, the list of SensorData instances that were stored.
+# bulk_create() does not send post_save, so ingest code sends this for batches and the
+# post_save handler below forwards single saves; receivers see every new reading once.
+sensor_data_ingested = Signal()
+
+
+@receiver(post_save, sender=SensorData)
+def forward_single_save(sender, instance, created, raw=False, **kwargs):
+    """Treat a newly created SensorData row (API, admin, shell) as an ingest of one reading"""
+    if created and not raw:
+        sensor_data_ingested.send(sender=SensorData, readings=[instance])
+
+
+@receiver(sensor_data_ingested)
+def update_rollups(sender, readings, **kwargs):
+    """Keep the minute/hour/day rollups in step with raw data"""
+    from .rollups import apply_readings
+    apply_readings(readings)
+
+
+@receiver(pre_save, sender=SensorData)
+def remember_stored_timestamp(sender, instance, raw=False, **kwargs):
+    """Keep the stored timestamp of an updated row: its old buckets change too"""
+    if instance.pk is not None and not raw:
+        instance._stored_timestamp = (
+            SensorData.objects.filter(pk=instance.pk).values_list('timestamp', flat=True).first())
+
+
+@receiver(post_save, sender=SensorData)
+def refresh_rollups_on_update(sender, instance, created, raw=False, **kwargs):
+    """Recompute the buckets of an edited reading, at its old and new timestamp"""
+    if not created and not raw:
+        from .rollups import refresh_rollups
+        refresh_rollups([instance.timestamp, getattr(instance, '_stored_timestamp', None)])
+
+
+@receiver(post_delete, sender=SensorData)
+def refresh_rollups_on_delete(sender, instance, **kwargs):
+    """Recompute the buckets a deleted reading was counted in"""
+    from .rollups import refresh_rollups
+    refresh_rollups([instance.timestamp])
+
+
+@receiver(post_save, sender=SensorData)
+@receiver(post_delete, sender=SensorData)
+def bump_generation_on_change(sender, created=False, raw=False, **kwargs):
+    """Edits and deletes leave the newest id alone; move validators and caches to a new generation"""
+    if not created and not raw:
+        from .conditional import bump_data_generation
+        bump_data_generation()
+
+
+@receiver(sensor_data_ingested)
+def publish_live_readings(sender, readings, **kwargs):
+    """Push new readings to live stream clients once they are committed"""
+    from .live import get_reading_broker
+    broker = get_reading_broker()
+    transaction.on_commit(lambda: broker.publish(readings))
+
+
+@receiver(sensor_data_ingested)
+def update_sensor_snapshot(sender, readings, **kwargs):
+    """Fold new readings into the in-memory current state once they are committed"""
+    from .snapshot import get_sensor_snapshot
+    snapshot = get_sensor_snapshot()
+    transaction.on_commit(lambda: snapshot.apply(readings))
+
+
+@receiver(post_save, sender=SensorData)
+@receiver(post_delete, sender=SensorData)
+def reseed_sensor_snapshot(sender, created=False, raw=False, **kwargs):
+    """Seed the snapshot again from the refreshed rollups once a change or delete is committed"""
+    from . import snapshot
+    if snapshot._snapshot is not None and not created and not raw:
+        transaction.on_commit(snapshot._snapshot.invalidate)
@@ -0,0 +1,145 @@
+"""
+In-memory current state of the sensors
+
+The chatbot, the analysis page and the MCP server all ask for the latest
+reading, and the chatbot also for the average of every metric over all
+readings. SensorSnapshot keeps both: the latest reading, a running count and
+sum per metric, and the AQI of the latest reading.
+
+It is seeded once per process from the day rollups (a few hundred rows
+instead of the whole table) and kept current in two ways. Batches ingested in
+this process are folded in after they commit. Before each read, a primary key
+range query from the newest known id fetches that row back plus anything
+stored since, so readings written by other processes (the MCP server, other
+workers) are folded in as well. If the newest known row is gone or changed
+(deleted, rolled back), or too many new rows piled up, the snapshot is seeded
+again. So is it after a reading is changed or deleted in this process, once the
+rollups it is seeded from have been recomputed (see signals.py).
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Max, Sum
+
+from .aqi import calculate_aqi_from_pm
+from .models import METRICS, SensorData, SensorRollupDay
+
+# More new rows than this since the last read are cheaper to take from the rollups
+CATCH_UP_LIMIT = 1000
+
+
+class SensorState:
+    """Latest reading, count and per-metric sums of all readings, and the current AQI"""
+
+    def __init__(self, latest, count, sums, aqi):
+        self.latest = latest
+        self.count = count
+        self.sums = sums
+        self.aqi = aqi
+
+    def average(self, metric):
+        """Average of `metric` over all readings, or None without readings"""
+        return self.sums[metric] / self.count if self.count else None
+
+
+def same_row(a, b):
+    return a.pk == b.pk and a.timestamp == b.timestamp and all(getattr(a, m) == getattr(b, m) for m in METRICS)
+
+
+class SensorSnapshot:
+    """Running state of all stored readings, kept in memory"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seeded = False
+        self._reset()
+
+    def _reset(self):
+        self.latest = None     # Newest by timestamp
+        self.last_row = None   # Newest by id: where catching up continues
+        self.count = 0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.aqi = None
+
+    def invalidate(self):
+        """Seed again on the next read"""
+        with self._lock:
+            self._seeded = False
+
+    def current(self):
+        """The SensorState including every reading stored so far"""
+        with self._lock:
+            if not self._seeded or not self._catch_up():
+                self._seed()
+            return SensorState(self.latest, self.count, dict(self.sums), self.aqi)
+
+    def apply(self, readings):
+        """Fold in readings ingested by this process, if they directly follow the newest known row"""
+        with self._lock:
+            if not self._seeded or not readings:
+                return
+            ids = [reading.pk for reading in readings]
+            expected = (self.last_row.pk if self.last_row is not None else 0) + 1
+            if None in ids or ids != list(range(expected, expected + len(ids))):
+                # Left to the catch-up query of the next read
+                return
+            self._fold(readings)
+
+    def _seed(self):
+        self._reset()
+        # One transaction, so the rollup totals and the newest id agree (SQLite reads a snapshot)
+        with transaction.atomic():
+            last_id = SensorData.objects.aggregate(last=Max('id'))['last']
+            if last_id is not None:
+                totals = SensorRollupDay.objects.aggregate(
+                    count=Sum('count'), **{metric: Sum(f'{metric}_sum') for metric in METRICS})
+                self.count = totals['count'] or 0
+                self.sums = {metric: totals[metric] or 0.0 for metric in METRICS}
+                self.last_row = SensorData.objects.get(pk=last_id)
+                self._set_latest(SensorData.objects.order_by('-timestamp').first())
+        self._seeded = True
+
+    def _catch_up(self):
+        """Fold in rows stored since the last read; False when the snapshot must be seeded again"""
+        last_id = self.last_row.pk if self.last_row is not None else 0
+        rows = list(SensorData.objects.filter(id__gte=last_id).order_by('id')[:CATCH_UP_LIMIT + 1])
+        if self.last_row is not None:
+            if not rows or not same_row(rows[0], self.last_row):
+                return False
+            rows = rows[1:]
+        if len(rows) > CATCH_UP_LIMIT:
+            return False
+        self._fold(rows)
+        return True
+
+    def _fold(self, readings):
+        for reading in readings:
+            self.count += 1
+            for metric in METRICS:
+                self.sums[metric] += getattr(reading, metric)
+            if self.latest is None or reading.timestamp >= self.latest.timestamp:
+                self._set_latest(reading)
+        if readings:
+            self.last_row = max(readings, key=lambda reading: reading.pk)
+
+    def _set_latest(self, reading):
+        self.latest = reading
+        self.aqi = calculate_aqi_from_pm(reading.pm2_5, reading.pm10_0) if reading is not None else None
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_sensor_snapshot():
+    """Return the process-wide SensorSnapshot"""
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = SensorSnapshot()
+    return _snapshot
+
+
+def current_sensor_state():
+    return get_sensor_snapshot().current()
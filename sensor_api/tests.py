@@ -1,13 +1,40 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Max, Min
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from rest_framework.test import APITestCase, APIClient
+from django.utils.http import parse_http_date
 from rest_framework import status
-from datetime import timedelta, datetime
-from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+
+from .aqi import calculate_aqi_from_pm
+from .downsample import lttb_indices
+from .export import EXPORT_FIELDS, pq
+from .ingest import ACK_AFTER_FLUSH, ACK_ON_ENQUEUE, IngestBuffer, save_readings
+from .jobs import ExportJobRunner, run_export_job
+from .live import ReadingBroker, reading_stream
+from .models import SensorData, SensorRollupDay, SensorRollupHour, SensorRollupMinute
+from .renderers import SensorJSONRenderer
+from .rollups import aggregate_range, find_extreme_reading, plan_range
+from .serializers import SensorDataSerializer, serialize_rows
+from .snapshot import SensorSnapshot
 
-from .models import SensorData
-from .serializers import SensorDataSerializer
 
 class SensorDataModelTests(TestCase):
     """Test the functionality of the SensorData model"""
@@ -218,3 +245,1116 @@ class SensorDataListAPIViewTests(APITestCase):
         response = self.client.get(f"{self.url}?hours=invalid")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
+
+    def test_since_cursor_returns_only_new_rows(self):
+        """Test polling with the id cursor from X-Next-Cursor"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f"{self.url}?hours=48")
+        cursor = response['X-Next-Cursor']
+        self.assertEqual(int(cursor), SensorData.objects.latest('id').id)
+        
+        # Nothing new yet
+        response = self.client.get(f"{self.url}?hours=48&since={cursor}")
+        self.assertEqual(response.data, [])
+        self.assertEqual(response['X-Next-Cursor'], cursor)
+        
+        new = SensorData.objects.create(co2=550.0, humidity=61.0, temperature=24.5,
+                                        pm1_0=9.0, pm2_5=15.0, pm10_0=30.0)
+        response = self.client.get(f"{self.url}?hours=48&since={cursor}")
+        self.assertEqual([row['co2'] for row in response.data], [550.0])
+        self.assertEqual(response['X-Next-Cursor'], str(new.id))
+    
+    def test_since_cursor_respects_time_window(self):
+        """Rows stored after the cursor but outside the window are not returned"""
+        self.client.force_authenticate(user=self.user)
+        cursor = self.client.get(self.url)['X-Next-Cursor']
+        SensorData.objects.create(co2=550.0, humidity=61.0, temperature=24.5, pm1_0=9.0, pm2_5=15.0,
+                                  pm10_0=30.0, timestamp=timezone.now() - timedelta(hours=40))
+        response = self.client.get(f"{self.url}?since={cursor}")
+        self.assertEqual(response.data, [])
+    
+    def test_since_timestamp(self):
+        """Test the ISO 8601 timestamp form of the cursor"""
+        self.client.force_authenticate(user=self.user)
+        since = (timezone.now() - timedelta(hours=20)).isoformat()
+        response = self.client.get(self.url, {'hours': 48, 'since': since})
+        self.assertEqual(len(response.data), 2)
+        
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SensorDataBatchCreateAPIViewTests(APITestCase):
+    """Test batch uploads on /api/sensor/ and /api/sensor/batch/"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.url = reverse('sensor-batch-create')
+        self.readings = [
+            {'co2': 400.0 + i, 'humidity': 50.0, 'temperature': 22.0,
+             'pm1_0': 5.0, 'pm2_5': 10.0, 'pm10_0': 20.0}
+            for i in range(5)
+        ]
+
+    def test_create_batch(self):
+        """Test that a valid batch is stored in full"""
+        response = self.client.post(self.url, self.readings, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual(SensorData.objects.count(), 5)
+
+    def test_create_batch_on_single_endpoint(self):
+        """Test that posting a list to the single-reading endpoint uses the batch path"""
+        response = self.client.post(reverse('sensor-create'), self.readings, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(SensorData.objects.count(), 5)
+
+    def test_batch_keeps_reading_timestamps(self):
+        """Test that buffered readings keep the time they were taken"""
+        taken_at = timezone.now() - timedelta(hours=3)
+        reading = dict(self.readings[0], timestamp=taken_at.isoformat())
+        response = self.client.post(self.url, [reading], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(SensorData.objects.get().timestamp, taken_at)
+
+    def test_invalid_batch_reports_per_item_errors(self):
+        """Test that an invalid batch is rejected with errors aligned to the items"""
+        self.readings[2]['co2'] = 'invalid'
+        del self.readings[4]['humidity']
+        response = self.client.post(self.url, self.readings, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data['errors']
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(errors[0], {})
+        self.assertIn('co2', errors[2])
+        self.assertIn('humidity', errors[4])
+        self.assertEqual(SensorData.objects.count(), 0)
+
+    def test_batch_size_limit(self):
+        """Test that oversized batches are rejected"""
+        with self.settings(SENSOR_BATCH_MAX_SIZE=3):
+            response = self.client.post(self.url, self.readings, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(SensorData.objects.count(), 0)
+
+
+class IngestBufferTests(TestCase):
+    """Test the write-behind ingest buffer"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.reading = {'co2': 450.0, 'humidity': 55.5, 'temperature': 25.3,
+                        'pm1_0': 10.2, 'pm2_5': 15.6, 'pm10_0': 30.1}
+
+    def test_flush_group_commits_queued_readings(self):
+        """Test that readings from several submits are written by one flush"""
+        buffer = IngestBuffer(autostart=False)
+        first = buffer.submit([self.reading])
+        second = buffer.submit([self.reading, self.reading])
+        self.assertEqual(buffer.stats()['queue_depth'], 2)
+        self.assertEqual(SensorData.objects.count(), 0)
+
+        buffer.flush()
+
+        self.assertEqual(SensorData.objects.count(), 3)
+        self.assertTrue(first.wait(0))
+        self.assertEqual(len(second.objects), 2)
+        stats = buffer.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['flushes'], 1)
+        self.assertEqual(stats['flushed_rows'], 3)
+        self.assertEqual(stats['last_batch_size'], 3)
+
+    def test_readings_are_stamped_on_enqueue(self):
+        """Test that the timestamp is the enqueue time, not the flush time"""
+        buffer = IngestBuffer(autostart=False)
+        before = timezone.now()
+        buffer.submit([self.reading])
+        buffer.flush()
+        self.assertLessEqual(SensorData.objects.get().timestamp - before, timedelta(seconds=1))
+
+    def test_ack_on_enqueue_returns_accepted(self):
+        """Test that the create endpoint answers 202 before the rows are written"""
+        buffer = IngestBuffer(durability=ACK_ON_ENQUEUE, autostart=False)
+        with mock.patch('sensor_api.views.get_ingest_buffer', return_value=buffer):
+            response = self.client.post(reverse('sensor-create'), self.reading, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(SensorData.objects.count(), 0)
+        buffer.flush()
+        self.assertEqual(SensorData.objects.count(), 1)
+
+    def test_invalid_durability_mode(self):
+        """Test that an unknown durability mode is rejected"""
+        with self.assertRaises(ValueError):
+            IngestBuffer(durability='eventually')
+
+
+class IngestBufferFlusherTests(TransactionTestCase):
+    """Test the background flusher thread (needs real commits)"""
+
+    def test_ack_after_flush_waits_for_commit(self):
+        """Test that ack-after-flush responds 201 once the group commit is done"""
+        buffer = IngestBuffer(flush_interval_ms=20, durability=ACK_AFTER_FLUSH)
+        reading = {'co2': 450.0, 'humidity': 55.5, 'temperature': 25.3,
+                   'pm1_0': 10.2, 'pm2_5': 15.6, 'pm10_0': 30.1}
+        try:
+            with mock.patch('sensor_api.views.get_ingest_buffer', return_value=buffer):
+                response = self.client.post(reverse('sensor-create'), reading, content_type='application/json')
+        finally:
+            buffer.stop()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['co2'], 450.0)
+        self.assertEqual(SensorData.objects.count(), 1)
+
+
+class TimestampIndexQueryPlanTests(TestCase):
+    """Check that the hot time-range queries are served by an index, not a table scan"""
+
+    TABLE = SensorData._meta.db_table
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        now = timezone.now()
+        for hours in (1, 30, 200):
+            SensorData.objects.create(co2=450.0, humidity=55.0, temperature=22.0,
+                                      pm1_0=7.0, pm2_5=12.0, pm10_0=25.0,
+                                      timestamp=now - timedelta(hours=hours))
+
+    def assertNoTableScan(self, captured):
+        """Run EXPLAIN QUERY PLAN on every captured read of the sensor table"""
+        statements = [q['sql'] for q in captured.captured_queries
+                      if q['sql'].lstrip().upper().startswith('SELECT') and self.TABLE in q['sql']]
+        self.assertTrue(statements, 'No sensor queries were captured')
+        full_scan = re.compile(rf'^SCAN "?{self.TABLE}"?$')
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                details = [row[-1] for row in cursor.fetchall()]
+                for detail in details:
+                    self.assertFalse(full_scan.match(detail), f'Table scan in plan {details} for: {sql}')
+
+    def test_list_api_uses_index(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('sensor-list') + '?hours=48')
+        self.assertNoTableScan(captured)
+
+    def test_export_uses_index(self):
+        self.client.force_login(self.user)
+        for format_type in ('csv', 'json'):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post(reverse('export_data'), {'format': format_type, 'time_range': '30days'})
+                b''.join(response.streaming_content)
+            self.assertNoTableScan(captured)
+
+    def test_analyze_view_uses_index(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('analyze'))
+        self.assertNoTableScan(captured)
+
+    def test_mcp_helpers_use_index(self):
+        from MCP_server import mcp_server
+
+        end = timezone.now()
+        start = end - timedelta(days=2)
+        calls = [
+            (mcp_server._get_latest_sensor_data_sync, ()),
+            (mcp_server._get_sensor_data_summary_sync, (start, end)),
+            (mcp_server._get_sensor_data_in_range_sync, (start, end)),
+            (mcp_server._get_extreme_sensor_value_sync, ('co2', start, end)),
+            (mcp_server._count_sensor_data_points_sync, (start, end)),
+            (mcp_server._get_recent_sensor_data_sync, (48,)),
+            (mcp_server._get_etag_sync, (('count', 48), timedelta(hours=48))),
+        ]
+        for helper, args in calls:
+            with CaptureQueriesContext(connection) as captured:
+                async_to_sync(helper)(*args)
+            self.assertNoTableScan(captured)
+
+
+class SensorRollupTests(TestCase):
+    """Test the minute/hour/day rollups and range aggregation on top of them"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        # Readings spread over ~3 days, not aligned to any bucket boundary
+        self.base = datetime(2025, 3, 1, 10, 17, 23, tzinfo=dt_timezone.utc)
+        self.readings = []
+        for i in range(120):
+            self.readings.append(SensorData.objects.create(
+                co2=400.0 + (i * 37) % 500,
+                humidity=40.0 + (i * 7) % 30,
+                temperature=18.0 + (i % 13),
+                pm1_0=3.0 + i % 11,
+                pm2_5=5.0 + (i * 3) % 40,
+                pm10_0=10.0 + (i * 5) % 90,
+                timestamp=self.base + timedelta(minutes=37 * i, seconds=i),
+            ))
+
+    def raw_stats(self, start, end):
+        return SensorData.objects.filter(timestamp__gte=start, timestamp__lte=end).aggregate(
+            avg_co2=Avg('co2'), min_co2=Min('co2'), max_co2=Max('co2'),
+            avg_temperature=Avg('temperature'), min_pm2_5=Min('pm2_5'), max_pm10_0=Max('pm10_0'),
+        )
+
+    def test_rollups_updated_on_create(self):
+        """Test that every ingested reading is counted at each resolution"""
+        for model in (SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            self.assertEqual(sum(model.objects.values_list('count', flat=True)), 120)
+        day = SensorRollupDay.objects.get(bucket_start=datetime(2025, 3, 1, tzinfo=dt_timezone.utc))
+        first_day = [r for r in self.readings if r.timestamp.date() == day.bucket_start.date()]
+        self.assertEqual(day.count, len(first_day))
+        self.assertEqual(day.co2_max, max(r.co2 for r in first_day))
+        self.assertAlmostEqual(day.co2_sum, sum(r.co2 for r in first_day))
+
+    def test_rollups_updated_on_batch_ingest(self):
+        """Test that bulk ingested readings are rolled up as well"""
+        save_readings([{'co2': 999.0, 'humidity': 50.0, 'temperature': 20.0, 'pm1_0': 1.0,
+                        'pm2_5': 2.0, 'pm10_0': 3.0, 'timestamp': self.base}] * 3)
+        minute = SensorRollupMinute.objects.get(bucket_start=self.base.replace(second=0))
+        self.assertEqual(minute.count, 4)
+        self.assertEqual(minute.co2_max, 999.0)
+
+    def test_aggregate_range_matches_raw(self):
+        """Test that rollup-based aggregates equal the raw aggregates over odd windows"""
+        windows = [
+            (self.base, self.base + timedelta(days=3)),
+            (self.base + timedelta(hours=5, seconds=13), self.base + timedelta(days=2, minutes=7)),
+            (self.readings[10].timestamp, self.readings[50].timestamp),
+            (self.base + timedelta(seconds=5), self.base + timedelta(seconds=50)),
+        ]
+        for start, end in windows:
+            expected = self.raw_stats(start, end)
+            stats = aggregate_range(start, end)
+            self.assertEqual(stats['count'], SensorData.objects.filter(timestamp__gte=start, timestamp__lte=end).count())
+            for key, value in expected.items():
+                if value is None:
+                    self.assertIsNone(stats[key])
+                else:
+                    self.assertAlmostEqual(stats[key], value)
+
+    def assertRangeMatchesRaw(self, start, end):
+        expected = self.raw_stats(start, end)
+        stats = aggregate_range(start, end)
+        self.assertEqual(stats['count'], SensorData.objects.filter(timestamp__gte=start, timestamp__lte=end).count())
+        for key, value in expected.items():
+            self.assertAlmostEqual(stats[key], value)
+
+    def test_rollups_refreshed_on_delete(self):
+        """Test that deleted readings, including a bucket's extreme, leave the rollups"""
+        start, end = self.base, self.base + timedelta(days=3)
+        highest = max(self.readings, key=lambda r: r.co2)
+        highest.delete()
+        SensorData.objects.filter(pk__in=[r.pk for r in self.readings[40:45]]).delete()
+        for model in (SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            self.assertEqual(sum(model.objects.values_list('count', flat=True)), 114)
+        self.assertFalse(SensorRollupMinute.objects.filter(bucket_start=highest.timestamp.replace(second=0)).exists())
+        self.assertRangeMatchesRaw(start, end)
+        self.assertRangeMatchesRaw(self.readings[30].timestamp, self.readings[60].timestamp)
+
+    def test_rollups_refreshed_on_update(self):
+        """Test that an edited reading is moved out of its old buckets into its new ones"""
+        start, end = self.base, self.base + timedelta(days=3)
+        reading = self.readings[10]
+        old_minute = reading.timestamp.replace(second=0)
+        reading.co2 = 5000.0
+        reading.timestamp = self.readings[90].timestamp + timedelta(seconds=1)
+        reading.save()
+        self.assertFalse(SensorRollupMinute.objects.filter(bucket_start=old_minute).exists())
+        self.assertEqual(SensorRollupMinute.objects.get(bucket_start=reading.timestamp.replace(second=0)).co2_max, 5000.0)
+        for model in (SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            self.assertEqual(sum(model.objects.values_list('count', flat=True)), 120)
+        self.assertRangeMatchesRaw(start, end)
+        self.assertRangeMatchesRaw(self.base, self.readings[50].timestamp)
+
+    def test_long_window_reads_rollups(self):
+        """Test that a multi-day window is planned onto day/hour/minute buckets"""
+        segments = plan_range(self.base, self.base + timedelta(days=3))
+        models = [model for model, _, _ in segments]
+        self.assertIn(SensorRollupDay, models)
+        self.assertEqual(models.count(None), 2)  # only the partial-minute edges are raw
+        raw_span = sum((hi - lo for model, lo, hi in segments if model is None), timedelta())
+        self.assertLess(raw_span, timedelta(minutes=2))
+
+    def test_find_extreme_reading(self):
+        """Test that the min/max rows are located through the rollups"""
+        start, end = self.readings[5].timestamp, self.readings[100].timestamp
+        in_range = [r for r in self.readings if start <= r.timestamp <= end]
+        expected_max = max(in_range, key=lambda r: (r.co2, -r.timestamp.timestamp()))
+        expected_min = min(in_range, key=lambda r: (r.pm2_5, r.timestamp))
+        self.assertEqual(find_extreme_reading('co2', start, end, 'max'), expected_max)
+        self.assertEqual(find_extreme_reading('pm2_5', start, end, 'min'), expected_min)
+
+    def test_find_extreme_reading_skips_a_stale_bucket(self):
+        """Test that a matching bucket without the row does not hide a later one"""
+        first_day, second_day = SensorRollupDay.objects.order_by('bucket_start')[:2]
+        value = second_day.co2_max
+        # The first day still claims the maximum, but none of its rows hold it any more
+        SensorData.objects.filter(timestamp__lt=second_day.bucket_start, co2__gte=value).update(co2=value - 1)
+        SensorRollupDay.objects.filter(pk=first_day.pk).update(co2_max=value)
+        start, end = first_day.bucket_start, self.readings[-1].timestamp
+        expected = SensorData.objects.filter(co2=value).order_by('timestamp').first()
+        self.assertEqual(find_extreme_reading('co2', start, end, 'max', value=value), expected)
+
+    def test_rebuild_command(self):
+        """Test that the management command recreates rollups from raw data"""
+        SensorRollupMinute.objects.all().delete()
+        SensorRollupDay.objects.update(count=0)
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('Rollups rebuilt', out.getvalue())
+        for model in (SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            self.assertEqual(sum(model.objects.values_list('count', flat=True)), 120)
+        stats = aggregate_range(self.base, self.base + timedelta(days=3))
+        self.assertAlmostEqual(stats['avg_co2'], self.raw_stats(self.base, self.base + timedelta(days=3))['avg_co2'])
+
+
+class DownsampleTests(APITestCase):
+    """Test the bucket and LTTB downsampling of the list API"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('sensor-list')
+        # ~10 hours of readings every 37 seconds, not aligned to any bucket boundary
+        start = timezone.now() - timedelta(hours=10)
+        save_readings([{
+            'co2': 400.0 + (i * 37) % 500,
+            'humidity': 40.0 + (i * 7) % 30,
+            'temperature': 18.0 + (i % 13),
+            'pm1_0': 3.0 + i % 11,
+            'pm2_5': 5.0 + (i * 3) % 40,
+            'pm10_0': 10.0 + (i * 5) % 90,
+            'timestamp': start + timedelta(seconds=37 * i),
+        } for i in range(950)])
+
+    def expected_buckets(self, width):
+        buckets = {}
+        for reading in SensorData.objects.order_by('timestamp'):
+            buckets.setdefault(int(reading.timestamp.timestamp()) // width, []).append(reading)
+        return buckets
+
+    def assertBucketsMatchRaw(self, response, width):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Bucket-Seconds'], str(width))
+        expected = self.expected_buckets(width)
+        self.assertEqual(len(response.data), len(expected))
+        for point, (index, readings) in zip(response.data, sorted(expected.items())):
+            self.assertEqual(datetime.fromisoformat(point['timestamp']).timestamp(), index * width)
+            self.assertEqual(point['count'], len(readings))
+            for metric in ('co2', 'pm2_5', 'temperature'):
+                values = [getattr(r, metric) for r in readings]
+                self.assertAlmostEqual(point[metric], sum(values) / len(values))
+                self.assertEqual(point[f'{metric}_min'], min(values))
+                self.assertEqual(point[f'{metric}_max'], max(values))
+
+    def test_bucket_matches_raw(self):
+        """Test avg/min/max per bucket for widths read from rollups and from raw rows"""
+        for width in (45, 600, 7200):
+            with self.subTest(width=width):
+                response = self.client.get(self.url, {'hours': 12, 'bucket': width})
+                self.assertBucketsMatchRaw(response, width)
+                self.assertEqual(response['X-Downsample'], 'bucket')
+
+    def test_bucket_after_since_cursor(self):
+        """Test that an incremental request only aggregates the new rows"""
+        cursor = self.client.get(self.url, {'hours': 12, 'bucket': 600})['X-Next-Cursor']
+        SensorData.objects.create(co2=999.0, humidity=50.0, temperature=20.0, pm1_0=1.0, pm2_5=2.0, pm10_0=3.0)
+        response = self.client.get(self.url, {'hours': 12, 'bucket': 600, 'since': cursor})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['count'], 1)
+        self.assertEqual(response.data[0]['co2'], 999.0)
+
+    def test_max_points_picks_bucket_width(self):
+        """Test that max_points selects the smallest clock-aligned width that fits"""
+        response = self.client.get(self.url, {'hours': 12, 'max_points': 100})
+        self.assertEqual(response['X-Bucket-Seconds'], '600')
+        self.assertLessEqual(len(response.data), 100)
+        self.assertBucketsMatchRaw(response, 600)
+
+    def test_lttb(self):
+        """Test that LTTB returns raw readings, keeping the first and last"""
+        response = self.client.get(self.url, {'hours': 12, 'max_points': 50, 'method': 'lttb', 'metric': 'pm2_5'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Downsample'], 'lttb')
+        self.assertEqual(len(response.data), 50)
+        raw = SensorDataSerializer(SensorData.objects.order_by('timestamp'), many=True).data
+        self.assertEqual(response.data[0], raw[0])
+        self.assertEqual(response.data[-1], raw[-1])
+        for point in response.data:
+            self.assertIn(point, raw)
+
+    def test_lttb_keeps_spikes(self):
+        """Test that an isolated peak survives downsampling"""
+        y = np.zeros(1000)
+        y[437] = 100.0
+        indices = lttb_indices(np.arange(1000), y, 20)
+        self.assertEqual(len(indices), 20)
+        self.assertIn(437, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_invalid_parameters(self):
+        """Test that malformed downsampling parameters are rejected"""
+        for params in ({'bucket': 0}, {'bucket': 'abc'}, {'max_points': 1}, {'max_points': 10 ** 6},
+                       {'max_points': 10, 'method': 'median'}, {'max_points': 10, 'method': 'lttb', 'metric': 'id'},
+                       {'bucket': 60, 'method': 'lttb'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastSerializerTests(APITestCase):
+    """Test that the values_list read path matches SensorDataSerializer byte for byte"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('sensor-list')
+        now = timezone.now().replace(microsecond=0)
+        save_readings([{
+            'co2': 400.0 + i * 0.1, 'humidity': 55.5, 'temperature': -3.25 + i, 'pm1_0': 0.0,
+            'pm2_5': 12.0, 'pm10_0': 1 / 3,
+            # Whole seconds and microsecond timestamps are formatted differently
+            'timestamp': now - timedelta(minutes=i, microseconds=i * 1234),
+        } for i in range(50)])
+
+    def expected_content(self, queryset):
+        return JSONRenderer().render(SensorDataSerializer(queryset, many=True).data)
+
+    def test_list_matches_model_serializer(self):
+        """Test that the list endpoint returns the same bytes as the ModelSerializer path"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, self.expected_content(SensorData.objects.order_by('timestamp')))
+        self.assertEqual(len(response.data), 50)
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_utc_timestamps(self):
+        """Test the 'Z' suffix DRF uses for UTC timestamps"""
+        rows = serialize_rows(SensorData.objects.order_by('timestamp'))
+        self.assertTrue(rows[0]['timestamp'].endswith('Z'))
+        self.assertEqual(SensorJSONRenderer().render(rows),
+                         self.expected_content(SensorData.objects.order_by('timestamp')))
+
+    def test_floats_orjson_spells_differently(self):
+        """Test values whose orjson spelling differs from json.dumps"""
+        SensorData.objects.update(co2=1e16, pm1_0=1e-05, pm2_5=-2.5e-07)
+        queryset = SensorData.objects.order_by('timestamp')
+        self.assertEqual(SensorJSONRenderer().render(serialize_rows(queryset)), self.expected_content(queryset))
+
+    def test_stdlib_fallback(self):
+        """Test the encoder used when orjson is not installed"""
+        queryset = SensorData.objects.order_by('timestamp')
+        with mock.patch('sensor_api.renderers.orjson', None):
+            self.assertEqual(SensorJSONRenderer().render(serialize_rows(queryset)), self.expected_content(queryset))
+
+    def test_indented_json_uses_drf_renderer(self):
+        """Test that an indent requested through the Accept header is honoured"""
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual(json.loads(response.content), json.loads(self.expected_content(
+            SensorData.objects.order_by('timestamp'))))
+        self.assertIn(b'\n    ', response.content)
+
+    def test_mcp_range_rows_unchanged(self):
+        """Test that the MCP range helpers return the same points as before"""
+        from MCP_server import mcp_server
+        start, end = timezone.now() - timedelta(hours=2), timezone.now()
+        expected = list(SensorData.objects.filter(timestamp__gte=start, timestamp__lte=end).order_by('timestamp')
+                        .values(*mcp_server.RANGE_FIELDS))
+        for point in expected:
+            point['timestamp'] = point['timestamp'].isoformat()
+        data = async_to_sync(mcp_server._get_sensor_data_in_range_sync)(start, end)
+        self.assertEqual(json.dumps(data), json.dumps(expected))
+
+
+class ColumnarFormatTests(APITestCase):
+    """Test the columnar JSON and binary formats of the list API"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('sensor-list')
+        now = timezone.now()
+        save_readings([{
+            'co2': 400.0 + i * 0.1, 'humidity': 55.3, 'temperature': 21.0 + i / 7, 'pm1_0': 1.0,
+            'pm2_5': 12.5, 'pm10_0': 20.0 + i, 'timestamp': now - timedelta(minutes=i, microseconds=i * 999),
+        } for i in range(30)])
+        self.rows = self.client.get(self.url).data
+
+    def test_columnar_json(self):
+        """Test that columns hold the row format's values in the same order"""
+        response = self.client.get(self.url, {'format': 'columnar'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(list(data), ['timestamps', 'co2', 'humidity', 'temperature', 'pm1_0', 'pm2_5', 'pm10_0'])
+        self.assertEqual(data['timestamps'], [row['timestamp'] for row in self.rows])
+        self.assertEqual(data['temperature'], [row['temperature'] for row in self.rows])
+        self.assertEqual(response['X-Row-Count'], '30')
+        self.assertIn('X-Next-Cursor', response)
+
+    def test_columnar_epoch_ms(self):
+        """Test integer millisecond timestamps"""
+        response = self.client.get(self.url, {'format': 'columnar', 'timestamps': 'epoch_ms'})
+        data = json.loads(response.content)
+        expected = [int(datetime.fromisoformat(row['timestamp']).timestamp() * 1000) for row in self.rows]
+        self.assertEqual(data['timestamps'], expected)
+        response = self.client.get(self.url, {'format': 'columnar', 'timestamps': 'unix'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_binary(self):
+        """Test the little-endian float64 timestamp + float32 column layout"""
+        for params, headers in (({'format': 'binary'}, {}), ({}, {'HTTP_ACCEPT': 'application/octet-stream'})):
+            response = self.client.get(self.url, params, **headers)
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
+            columns = response['X-Columns'].split(',')
+            count = int(response['X-Row-Count'])
+            self.assertEqual(count, 30)
+            self.assertEqual(len(response.content), count * 8 + count * 4 * (len(columns) - 1))
+            timestamps = np.frombuffer(response.content, dtype='<f8', count=count)
+            self.assertEqual(timestamps[0], int(datetime.fromisoformat(self.rows[0]['timestamp']).timestamp() * 1000))
+            for i, name in enumerate(columns[1:]):
+                values = np.frombuffer(response.content, dtype='<f4', count=count, offset=count * (8 + 4 * i))
+                np.testing.assert_array_equal(values, np.array([row[name] for row in self.rows], dtype=np.float32))
+
+    def test_binary_downsampled(self):
+        """Test that bucket series include their count/min/max columns"""
+        response = self.client.get(self.url, {'format': 'binary', 'bucket': 600})
+        columns = response['X-Columns'].split(',')
+        self.assertIn('count', columns)
+        self.assertIn('co2_max', columns)
+        count = int(response['X-Row-Count'])
+        counts = np.frombuffer(response.content, dtype='<f4', count=count, offset=count * (8 + 4 * (columns.index('count') - 1)))
+        self.assertEqual(counts.sum(), 30)
+
+    def test_empty_and_errors(self):
+        """Test empty columns and that errors are still JSON"""
+        response = self.client.get(self.url, {'format': 'columnar', 'since': SensorData.objects.latest('id').id})
+        self.assertEqual(json.loads(response.content)['co2'], [])
+        response = self.client.get(self.url, {'format': 'binary', 'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('since', json.loads(response.content))
+
+
+class LiveStreamTests(TestCase):
+    """Test the Server-Sent Events stream of new readings"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.url = reverse('sensor-stream')
+        self.readings = [
+            SensorData.objects.create(co2=400.0 + i, humidity=50.0, temperature=20.0, pm1_0=1.0, pm2_5=5.0, pm10_0=9.0)
+            for i in range(3)
+        ]
+        self.config = {'HEARTBEAT_S': 0.05, 'RETRY_MS': 1000, 'QUEUE_SIZE': 4, 'REPLAY_LIMIT': 10}
+
+    def collect(self, broker, cursor, steps, config=None):
+        """Read one chunk from the stream per step, running the step's action first"""
+        async def run():
+            chunks = []
+            stream = reading_stream(broker, cursor, config or self.config)
+            try:
+                for action in steps:
+                    if action:
+                        action()
+                    chunks.append(await stream.__anext__())
+            except StopAsyncIteration:
+                pass
+            finally:
+                await stream.aclose()
+            return chunks
+        return async_to_sync(run)()
+
+    def test_replay_then_live_events(self):
+        """Test resuming after a cursor, then receiving published readings"""
+        broker = ReadingBroker(queue_size=4)
+        new = SensorData.objects.create(co2=999.0, humidity=50.0, temperature=20.0, pm1_0=1.0, pm2_5=5.0, pm10_0=9.0)
+        cursor = self.readings[0].id
+        chunks = self.collect(broker, cursor, [None, None, lambda: broker.publish([new]), None])
+        self.assertEqual(chunks[0], b'retry: 1000\nid: %d\n\n' % cursor)
+        # Replay: readings after the cursor, including `new`, in the list API's row format
+        replayed = re.findall(rb'id: (\d+)\nevent: reading\ndata: (.*)\n\n', chunks[1])
+        self.assertEqual([int(i) for i, _ in replayed], [self.readings[1].id, self.readings[2].id, new.id])
+        self.assertEqual(json.loads(replayed[-1][1]), SensorDataSerializer(new).data)
+        # Publishing `new` again is not repeated: the next chunk is a heartbeat
+        self.assertEqual(chunks[2], b': ping\n\n')
+        self.assertEqual(broker.subscriber_count, 0)
+
+    def test_live_event(self):
+        """Test that a published reading reaches a client without a cursor"""
+        broker = ReadingBroker(queue_size=4)
+        new = SensorData.objects.create(co2=999.0, humidity=50.0, temperature=20.0, pm1_0=1.0, pm2_5=5.0, pm10_0=9.0)
+        SensorData.objects.filter(id=new.id).delete()  # Not in the table yet when the client connects
+        chunks = self.collect(broker, None, [None, lambda: broker.publish([new])])
+        self.assertEqual(chunks[0], b'retry: 1000\nid: %d\n\n' % self.readings[-1].id)
+        self.assertIn(b'id: %d\nevent: reading\n' % new.id, chunks[1])
+
+    def test_reset_when_backlog_is_too_long(self):
+        """Test that a client far behind is told to reload"""
+        chunks = self.collect(ReadingBroker(), 0, [None, None], {**self.config, 'REPLAY_LIMIT': 2})
+        self.assertEqual(chunks[1], b'id: %d\nevent: reset\ndata: {}\n\n' % self.readings[-1].id)
+
+    def test_slow_client_is_disconnected(self):
+        """Test that overflowing the queue ends the stream after the queued events"""
+        broker = ReadingBroker(queue_size=1)
+        flood = lambda: [broker.publish([reading]) for reading in self.readings]
+        self.readings[0].id, self.readings[1].id, self.readings[2].id = 10 ** 6, 10 ** 6 + 1, 10 ** 6 + 2
+        chunks = self.collect(broker, None, [None, flood, None, None])
+        self.assertEqual(len(chunks), 2)
+        self.assertIn(b'id: 1000000\n', chunks[1])
+
+    def test_ingest_publishes_after_commit(self):
+        """Test that the ingest path hands committed readings to the broker"""
+        with mock.patch.object(ReadingBroker, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                created = save_readings([{'co2': 410.0, 'humidity': 50.0, 'temperature': 20.0,
+                                          'pm1_0': 1.0, 'pm2_5': 5.0, 'pm10_0': 9.0}] * 2)
+        publish.assert_called_once_with(created)
+
+    def test_view(self):
+        """Test authentication, the ASGI-only guard and the response headers"""
+        self.assertEqual(self.client.get(self.url).status_code, 503)  # WSGI test client
+
+        async def run():
+            client = AsyncClient()
+            anonymous = await client.get(self.url)
+            await client.aforce_login(self.user)
+            response = await client.get(self.url, headers={'Last-Event-ID': str(self.readings[1].id)})
+            first = await response.streaming_content.__anext__()
+            await response.streaming_content.aclose()
+            return anonymous, response, first
+        anonymous, response, first = async_to_sync(run)()
+        self.assertEqual(anonymous.status_code, 403)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIn(b'id: %d\n' % self.readings[1].id, first)
+
+
+class ConditionalReadTests(APITestCase):
+    """Test ETag / Last-Modified handling of the list API"""
+
+    def setUp(self):
+        """Create test data for each test method"""
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('sensor-list')
+        now = timezone.now()
+        save_readings([{'co2': 400.0 + i, 'humidity': 50.0, 'temperature': 20.0, 'pm1_0': 1.0, 'pm2_5': 5.0,
+                        'pm10_0': 9.0, 'timestamp': now - timedelta(minutes=10 * i)} for i in range(5)])
+
+    def test_not_modified_skips_the_query(self):
+        """Test that a matching If-None-Match gets a 304 from the validator lookups only"""
+        first = self.client.get(self.url, {'hours': 1})
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+        self.assertIn('no-cache', first['Cache-Control'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'hours': 1}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+        response = self.client.get(self.url, {'hours': 1}, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_new_reading_changes_the_etag(self):
+        """Test that a new reading, or a different window or format, gets a full response"""
+        first = self.client.get(self.url, {'hours': 1})
+        for params in ({'hours': 2}, {'hours': 1, 'format': 'columnar'}, {'hours': 1, 'max_points': 10}):
+            response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        SensorData.objects.create(co2=999.0, humidity=50.0, temperature=20.0, pm1_0=1.0, pm2_5=5.0, pm10_0=9.0)
+        response = self.client.get(self.url, {'hours': 1}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 6)
+
+    def test_edited_or_replaced_reading_changes_the_etag(self):
+        """Test that edits and deletes, which keep the newest id and the row count, get a full response"""
+        first = self.client.get(self.url, {'hours': 1})
+        reading = SensorData.objects.get(co2=402.0)
+        reading.co2 = 1500.0
+        reading.save()
+        response = self.client.get(self.url, {'hours': 1}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(1500.0, [row['co2'] for row in response.data])
+
+        # A delete keeps the newest id and timestamp as well
+        second = response
+        SensorData.objects.get(co2=401.0).delete()
+        response = self.client.get(self.url, {'hours': 1}, HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(401.0, [row['co2'] for row in response.data])
+        self.assertGreaterEqual(parse_http_date(response['Last-Modified']), parse_http_date(first['Last-Modified']))
+
+    def test_reading_leaving_the_window_changes_the_etag(self):
+        """Test that the sliding window is part of the validator"""
+        first = self.client.get(self.url, {'hours': 1})
+        later = timezone.now() + timedelta(minutes=25)  # The reading from 40 minutes ago leaves
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(self.url, {'hours': 1}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 4)
+        self.assertGreater(parse_http_date(response['Last-Modified']), parse_http_date(first['Last-Modified']))
+
+    def test_unauthenticated_is_not_answered_from_the_validator(self):
+        """Test that permissions are checked before the conditional headers"""
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SensorSnapshotTests(TestCase):
+    """The latest reading and running averages are kept in memory"""
+
+    def setUp(self):
+        self.snapshot = SensorSnapshot()
+        # Installed as the process-wide snapshot, so the signal receivers keep it current
+        patcher = mock.patch('sensor_api.snapshot._snapshot', self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = timezone.now()
+        self.ingest(co2=500.0, minutes=10)
+        self.ingest(co2=700.0, minutes=5)
+
+    def ingest(self, co2, minutes=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            readings = save_readings([{'co2': co2, 'humidity': 50.0, 'temperature': 21.0, 'pm1_0': 3.0,
+                                       'pm2_5': 40.0, 'pm10_0': 20.0,
+                                       'timestamp': self.now - timedelta(minutes=minutes)}])
+        return readings[0]
+
+    def assertMatchesTable(self, state):
+        averages = SensorData.objects.aggregate(co2=Avg('co2'), humidity=Avg('humidity'))
+        self.assertAlmostEqual(state.average('co2'), averages['co2'])
+        self.assertAlmostEqual(state.average('humidity'), averages['humidity'])
+        self.assertEqual(state.count, SensorData.objects.count())
+        self.assertEqual(state.latest, SensorData.objects.order_by('-timestamp').first())
+
+    def test_seeded_from_rollups(self):
+        state = self.snapshot.current()
+        self.assertMatchesTable(state)
+        self.assertEqual(state.aqi, calculate_aqi_from_pm(40.0, 20.0))
+
+    def test_ingest_is_folded_in(self):
+        self.snapshot.current()
+        reading = self.ingest(co2=1200.0)
+        # Only the catch-up check for newer rows
+        with CaptureQueriesContext(connection) as ctx:
+            state = self.snapshot.current()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(state.latest, reading)
+        self.assertMatchesTable(state)
+
+    def test_backfilled_reading_keeps_the_latest(self):
+        self.snapshot.current()
+        self.ingest(co2=2000.0, minutes=60)
+        state = self.snapshot.current()
+        self.assertEqual(state.latest.co2, 700.0)
+        self.assertMatchesTable(state)
+
+    def test_rows_from_other_processes_are_caught_up(self):
+        self.snapshot.current()
+        # Stored without this snapshot seeing the ingest
+        save_readings([{'co2': 900.0, 'humidity': 60.0, 'temperature': 22.0, 'pm1_0': 3.0, 'pm2_5': 5.0,
+                        'pm10_0': 10.0, 'timestamp': self.now}])
+        self.assertMatchesTable(self.snapshot.current())
+
+    def test_deleted_latest_reseeds(self):
+        self.snapshot.current()
+        with self.captureOnCommitCallbacks(execute=True):
+            SensorData.objects.order_by('-timestamp').first().delete()
+        self.assertMatchesTable(self.snapshot.current())
+
+    def test_deleted_older_reading_reseeds(self):
+        self.ingest(co2=900.0)
+        self.snapshot.current()
+        with self.captureOnCommitCallbacks(execute=True):
+            SensorData.objects.get(co2=500.0).delete()
+        state = self.snapshot.current()
+        self.assertAlmostEqual(state.average('co2'), 800.0)
+        self.assertMatchesTable(state)
+
+    def test_edited_reading_reseeds(self):
+        self.snapshot.current()
+        reading = SensorData.objects.get(co2=500.0)
+        reading.co2 = 1500.0
+        with self.captureOnCommitCallbacks(execute=True):
+            reading.save()
+        state = self.snapshot.current()
+        self.assertAlmostEqual(state.average('co2'), 1100.0)
+        self.assertMatchesTable(state)
+
+    def test_empty_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SensorData.objects.all().delete()
+        state = self.snapshot.current()
+        self.assertIsNone(state.latest)
+        self.assertIsNone(state.average('co2'))
+        self.ingest(co2=800.0)
+        self.assertEqual(self.snapshot.current().latest.co2, 800.0)
+
+    def test_chatbot_reads_the_snapshot(self):
+        from chatbot.views import get_sensor_info
+        with mock.patch('chatbot.views.current_sensor_state', self.snapshot.current):
+            self.assertIn('700', get_sensor_info('what is the current co2'))
+            self.assertIn('CO2: 600.0ppm', get_sensor_info('average of all'))
+
+
+class ExportDataViewTests(TestCase):
+    """Test the streaming CSV/JSON export"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_login(self.user)
+        self.now = timezone.now().replace(microsecond=0)
+        self.readings = [
+            SensorData.objects.create(co2=400.0 + i, humidity=50.5, temperature=21.25,
+                                      pm1_0=1.0, pm2_5=2.5, pm10_0=10.0,
+                                      timestamp=self.now - timedelta(hours=i + 1))
+            for i in range(5)
+        ]
+
+    def export(self, format_type, **extra):
+        response = self.client.post(reverse('export_data'), {'format': format_type, 'time_range': '7days', **extra})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_export(self):
+        lines = self.export('csv').splitlines()
+        self.assertEqual(lines[0], 'timestamp,temperature,humidity,co2,pm1_0,pm2_5,pm10_0')
+        self.assertEqual(len(lines), 6)
+        oldest = self.readings[-1]
+        self.assertEqual(lines[1], f"{oldest.timestamp.strftime('%Y-%m-%d %H:%M:%S')},21.25,50.5,404.0,1.0,2.5,10.0")
+
+    def test_json_export_matches_full_dump(self):
+        """The incrementally written array is byte-identical to json.dumps(rows, indent=4)"""
+        content = self.export('json', sensor_types=['co2', 'pm2_5'])
+        expected = [
+            {'timestamp': r.timestamp.strftime('%Y-%m-%d %H:%M:%S'), 'co2': r.co2, 'pm2_5': r.pm2_5}
+            for r in reversed(self.readings)
+        ]
+        self.assertEqual(content, json.dumps(expected, indent=4))
+
+    def test_json_export_chunk_boundaries(self):
+        from .export import export_queryset, stream_json
+
+        queryset = export_queryset(self.now - timedelta(days=1), self.now)
+        chunked = b''.join(stream_json(queryset, ['co2'], chunk_size=2))
+        whole = b''.join(stream_json(queryset, ['co2']))
+        self.assertEqual(chunked, whole)
+        self.assertEqual(len(json.loads(chunked)), 5)
+        self.assertEqual(b''.join(stream_json(queryset.none(), ['co2'])), b'[]')
+
+    def test_no_data(self):
+        SensorData.objects.all().delete()
+        response = self.client.post(reverse('export_data'), {'format': 'csv', 'time_range': '7days'})
+        self.assertContains(response, 'No data found for the selected time range.')
+
+    def export_bytes(self, format_type, **extra):
+        response = self.client.post(reverse('export_data'), {'format': format_type, 'time_range': '7days', **extra})
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_gzip_exports_decompress_to_plain_exports(self):
+        for plain, compressed in (('csv', 'csv_gz'), ('json', 'json_gz')):
+            response, content = self.export_bytes(compressed)
+            self.assertEqual(response['Content-Type'], 'application/gzip')
+            self.assertIn(f'.{plain}.gz"', response['Content-Disposition'])
+            self.assertEqual(gzip.decompress(content).decode('utf-8'), self.export(plain))
+
+    def test_npz_export_is_columnar(self):
+        response, content = self.export_bytes('npz', sensor_types=['co2', 'temperature'])
+        self.assertIn('.npz"', response['Content-Disposition'])
+        with np.load(BytesIO(content)) as archive:
+            self.assertEqual(sorted(archive.files), ['co2', 'temperature', 'timestamp'])
+            self.assertEqual(archive['timestamp'].dtype, np.dtype('<i8'))
+            self.assertEqual(archive['co2'].dtype, np.dtype('<f4'))
+            expected = list(reversed(self.readings))
+            self.assertEqual(archive['timestamp'].tolist(),
+                             [int(r.timestamp.timestamp()) * 1_000_000 for r in expected])
+            self.assertEqual(archive['co2'].tolist(), [r.co2 for r in expected])
+            self.assertEqual(archive['temperature'].tolist(), [21.25] * 5)
+
+    def test_npz_spans_several_chunks(self):
+        from .export import export_queryset, write_npz
+
+        output = BytesIO()
+        write_npz(export_queryset(self.now - timedelta(days=1), self.now), ['pm2_5'], output, chunk_size=2)
+        output.seek(0)
+        with np.load(output) as archive:
+            self.assertEqual(archive['pm2_5'].tolist(), [2.5] * 5)
+            self.assertTrue((np.diff(archive['timestamp']) > 0).all())
+
+    @skipUnless(pq is not None, 'pyarrow is not installed')
+    def test_parquet_export(self):
+        response, content = self.export_bytes('parquet')
+        table = pq.read_table(BytesIO(content))
+        self.assertEqual(table.column_names, ['timestamp', 'temperature', 'humidity', 'co2', 'pm1_0', 'pm2_5', 'pm10_0'])
+        self.assertEqual(str(table.schema.field('co2').type), 'float')
+        self.assertEqual(table.column('co2').to_pylist(), [r.co2 for r in reversed(self.readings)])
+        self.assertEqual(table.column('timestamp').to_pylist()[0], self.readings[-1].timestamp)
+
+    def test_export_page_offers_formats(self):
+        response = self.client.get(reverse('export_data'))
+        for value in ('csv', 'json', 'csv_gz', 'json_gz', 'npz'):
+            self.assertContains(response, f'value="{value}"')
+        if pq is not None:
+            self.assertContains(response, 'value="parquet"')
+
+    def test_invalid_format(self):
+        response = self.client.post(reverse('export_data'), {'format': 'xls', 'time_range': '7days'})
+        self.assertContains(response, 'Invalid export format selected.')
+
+
+@skipUnless(os.environ.get('SENSOR_SLOW_TESTS'), 'Slow: set SENSOR_SLOW_TESTS=1 to run')
+@skipUnless(os.path.exists('/proc/self/statm'), 'Needs /proc to sample the resident set size')
+class StreamingExportMemoryTests(TestCase):
+    """Exporting a million rows keeps the resident set size flat"""
+
+    ROWS = 1_000_000
+    # Materialising the rows (or the file) would cost hundreds of megabytes
+    MAX_GROWTH_BYTES = 32 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='password123')
+        # Generated in SQL; building a million model instances here would defeat the test
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < {cls.ROWS - 1})
+                INSERT INTO {SensorData._meta.db_table} (timestamp, co2, humidity, temperature, pm1_0, pm2_5, pm10_0)
+                SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || (i + 60) || ' seconds'),
+                       400.0 + i % 600, 45.5, 21.5, 5.0, 8.0, 15.0
+                FROM seq
+            """)
+
+    @staticmethod
+    def resident_set_size():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def test_csv_export_memory_is_bounded(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('export_data'), {'format': 'csv', 'time_range': '30days'})
+        baseline = peak = self.resident_set_size()
+        lines = 0
+        for chunk in response.streaming_content:
+            lines += chunk.count(b'\n')
+            peak = max(peak, self.resident_set_size())
+        self.assertEqual(lines, self.ROWS + 1)
+        self.assertLess(peak - baseline, self.MAX_GROWTH_BYTES)
+
+
+class ExportJobTests(TestCase):
+    """Test background export jobs, progress polling and ranged downloads"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp(prefix='sensor_exports_')
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.start, self.end = now - timedelta(days=1), now
+        for i in range(5):
+            SensorData.objects.create(co2=400.0 + i, humidity=50.0, temperature=21.0,
+                                      pm1_0=1.0, pm2_5=2.0, pm10_0=3.0,
+                                      timestamp=now - timedelta(hours=i + 1))
+        self.runner = ExportJobRunner(workers=1)
+
+    def submit(self, format_type='csv', params=None):
+        return self.runner.submit(self.user, format_type, params or {'time_range': '24hours'},
+                                  self.start, self.end, list(EXPORT_FIELDS))
+
+    def test_identical_requests_share_a_job(self):
+        job, created = self.submit()
+        self.assertTrue(created)
+        again, created = self.submit()
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+        other, created = self.submit(format_type='json')
+        self.assertTrue(created)
+        self.assertNotEqual(other.pk, job.pk)
+
+    def test_run_writes_artifact_and_reports_progress(self):
+        job, _ = self.submit()
+        run_export_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.rows_written, job.rows_total), (5, 5))
+        self.assertTrue(os.path.exists(job.file.path))
+
+        status_response = self.client.get(reverse('export_job_status', args=[job.pk]))
+        payload = status_response.json()
+        self.assertEqual(payload['progress'], 1.0)
+        self.assertEqual(payload['download_url'], reverse('export_job_download', args=[job.pk]))
+
+        # A finished artifact is reused by identical requests
+        again, created = self.submit()
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+    def test_download_supports_ranges(self):
+        job, _ = self.submit()
+        run_export_job(job.pk)
+        url = reverse('export_job_download', args=[job.pk])
+        full = self.client.get(url)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        content = b''.join(full.streaming_content)
+        self.assertTrue(content.startswith(b'timestamp,temperature'))
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(partial.streaming_content), content[10:20])
+
+        suffix = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(suffix.streaming_content), content[-5:])
+
+        unsatisfiable = self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(unsatisfiable.status_code, 416)
+
+    def test_download_before_done_is_404(self):
+        job, _ = self.submit()
+        response = self.client.get(reverse('export_job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_background_post_returns_job(self):
+        with mock.patch('sensor_api.views.get_export_job_runner', return_value=self.runner):
+            response = self.client.post(reverse('export_data'),
+                                        {'format': 'npz', 'time_range': '24hours', 'background': '1'},
+                                        HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        payload = response.json()
+        self.assertEqual(payload['status'], 'pending')
+        self.assertEqual(payload['status_url'], reverse('export_job_status', args=[payload['id']]))
+
+
+class ExportJobWorkerTests(TransactionTestCase):
+    """The worker pool picks up committed jobs on its own thread"""
+
+    def test_worker_completes_job(self):
+        media = tempfile.mkdtemp(prefix='sensor_exports_')
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        SensorData.objects.create(co2=400.0, humidity=50.0, temperature=21.0, pm1_0=1.0, pm2_5=2.0, pm10_0=3.0)
+        runner = ExportJobRunner(workers=1)
+        now = timezone.now()
+        with self.settings(MEDIA_ROOT=media):
+            job, _ = runner.submit(None, 'json_gz', {'time_range': '24hours'},
+                                   now - timedelta(days=1), now + timedelta(seconds=1), ['co2'])
+            runner.shutdown(wait=True)
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'done')
+            with gzip.open(job.file.path) as f:
+                self.assertEqual([row['co2'] for row in json.load(f)], [400.0])
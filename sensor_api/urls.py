@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import SensorDataCreateAPIView, SensorDataListAPIView, export_data_view
+from .views import SensorDataCreateAPIView, SensorDataBatchCreateAPIView, SensorDataListAPIView, IngestStatsAPIView, sensor_stream_view, export_data_view, export_job_status_view, export_job_download_view
 
 urlpatterns = [
     path('sensor/', SensorDataCreateAPIView.as_view(), name='sensor-create'),
+    path('sensor/batch/', SensorDataBatchCreateAPIView.as_view(), name='sensor-batch-create'),
+    path('sensor/ingest/stats/', IngestStatsAPIView.as_view(), name='sensor-ingest-stats'),
     path('sensor/list/', SensorDataListAPIView.as_view(), name='sensor-list'),
+    path('sensor/stream/', sensor_stream_view, name='sensor-stream'),
     path('export/', export_data_view, name='export_data'),
+    path('export/jobs/<uuid:job_id>/', export_job_status_view, name='export_job_status'),
+    path('export/jobs/<uuid:job_id>/download/', export_job_download_view, name='export_job_download'),
 ] 
\ No newline at end of file
@@ -1,14 +1,32 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from rest_framework import status
-from .models import SensorData
-from .serializers import SensorDataSerializer
-import csv
-import json
-from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from .models import METRICS, SensorData, ExportJob
+from .serializers import SensorDataSerializer, SensorDataBatchItemSerializer, SerializedRows, serialize_rows
+from .renderers import ColumnarJSONRenderer, Float32ColumnsRenderer, SensorJSONRenderer
+from .live import get_reading_broker, parse_cursor, reading_stream
+from .conditional import not_modified_response, read_validator, set_validator_headers
+from .columnar import COLUMNAR_RENDER_FORMATS, TIMESTAMP_FORMATS, queryset_columns, rows_to_columns
+from .ingest import save_readings, get_ingest_buffer, get_buffer_settings, ACK_ON_ENQUEUE
+from .export import EXPORT_FORMATS, export_queryset, select_fields
+from .jobs import get_export_job_runner
+from .downsample import (DOWNSAMPLE_METHODS, MAX_POINTS_LIMIT, bucket_series, choose_bucket_seconds,
+                         lttb_series)
+import os
+import re
+import tempfile
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Max
 from datetime import timedelta, datetime
 
 # Create your views here.
@@ -19,30 +37,104 @@ class SensorDataCreateAPIView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]  # Allow anyone to send data
     
     def create(self, request, *args, **kwargs):
+        # A JSON array is treated as a batch upload
+        if isinstance(request.data, list):
+            return create_batch(request.data)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        buffer = get_ingest_buffer()
+        if buffer is not None:
+            return buffered_write_response(buffer, [serializer.validated_data], single=True)
         self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+class SensorDataBatchCreateAPIView(generics.GenericAPIView):
+    """Accept an array of readings and store them in one transaction"""
+    queryset = SensorData.objects.all()
+    serializer_class = SensorDataBatchItemSerializer
+    permission_classes = [permissions.AllowAny]  # Same policy as the single-reading endpoint
+
+    def post(self, request, *args, **kwargs):
+        return create_batch(request.data)
+
+def create_batch(data):
+    """
+    Validate a list of readings in one pass and write them with a single bulk_create.
+    Invalid batches are rejected as a whole; the error response is a list aligned
+    with the submitted items, with an empty object for every valid reading.
+    """
+    if not isinstance(data, list):
+        return Response({'detail': 'Expected a list of readings.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not data:
+        return Response({'detail': 'The batch is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+    max_size = getattr(settings, 'SENSOR_BATCH_MAX_SIZE', 5000)
+    if len(data) > max_size:
+        return Response({'detail': f'A batch may contain at most {max_size} readings.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = SensorDataBatchItemSerializer(data=data, many=True)
+    if not serializer.is_valid():
+        return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    buffer = get_ingest_buffer()
+    if buffer is not None:
+        return buffered_write_response(buffer, serializer.validated_data)
+    created = save_readings(serializer.validated_data)
+    return Response({'created': len(created)}, status=status.HTTP_201_CREATED)
+
+def buffered_write_response(buffer, readings, single=False):
+    """
+    Hand readings to the write-behind buffer and build the response for the
+    configured durability mode: 202 straight away for ack-on-enqueue, or 201
+    once the group commit containing these readings has finished.
+    """
+    pending = buffer.submit(readings)
+    if buffer.durability == ACK_ON_ENQUEUE:
+        return Response({'queued': len(readings)}, status=status.HTTP_202_ACCEPTED)
+
+    if not pending.wait(get_buffer_settings()['ACK_TIMEOUT_S']):
+        # Still queued; it will be written, we just stop waiting for it
+        return Response({'queued': len(readings)}, status=status.HTTP_202_ACCEPTED)
+    if pending.error is not None:
+        return Response({'detail': 'Failed to store sensor data.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if single:
+        return Response(SensorDataSerializer(pending.objects[0]).data, status=status.HTTP_201_CREATED)
+    return Response({'created': len(pending.objects)}, status=status.HTTP_201_CREATED)
+
+class IngestStatsAPIView(generics.GenericAPIView):
+    """Expose the write-behind buffer counters (queue depth, flush latency, ...)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        buffer = get_ingest_buffer()
+        if buffer is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, **buffer.stats()})
+
 class SensorDataListAPIView(generics.ListAPIView):
     serializer_class = SensorDataSerializer
     permission_classes = [permissions.IsAuthenticated]  # Only logged in users can view data
+    renderer_classes = [SensorJSONRenderer, BrowsableAPIRenderer, ColumnarJSONRenderer, Float32ColumnsRenderer]
     
-    def get_queryset(self):
+    def get_hours(self):
         # 获取时间范围参数，默认为24小时
         hours = self.request.query_params.get('hours', '24')
         
         try:
             # 将小时数转换为整数
-            hours = int(hours)
+            return int(hours)
         except ValueError:
             # 如果转换失败，默认为24小时
-            hours = 24
+            return 24
+    
+    def get_queryset(self):
+        hours = self.get_hours()
             
         # 计算开始时间
         end_date = timezone.now()
         start_date = end_date - timedelta(hours=hours)
+        self.window = (start_date, end_date)
         
         # 根据时间范围过滤数据
         queryset = SensorData.objects.filter(
@@ -50,14 +142,228 @@ class SensorDataListAPIView(generics.ListAPIView):
             timestamp__lte=end_date
         ).order_by('timestamp')
         
+        # Incremental polling: the cursor is the newest id seen when the response
+        # was built. Rows are capped at it so anything stored meanwhile is returned
+        # by the next request instead of being skipped. list() sets it from the
+        # validator so the rows match the ETag.
+        if getattr(self, 'next_cursor', None) is None:
+            self.next_cursor = SensorData.objects.aggregate(last=Max('id'))['last'] or 0
+        queryset = queryset.filter(id__lte=self.next_cursor)
+        
+        since = self.request.query_params.get('since')
+        if since:
+            if since.isdigit():
+                # Id cursor from a previous X-Next-Cursor header
+                queryset = queryset.filter(id__gt=int(since))
+            else:
+                # Timestamp cursor (ISO 8601); naive values are in the current timezone
+                since_date = parse_datetime(since.replace(' ', '+'))
+                if since_date is None:
+                    raise ValidationError({'since': 'Expected an id cursor or an ISO 8601 timestamp.'})
+                if timezone.is_naive(since_date):
+                    since_date = timezone.make_aware(since_date)
+                queryset = queryset.filter(timestamp__gt=since_date)
+        
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        # Unchanged since the client's copy: answer 304 before reading any rows
+        validator = read_validator(
+            (sorted(request.query_params.lists()), request.accepted_renderer.format),
+            window=timedelta(hours=self.get_hours()),
+        )
+        response = not_modified_response(request, validator.etag, validator.last_modified)
+        if response is not None:
+            return response
+        self.next_cursor = validator.latest_id
+        downsample = self.get_downsample_params()
+        columnar = self.get_columnar_params()
+        headers = {}
+        if downsample is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            if columnar is None:
+                # Same output as SensorDataSerializer(many=True), without a model instance per row
+                data = serialize_rows(queryset)
+            else:
+                data = queryset_columns(queryset, METRICS, **columnar)
+        else:
+            rows = self.downsampled_rows(headers=headers, **downsample)
+            data = SerializedRows(rows) if columnar is None else rows_to_columns(rows, METRICS, **columnar)
+        if columnar is not None:
+            headers['X-Columns'] = ','.join(data)
+            headers['X-Row-Count'] = str(data.row_count)
+        # Pass back as ?since= to receive only rows stored after this response
+        headers['X-Next-Cursor'] = str(self.next_cursor)
+        return set_validator_headers(Response(data, headers=headers), validator.etag, validator.last_modified,
+                                     vary=['Accept'])
+
+    def get_columnar_params(self):
+        """
+        None for the row format, else the options of ?format=columnar/binary:
+        ?timestamps=iso|epoch_ms (binary always sends epoch milliseconds).
+        """
+        render_format = self.request.accepted_renderer.format
+        if render_format not in COLUMNAR_RENDER_FORMATS:
+            return None
+        timestamps = self.request.query_params.get('timestamps', 'iso')
+        if timestamps not in TIMESTAMP_FORMATS:
+            raise ValidationError({'timestamps': f"Expected one of: {', '.join(TIMESTAMP_FORMATS)}."})
+        return {'epoch_ms': timestamps == 'epoch_ms' or render_format == 'binary'}
+
+    def get_downsample_params(self):
+        """
+        Parse ?bucket=<seconds>, ?max_points=<n>, ?method=bucket|lttb and
+        ?metric=<name> (LTTB only). Returns None when no downsampling was asked for.
+        """
+        params = self.request.query_params
+        if 'bucket' not in params and 'max_points' not in params:
+            return None
+        method = params.get('method', 'bucket')
+        if method not in DOWNSAMPLE_METHODS:
+            raise ValidationError({'method': f"Expected one of: {', '.join(DOWNSAMPLE_METHODS)}."})
+        bucket = max_points = None
+        if 'bucket' in params:
+            bucket = parse_int_param(params, 'bucket', 1, 31 * 24 * 3600)
+        if 'max_points' in params:
+            max_points = parse_int_param(params, 'max_points', 2, MAX_POINTS_LIMIT)
+        metric = params.get('metric', 'co2')
+        if metric not in METRICS:
+            raise ValidationError({'metric': f"Expected one of: {', '.join(METRICS)}."})
+        if method == 'lttb' and max_points is None:
+            raise ValidationError({'max_points': 'Required for method=lttb.'})
+        return {'method': method, 'bucket': bucket, 'max_points': max_points, 'metric': metric}
+
+    def downsampled_rows(self, method, bucket, max_points, metric, headers):
+        queryset = self.get_queryset()
+        headers['X-Downsample'] = method
+        if method == 'lttb':
+            return lttb_series(queryset, max_points, metric)
+        start, end = self.window
+        width = bucket or choose_bucket_seconds(start, end, max_points)
+        headers['X-Bucket-Seconds'] = str(width)
+        # Rollups only describe the whole window, not an incremental slice of it
+        if self.request.query_params.get('since'):
+            return bucket_series(queryset, width)
+        return bucket_series(queryset, width, start, end)
+
+async def sensor_stream_view(request):
+    """
+    Server-Sent Events stream of newly ingested readings (see live.py).
+
+    Resumes after the Last-Event-ID header or ?since=<cursor>. Needs the ASGI
+    server: under WSGI the stream would tie up a worker thread per client, so
+    it answers 503 and the dashboard keeps polling the list API instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': 'The live stream is only served by the ASGI application.'}, status=503)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+    cursor = parse_cursor(request.headers.get('Last-Event-ID'))
+    if cursor is None:
+        cursor = parse_cursor(request.GET.get('since'))
+    response = StreamingHttpResponse(reading_stream(get_reading_broker(), cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tell nginx not to buffer the stream
+    return response
+
+def parse_int_param(params, name, minimum, maximum):
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
+    if not minimum <= value <= maximum:
+        raise ValidationError({name: f'Expected a value between {minimum} and {maximum}.'})
+    return value
+
+def render_export_page(request, error=None, job=None):
+    """Export options page, offering Parquet only when pyarrow is installed"""
+    return render(request, 'sensor_api/export_data.html', {
+        'error': error,
+        'job': job,
+        'parquet_available': 'parquet' in EXPORT_FORMATS,
+    })
+
+def export_job_payload(job):
+    payload = {
+        'id': str(job.pk),
+        'status': job.status,
+        'format': job.format,
+        'rows_written': job.rows_written,
+        'rows_total': job.rows_total,
+        'progress': round(job.progress, 4),
+        'status_url': reverse('export_job_status', args=[job.pk]),
+        'download_url': None,
+        'size': job.size,
+        'error': job.error or None,
+    }
+    if job.status == 'done':
+        payload['download_url'] = reverse('export_job_download', args=[job.pk])
+    return payload
+
+@login_required
+def export_job_status_view(request, job_id):
+    """Progress of a background export, polled by the export page"""
+    job = get_object_or_404(ExportJob, pk=job_id)
+    return JsonResponse(export_job_payload(job))
+
+@login_required
+def export_job_download_view(request, job_id):
+    """Serve a finished export, honouring single byte-range requests so downloads can resume"""
+    job = get_object_or_404(ExportJob, pk=job_id, status='done')
+    if not job.file or not default_storage.exists(job.file.name):
+        raise Http404('Export file has expired')
+    filename = os.path.basename(job.file.name)
+    return ranged_file_response(request, default_storage.path(job.file.name),
+                                EXPORT_FORMATS[job.format]['content_type'], filename)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def ranged_file_response(request, path, content_type, filename):
+    """
+    FileResponse for the whole file, or a 206 Partial Content response for a
+    single `Range: bytes=start-end` request; multi-range requests get the whole file.
+    """
+    size = os.path.getsize(path)
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if not match or match.groups() == ('', ''):
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        output = open(path, 'rb')
+        output.seek(start)
+        response = StreamingHttpResponse(_read_range(output, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _read_range(fileobj, length, block_size=64 * 1024):
+    with fileobj:
+        while length > 0:
+            data = fileobj.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
 
 @login_required
 def export_data_view(request):
     """Process sensor data export functionality"""
     if request.method == 'GET':
         # Display export options page
-        return render(request, 'sensor_api/export_data.html')
+        return render_export_page(request)
     
     elif request.method == 'POST':
         format_type = request.POST.get('format', 'csv')
@@ -80,93 +386,43 @@ def export_data_view(request):
                 start_date = datetime.strptime(start_date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
                 end_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
             except ValueError:
-                return render(request, 'sensor_api/export_data.html', {
-                    'error': 'Invalid date format. Please use YYYY-MM-DD format.'
-                })
+                return render_export_page(request, 'Invalid date format. Please use YYYY-MM-DD format.')
         else:
             start_date = end_date - timedelta(days=7)  # Default to 7 days
         
         # Query data for specified time range
-        sensor_data = SensorData.objects.filter(
-            timestamp__gte=start_date,
-            timestamp__lte=end_date
-        ).order_by('timestamp')
+        sensor_data = export_queryset(start_date, end_date)
         
-        if not sensor_data:
-            return render(request, 'sensor_api/export_data.html', {
-                'error': 'No data found for the selected time range.'
-            })
+        if not sensor_data.exists():
+            return render_export_page(request, 'No data found for the selected time range.')
         
-        # Export data based on selected format
-        if format_type == 'csv':
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename="sensor_data_{start_date.strftime("%Y%m%d")}_to_{end_date.strftime("%Y%m%d")}.csv"'
-            
-            writer = csv.writer(response)
-            
-            # Decide which fields to include
-            fields = ['timestamp']
-            if 'all' in sensor_types or 'temperature' in sensor_types:
-                fields.append('temperature')
-            if 'all' in sensor_types or 'humidity' in sensor_types:
-                fields.append('humidity')
-            if 'all' in sensor_types or 'co2' in sensor_types:
-                fields.append('co2')
-            if 'all' in sensor_types or 'pm1_0' in sensor_types:
-                fields.append('pm1_0')
-            if 'all' in sensor_types or 'pm2_5' in sensor_types:
-                fields.append('pm2_5')
-            if 'all' in sensor_types or 'pm10_0' in sensor_types:
-                fields.append('pm10_0')
-            
-            # Write header row
-            writer.writerow(fields)
-            
-            # Write data rows
-            for data in sensor_data:
-                row = [data.timestamp.strftime('%Y-%m-%d %H:%M:%S')]
-                if 'all' in sensor_types or 'temperature' in sensor_types:
-                    row.append(data.temperature)
-                if 'all' in sensor_types or 'humidity' in sensor_types:
-                    row.append(data.humidity)
-                if 'all' in sensor_types or 'co2' in sensor_types:
-                    row.append(data.co2)
-                if 'all' in sensor_types or 'pm1_0' in sensor_types:
-                    row.append(data.pm1_0)
-                if 'all' in sensor_types or 'pm2_5' in sensor_types:
-                    row.append(data.pm2_5)
-                if 'all' in sensor_types or 'pm10_0' in sensor_types:
-                    row.append(data.pm10_0)
-                writer.writerow(row)
-                
-            return response
-            
-        elif format_type == 'json':
-            data_list = []
-            
-            for data in sensor_data:
-                data_dict = {'timestamp': data.timestamp.strftime('%Y-%m-%d %H:%M:%S')}
-                
-                if 'all' in sensor_types or 'temperature' in sensor_types:
-                    data_dict['temperature'] = data.temperature
-                if 'all' in sensor_types or 'humidity' in sensor_types:
-                    data_dict['humidity'] = data.humidity
-                if 'all' in sensor_types or 'co2' in sensor_types:
-                    data_dict['co2'] = data.co2
-                if 'all' in sensor_types or 'pm1_0' in sensor_types:
-                    data_dict['pm1_0'] = data.pm1_0
-                if 'all' in sensor_types or 'pm2_5' in sensor_types:
-                    data_dict['pm2_5'] = data.pm2_5
-                if 'all' in sensor_types or 'pm10_0' in sensor_types:
-                    data_dict['pm10_0'] = data.pm10_0
-                
-                data_list.append(data_dict)
-            
-            response = HttpResponse(json.dumps(data_list, indent=4), content_type='application/json')
-            response['Content-Disposition'] = f'attachment; filename="sensor_data_{start_date.strftime("%Y%m%d")}_to_{end_date.strftime("%Y%m%d")}.json"'
-            return response
+        # Decide which fields to include
+        fields = select_fields(sensor_types)
+        filename = f'sensor_data_{start_date.strftime("%Y%m%d")}_to_{end_date.strftime("%Y%m%d")}'
+        
+        export_format = EXPORT_FORMATS.get(format_type)
+        if export_format is None:
+            return render_export_page(request, 'Invalid export format selected.')
+        
+        # Background mode: queue (or reuse) an export job and let the client poll it
+        if request.POST.get('background'):
+            params = {'time_range': time_range}
+            if time_range == 'custom':
+                params.update(start_date=request.POST.get('start_date', ''), end_date=request.POST.get('end_date', ''))
+            job, created = get_export_job_runner().submit(request.user, format_type, params, start_date, end_date, fields)
+            if 'application/json' in request.headers.get('Accept', ''):
+                return JsonResponse(export_job_payload(job), status=202)
+            return render_export_page(request, job=job)
         
+        # Text formats are streamed in chunks rather than built in memory; columnar
+        # formats are written to a temporary file that is then streamed back
+        if 'stream' in export_format:
+            response = StreamingHttpResponse(export_format['stream'](sensor_data, fields),
+                                             content_type=export_format['content_type'])
         else:
-            return render(request, 'sensor_api/export_data.html', {
-                'error': 'Invalid export format selected.'
-            })
+            output = tempfile.TemporaryFile()
+            export_format['write'](sensor_data, fields, output)
+            output.seek(0)
+            response = FileResponse(output, content_type=export_format['content_type'])
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format["extension"]}"'
+        return response